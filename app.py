@@ -2,45 +2,376 @@
 Flask web application for the Weather API POC
 """
 import os
+import sys
 import json
+import queue
+import signal
+import time
 import traceback
-from flask import Flask, request, jsonify, render_template
-from dotenv import load_dotenv
-from weather_api.flow import process_weather_query
 
-# Load environment variables
-load_dotenv()
+_import_start = time.perf_counter()
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
+from weather_api import flow
+from weather_api.flow import run_weather_query
+from weather_api.structured import build_structured_response
+from weather_api import (admission, alerts, export, httpcache, jsonutil, mcp_server, payloads, policies, prefetch,
+                         profiling, sessions, snapshot, startup, subscriptions, summary_router, tenants, upstream)
+startup.record("imports", (time.perf_counter() - _import_start) * 1000)
 
 # Create Flask app
 app = Flask(__name__)
 
+# Reload cached data from the last run, then keep snapshotting it
+with startup.phase("snapshot_restore"):
+    snapshot.start_snapshots()
+
+# Keep the hottest locations warm in the weather cache
+prefetch.start_prefetcher()
+
+# Model Context Protocol endpoints (/mcp, /mcp/sse, /mcp/messages)
+mcp_server.register(app)
+
+# Build the OpenAI client and upstream HTTP session before reporting ready
+startup.start_prewarm()
+
+@app.before_request
+def start_profile():
+    """Profile API requests selected by header, sample rate or an armed admin request"""
+    trigger = profiling.select(request.headers) if request.path.startswith('/api/') else None
+    if trigger is not None:
+        g.profile = profiling.start(f"{request.method} {request.full_path.rstrip('?')}", trigger)
+
+@app.after_request
+def finish_profile(response):
+    """Store the request's profile and tell the client where to find it"""
+    started = g.pop('profile', None)
+    if started is not None:
+        profile, token = started
+        profiling.finish(profile, token, response.status_code)
+        response.headers['X-Profile-Id'] = profile.id
+    return response
+
+@app.teardown_request
+def abandon_profile(error=None):
+    """Close a profile whose request failed before a response was made"""
+    started = g.pop('profile', None)
+    if started is not None:
+        profiling.finish(*started, status=500)
+
 @app.route('/')
 def index():
     """Render the main page with the query form"""
     return render_template('index.html')
 
+def _is_false(value):
+    """Interpret a JSON or query-string flag as False"""
+    return value is False or str(value).lower() in ('false', '0', 'no')
+
+def authenticate_tenant():
+    """
+    Identify the request's tenant and take a request token
+    
+    Returns:
+        (tenant, None) if the request may run - the tenant is None when no
+        tenants are configured - or (None, error response)
+    """
+    if not tenants.registry.enabled:
+        return None, None
+    tenant = tenants.registry.authenticate(request.headers)
+    if tenant is None:
+        return None, (jsonify({"error": "Missing or invalid API key"}), 401)
+    retry_after = tenant.admit()
+    if retry_after is not None:
+        response = jsonify({"error": f"Request quota exceeded for tenant '{tenant.name}'"})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return None, response
+    return tenant, None
+
+def answer_weather_query(data):
+    """
+    Answer a weather query with HTTP caching headers
+    
+    A request whose If-None-Match still matches the data behind the last
+    answer gets a 304 without running the flow. Requests that are part of a
+    session (``session_id``, or ``session: true`` to start one) depend on
+    earlier turns, so they are never cached. Neither are answers degraded
+    by admission control.
+    
+    With tenants configured, the request needs a tenant API key, counts
+    against the tenant's quotas and reads through the tenant's cache
+    namespace. Cacheable answers are then ``private``, so shared caches
+    never hand one tenant's answer to another client.
+    """
+    tenant, refused = authenticate_tenant()
+    if refused is not None:
+        return refused
+    
+    query = data.get('query', '')
+    provider = data.get('provider', 'api')  # Default to API if not specified
+    
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+    
+    # Validate provider
+    if provider not in ['api', 'mcp']:
+        return jsonify({"error": "Invalid provider. Must be 'api' or 'mcp'"}), 400
+    
+    # Validate response format
+    response_format = data.get('format', 'text')
+    if response_format not in ['text', 'structured']:
+        return jsonify({"error": "Invalid format. Must be 'text' or 'structured'"}), 400
+    
+    options = {"summary": not _is_false(data.get('summary', True))}
+    if response_format == 'structured':
+        options.update({"structured": True, "text": not _is_false(data.get('text', True))})
+    
+    session_id = data.get('session_id')
+    in_session = session_id or (data.get('session') is not None and not _is_false(data.get('session')))
+    
+    namespace = tenant.cache if tenant is not None else None
+    # Keys and validators are per cache namespace, like the data behind them
+    with upstream.cache_namespace(namespace):
+        key = httpcache.request_key(query, provider, options)
+        if request.if_none_match and not in_session:
+            etag, max_age = httpcache.revalidate(key)
+            if etag and request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag, weak=True)
+                response.cache_control.public = True
+                response.cache_control.max_age = max_age
+                return _tenant_scoped(response, tenant)
+    
+    # Under load, skip the AI summary, then upstream, then reject outright
+    start = time.perf_counter()
+    try:
+        with admission.controller.admit() as stage:
+            if stage == 'normal' and options['summary'] and tenant is not None and not tenant.take_summary():
+                stage = 'no_summary'
+            degraded = admission.degrade_options(options, stage)
+            with upstream.cache_namespace(namespace), tenants.acting_for(tenant):
+                if in_session:
+                    response = answer_in_session(session_id, query, provider, degraded, response_format, stage)
+                else:
+                    response = answer_from_flow(key, query, provider, degraded, response_format, stage)
+    except admission.OverloadedError as e:
+        response = jsonify({"error": str(e), "degradation": "reject"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        stage = 'reject'
+    if tenant is not None:
+        tenant.record_latency(time.perf_counter() - start)
+    response.headers['X-Degradation'] = stage
+    return _tenant_scoped(response, tenant)
+
+def _tenant_scoped(response, tenant):
+    """Keep answers to authenticated requests out of shared caches"""
+    if tenant is not None and response.cache_control.public:
+        response.cache_control.public = False
+        response.cache_control.private = True
+    return response
+
+def _degradation_fields(stage):
+    """Body fields reporting a degraded answer (none at normal load)"""
+    return {} if stage == 'normal' else {"degradation": stage}
+
+def _has_error(shared):
+    """Whether the flow failed or any payload it answered from is an error"""
+    if shared.get("error") or shared.get("error_message"):
+        return True
+    return any(policies.describe_error(shared.get(kind))
+               for kind in ("current_weather", "forecast", "historical_weather", "mcp_weather"))
+
+def answer_from_flow(key, query, provider, options, response_format, stage='normal'):
+    """Run the flow for a query and build a cacheable response"""
+    shared = run_weather_query(query, provider, options)
+    
+    if response_format == 'structured':
+        # Typed fields, serialized exactly once
+        body = jsonutil.dumps({**build_structured_response(shared), **_degradation_fields(stage)})
+        response = Response(body, mimetype='application/json')
+    else:
+        final_response = shared.get("final_response", "Sorry, I couldn't process your weather query.")
+        response = jsonify({"response": final_response, **_degradation_fields(stage)})
+    
+    # Degraded answers must not be reused once load is back to normal
+    if stage != 'normal':
+        response.cache_control.no_store = True
+        return response
+    etag, max_age = httpcache.remember(key, shared.get("upstream_trace", []))
+    if etag and not _has_error(shared):
+        response.set_etag(etag, weak=True)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_store = True
+    return response
+
+def answer_in_session(session_id, query, provider, options, response_format, stage='normal'):
+    """Answer a query as the next turn of a conversation session"""
+    session_id, context = sessions.load(session_id)
+    shared = run_weather_query(query, provider, options, session=context)
+    sessions.save(session_id, context, shared)
+    
+    if response_format == 'structured':
+        body = jsonutil.dumps({**build_structured_response(shared), "session_id": session_id,
+                               **_degradation_fields(stage)})
+        response = Response(body, mimetype='application/json')
+    else:
+        final_response = shared.get("final_response", "Sorry, I couldn't process your weather query.")
+        response = jsonify({"response": final_response, "session_id": session_id, **_degradation_fields(stage)})
+    response.cache_control.no_store = True
+    return response
+
 @app.route('/api/weather', methods=['POST'])
 def weather_api():
     """API endpoint for weather queries"""
     try:
-        data = request.get_json()
-        query = data.get('query', '')
-        provider = data.get('provider', 'api')  # Default to API if not specified
-        
-        if not query:
-            return jsonify({"error": "No query provided"}), 400
-        
-        # Validate provider
-        if provider not in ['api', 'mcp']:
-            return jsonify({"error": "Invalid provider. Must be 'api' or 'mcp'"}), 400
-        
-        response = process_weather_query(query, provider)
-        
-        return jsonify({"response": response})
+        return answer_weather_query(request.get_json())
     except Exception as e:
         traceback.print_exc()  # Print detailed error for debugging
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/weather', methods=['GET'])
+def weather_api_get():
+    """Cacheable GET variant of the weather endpoint (query in the URL)"""
+    try:
+        data = request.args.to_dict()
+        if 'q' in data and 'query' not in data:
+            data['query'] = data.pop('q')
+        return answer_weather_query(data)
+    except Exception as e:
+        traceback.print_exc()  # Print detailed error for debugging
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export', methods=['POST'])
+def export_api():
+    """
+    Stream weather rows for many locations as NDJSON or CSV
+
+    Rows are written as they are fetched, so the response starts straight
+    away and memory use doesn't grow with the size of the export. Every
+    location (every upstream batch for current conditions) counts as a
+    request against the tenant's quota, all charged before the export
+    starts; an export the quota can't cover right now gets a 429. Exports
+    can't be degraded, so they are only admitted while the service is at
+    the normal stage.
+    """
+    try:
+        tenant, refused = authenticate_tenant()
+        if refused is not None:
+            return refused
+        plan = export.plan_export(request.get_json() or {})
+        if "error" in plan:
+            return jsonify(plan), 400
+
+        # The export request itself paid for the first task
+        remaining = export.task_count(plan) - 1
+        limit = tenant.max_requests() if tenant is not None else None
+        if limit is not None and remaining + 1 > limit:
+            return jsonify({"error": f"Export needs {remaining + 1} requests but tenant '{tenant.name}' "
+                                     f"can spend at most {int(limit)} at once; split it into smaller exports"}), 429
+
+        try:
+            admission.controller.acquire(normal_only=True)
+        except admission.OverloadedError as e:
+            response = jsonify({"error": str(e), "degradation": "reject"})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+
+        retry_after = tenant.admit(remaining) if tenant is not None and remaining else None
+        if retry_after is not None:
+            admission.controller.release()
+            response = jsonify({"error": f"Request quota exceeded for tenant '{tenant.name}'"})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
+        rows = export.export_rows(plan, namespace=tenant.cache if tenant is not None else None)
+        response = Response(stream_with_context(export.encode(plan, rows)), mimetype=export.FORMATS[plan['format']])
+        # In flight until the last row is sent (or the client goes away)
+        response.call_on_close(admission.controller.release)
+        if plan['format'] == 'csv':
+            response.headers['Content-Disposition'] = 'attachment; filename="weather-export.csv"'
+        response.cache_control.no_store = True
+        return response
+    except Exception as e:
+        traceback.print_exc()  # Print detailed error for debugging
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/subscribe')
+def subscribe_api():
+    """
+    Stream current conditions for locations as Server-Sent Events
+
+    ``GET /api/subscribe?locations=London,Paris`` sends the latest
+    observation of each location, then an ``observation`` event whenever
+    one changes upstream. A subscription counts as a single request against
+    the tenant's quota.
+    """
+    tenant, refused = authenticate_tenant()
+    if refused is not None:
+        return refused
+    locations = [location.strip() for location in request.args.get('locations', '').split(',') if location.strip()]
+    if not locations:
+        return jsonify({"error": "No locations provided"}), 400
+    if len(locations) > subscriptions.SUBSCRIPTION_MAX_LOCATIONS:
+        return jsonify({"error": f"Subscriptions are limited to {subscriptions.SUBSCRIPTION_MAX_LOCATIONS} locations"}), 400
+
+    hub = subscriptions.get_hub()
+    subscriber = hub.subscribe(locations)
+
+    def events():
+        try:
+            while True:
+                try:
+                    event = subscriber.events.get(timeout=subscriptions.SUBSCRIPTION_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                name = 'error' if 'error' in event else 'observation'
+                yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            hub.unsubscribe(subscriber)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/alerts', methods=['POST'])
+def create_alert():
+    """Register a threshold alert rule"""
+    tenant, refused = authenticate_tenant()
+    if refused is not None:
+        return refused
+    rule = alerts.engine.add(request.get_json(silent=True) or {}, owner=tenant.name if tenant else None)
+    if "error" in rule:
+        return jsonify(rule), 400
+    return jsonify(rule), 201
+
+@app.route('/api/alerts/<rule_id>', methods=['GET'])
+def get_alert(rule_id):
+    """A rule and its last notification"""
+    tenant, refused = authenticate_tenant()
+    if refused is not None:
+        return refused
+    rule = alerts.engine.get(rule_id, owner=tenant.name if tenant else None)
+    if rule is None:
+        return jsonify({"error": "Unknown alert rule"}), 404
+    return jsonify(rule)
+
+@app.route('/api/alerts/<rule_id>', methods=['DELETE'])
+def delete_alert(rule_id):
+    """Remove a threshold alert rule"""
+    tenant, refused = authenticate_tenant()
+    if refused is not None:
+        return refused
+    if not alerts.engine.remove(rule_id, owner=tenant.name if tenant else None):
+        return jsonify({"error": "Unknown alert rule"}), 404
+    return Response(status=204)
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
@@ -49,7 +380,89 @@ def health():
         'service': 'weather-api-poc'
     })
 
+@app.route('/ready')
+def ready():
+    """Readiness check: 503 until startup pre-warming has finished"""
+    stats = startup.get_stats()
+    if not stats['ready']:
+        response = jsonify({'status': 'warming', 'startup': stats})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    return jsonify({'status': 'ready', 'startup': stats})
+
+def _profiling_refused():
+    """Error response unless profiling is on and the request carries its token"""
+    if not profiling.authorized(request.headers.get('X-Profile-Token')):
+        return jsonify({"error": "Profiling is disabled, no profile token is configured or the token is invalid"}), 403
+    return None
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Summaries of the stored request profiles, newest first"""
+    refused = _profiling_refused()
+    if refused is not None:
+        return refused
+    return jsonify({"profiles": profiling.list_profiles(), "stats": profiling.get_stats()})
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """
+    Download a profile as collapsed stacks for flamegraph.pl or speedscope
+
+    ``?format=json`` returns the summary and wall-clock breakdown instead.
+    """
+    refused = _profiling_refused()
+    if refused is not None:
+        return refused
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        return jsonify({"error": "Unknown profile"}), 404
+    if request.args.get('format') == 'json':
+        return jsonify(profile.summary())
+    response = Response(profile.folded(), mimetype='text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename="profile-{profile.id}.folded"'
+    return response
+
+@app.route('/admin/profiles/arm', methods=['POST'])
+def arm_profiler():
+    """Profile the next ``count`` API requests (0 disarms)"""
+    refused = _profiling_refused()
+    if refused is not None:
+        return refused
+    count = (request.get_json(silent=True) or {}).get('count', 1)
+    if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+        return jsonify({"error": "count must be a non-negative integer"}), 400
+    return jsonify({"armed": profiling.arm(count)})
+
+@app.route('/metrics')
+def metrics():
+    """Cache, upstream, prefetch, session, coalescing, node policy, payload memory, startup, admission,
+    tenant, export, subscription, alert, summary routing, profiling and MCP statistics"""
+    return jsonify({
+        'startup': startup.get_stats(),
+        'admission': admission.get_stats(),
+        'tenants': tenants.get_stats(),
+        'cache': upstream.weather_cache.stats(),
+        'upstream': upstream.get_stats(),
+        'prefetch': prefetch.get_stats(),
+        'snapshot': snapshot.get_stats(),
+        'sessions': sessions.get_stats(),
+        'coalescing': flow.get_stats(),
+        'node_policies': policies.get_stats(),
+        'payloads': payloads.get_stats(),
+        'exports': export.get_stats(),
+        'subscriptions': subscriptions.get_stats(),
+        'alerts': alerts.get_stats(),
+        'summary_routing': summary_router.get_stats(),
+        'profiling': profiling.get_stats(),
+        'mcp': mcp_server.get_stats()
+    })
+
 if __name__ == '__main__':
+    # Exit cleanly on SIGTERM (sent on deploys) so the final cache snapshot is written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     # Get port from environment or use default
     port = int(os.environ.get('PORT', 5001))
     
@@ -0,0 +1,75 @@
+"""
+Benchmark and check of bulk current-conditions batching
+
+Runs N concurrent current-conditions lookups for different places against
+a local WeatherAPI.com stand-in, once with bulk mode off and once with it
+on. Places are given as coordinates, as flows look them up once the
+location is resolved, so no search request staggers the lookups. Reports the upstream requests each mode made and its wall-clock
+time. With bulk mode on, N lookups within WEATHERAPI_BULK_MAX_LOCATIONS must
+go out as a single q=bulk POST; the script exits non-zero if they don't.
+
+Usage:
+    python -m benchmarks.bench_bulk [--lookups 32] [--latency-ms 50]
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+from benchmarks.bench_payloads import SyntheticWeatherAPI
+from weather_api import upstream
+
+
+def run(mode, lookups):
+    SyntheticWeatherAPI.calls.clear()
+    upstream.BULK_ENABLED = mode == "bulk"
+    start_together = threading.Barrier(lookups)
+
+    # Far enough apart not to share a geo cache cell, and apart per mode
+    offset = 10 if mode == "bulk" else -10
+
+    def lookup(index):
+        start_together.wait()
+        return upstream.cached_fetch("current.json", f"{offset + index * 0.5:.2f},{offset:.2f}", aqi="no")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=lookups) as pool:
+        results = list(pool.map(lookup, range(lookups)))
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for result in results if not isinstance(result, dict) or "current" not in result)
+    return dict(SyntheticWeatherAPI.calls), failed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lookups", type=int, default=32, help="concurrent current-conditions lookups")
+    parser.add_argument("--latency-ms", type=float, default=50, help="synthetic upstream latency")
+    args = parser.parse_args()
+    if args.lookups > upstream.BULK_MAX_LOCATIONS:
+        parser.error(f"--lookups must be at most WEATHERAPI_BULK_MAX_LOCATIONS ({upstream.BULK_MAX_LOCATIONS})")
+
+    SyntheticWeatherAPI.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyntheticWeatherAPI)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    upstream.WEATHERAPI_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    upstream.WEATHERAPI_KEY = upstream.WEATHERAPI_KEY or "bench"
+
+    print(f"{args.lookups} concurrent lookups, upstream latency {args.latency_ms:.0f} ms")
+    print(f"{'mode':<10}{'GETs':>6}{'bulk POSTs':>12}{'failed':>8}{'ms':>9}")
+    ok = True
+    for mode in ("single", "bulk"):
+        calls, failed, elapsed = run(mode, args.lookups)
+        gets, posts = calls.get("current.json", 0), calls.get("current.json bulk", 0)
+        print(f"{mode:<10}{gets:>6}{posts:>12}{failed:>8}{elapsed * 1000:>9.1f}")
+        if failed:
+            ok = False
+    if posts != 1 or gets:
+        print(f"FAIL: expected 1 bulk POST and no GETs, got {posts} POSTs and {gets} GETs")
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
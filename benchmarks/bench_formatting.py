@@ -0,0 +1,99 @@
+"""
+Microbenchmark of the response formatting stage
+
+Times the API and MCP formatters on synthetic WeatherAPI.com payloads,
+both uncached (no data version) and memoized (versioned cached payload).
+
+Usage:
+    python -m benchmarks.bench_formatting [--number 20000]
+"""
+import argparse
+import copy
+import timeit
+from weather_api.utils import (
+    format_current_weather_for_user,
+    format_forecast_for_user,
+    format_historical_for_user
+)
+from weather_api.nodes import ResponseFormatterNode
+
+
+def make_day(date):
+    return {
+        "date": date,
+        "day": {
+            "maxtemp_c": 22.1, "maxtemp_f": 71.8, "mintemp_c": 12.4, "mintemp_f": 54.3,
+            "avgtemp_c": 17.0, "maxwind_mph": 10.5, "maxwind_kph": 16.9,
+            "totalprecip_mm": 1.2, "totalprecip_in": 0.05, "avghumidity": 65,
+            "daily_chance_of_rain": 40, "daily_chance_of_snow": 0,
+            "condition": {"text": "Partly cloudy"}
+        },
+        "astro": {"sunrise": "07:00 AM", "sunset": "06:10 PM"}
+    }
+
+
+def make_payloads():
+    dates = ["2026-10-19", "2026-10-20", "2026-10-21"]
+    current = {
+        "location": {"name": "Seattle", "region": "Washington", "country": "USA"},
+        "current": {
+            "temp_c": 14.0, "temp_f": 57.2, "condition": {"text": "Light rain"},
+            "humidity": 82, "wind_mph": 8.1, "wind_kph": 13.0, "wind_dir": "SW",
+            "feelslike_c": 12.9, "feelslike_f": 55.2, "uv": 2.0, "vis_miles": 9.0
+        }
+    }
+    forecast = {"location": current["location"], "forecast": {"forecastday": [make_day(d) for d in dates]}}
+    historical = {"location": current["location"], "forecast": {"forecastday": [make_day(dates[0])]}}
+    mcp = {
+        "location": "Seattle", "region": "Washington", "country": "USA",
+        "current_conditions": {
+            "temperature": {"value": 14.0, "unit": "C"}, "weather_text": "Light rain",
+            "relative_humidity": 82, "precipitation": 0.4,
+            "wind": {"speed": 13.0, "direction": "SW"}, "observation_time": "2026-10-19 09:45"
+        },
+        "forecast": [
+            {"date": d, "max_temp_c": 22.1, "min_temp_c": 12.4, "condition": "Partly cloudy",
+             "chance_of_rain": 40, "chance_of_snow": 0}
+            for d in dates
+        ]
+    }
+    return current, forecast, historical, mcp
+
+
+def versioned(payload, version):
+    payload = copy.deepcopy(payload)
+    payload["data_version"] = version
+    return payload
+
+
+def cases(current, forecast, historical, mcp):
+    node = ResponseFormatterNode()
+    return [
+        ("api current", lambda: format_current_weather_for_user(current, "Seattle")),
+        ("api tomorrow", lambda: format_forecast_for_user(forecast, "Seattle", "tomorrow")),
+        ("api week", lambda: format_forecast_for_user(forecast, "Seattle", "week")),
+        ("api historical", lambda: format_historical_for_user(historical, "Seattle")),
+        ("mcp current", lambda: node._format_mcp_current(mcp)),
+        ("mcp tomorrow", lambda: node._format_mcp_tomorrow(mcp)),
+        ("mcp week", lambda: node._format_mcp_week(mcp)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=20000, help="calls per case")
+    args = parser.parse_args()
+
+    payloads = make_payloads()
+    uncached = cases(*payloads)
+    memoized = cases(*(versioned(p, -(i + 1)) for i, p in enumerate(payloads)))
+
+    print(f"{'case':<16}{'uncached us':>14}{'memoized us':>14}")
+    for (name, cold), (_, warm) in zip(uncached, memoized):
+        cold_us = min(timeit.repeat(cold, number=args.number, repeat=3)) / args.number * 1e6
+        warm_us = min(timeit.repeat(warm, number=args.number, repeat=3)) / args.number * 1e6
+        print(f"{name:<16}{cold_us:>14.2f}{warm_us:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark of forecast payload decoding
+
+Decodes synthetic 3/7/14-day WeatherAPI.com forecasts (24 hourly records
+per day) with the full json/orjson decoders and the projected decoders the
+upstream client uses. Reports CPU time per request, peak memory while
+decoding and memory retained by the result. The encoded payload is not
+counted; buffered decoders also need it in memory in full, the streaming
+decoder only a read buffer.
+
+Usage:
+    python -m benchmarks.bench_jsonstream [--number 50]
+"""
+import argparse
+import io
+import json
+import time
+import tracemalloc
+from weather_api import jsonstream
+from weather_api.upstream import PROJECTIONS
+
+HOUR = {
+    "time_epoch": 1792400400, "temp_c": 14.2, "temp_f": 57.6,
+    "is_day": 1, "condition": {"text": "Patchy rain nearby", "icon": "//cdn.weatherapi.com/weather/64x64/day/176.png", "code": 1063},
+    "wind_mph": 8.3, "wind_kph": 13.3, "wind_degree": 224, "wind_dir": "SW",
+    "pressure_mb": 1012.0, "pressure_in": 29.88, "precip_mm": 0.12, "precip_in": 0.0,
+    "snow_cm": 0.0, "humidity": 81, "cloud": 77, "feelslike_c": 12.9, "feelslike_f": 55.2,
+    "windchill_c": 12.9, "windchill_f": 55.2, "heatindex_c": 14.2, "heatindex_f": 57.6,
+    "dewpoint_c": 10.9, "dewpoint_f": 51.7, "will_it_rain": 1, "chance_of_rain": 72,
+    "will_it_snow": 0, "chance_of_snow": 0, "vis_km": 10.0, "vis_miles": 6.0,
+    "gust_mph": 12.1, "gust_kph": 19.5, "uv": 1.0
+}
+
+
+def make_forecast(days):
+    forecastday = []
+    for index in range(days):
+        date = f"2026-10-{19 + index:02d}"
+        forecastday.append({
+            "date": date, "date_epoch": 1792368000 + index * 86400,
+            "day": {
+                "maxtemp_c": 16.1, "maxtemp_f": 61.0, "mintemp_c": 10.2, "mintemp_f": 50.4,
+                "avgtemp_c": 13.0, "avgtemp_f": 55.4, "maxwind_mph": 11.2, "maxwind_kph": 18.0,
+                "totalprecip_mm": 3.1, "totalprecip_in": 0.12, "totalsnow_cm": 0.0,
+                "avgvis_km": 9.4, "avgvis_miles": 5.0, "avghumidity": 83,
+                "daily_will_it_rain": 1, "daily_chance_of_rain": 87,
+                "daily_will_it_snow": 0, "daily_chance_of_snow": 0,
+                "condition": {"text": "Moderate rain", "icon": "//cdn.weatherapi.com/weather/64x64/day/302.png", "code": 1189},
+                "uv": 1.0
+            },
+            "astro": {"sunrise": "07:35 AM", "sunset": "06:12 PM", "moonrise": "03:02 AM",
+                      "moonset": "04:55 PM", "moon_phase": "Waning Crescent", "moon_illumination": 12},
+            "hour": [dict(HOUR, time=f"{date} {hour:02d}:00") for hour in range(24)]
+        })
+    return {
+        "location": {"name": "Seattle", "region": "Washington", "country": "United States of America",
+                     "lat": 47.61, "lon": -122.33, "tz_id": "America/Los_Angeles",
+                     "localtime_epoch": 1792400000, "localtime": "2026-10-19 10:00"},
+        "current": dict(HOUR, last_updated="2026-10-19 09:45"),
+        "forecast": {"forecastday": forecastday},
+        "alerts": {"alert": []}
+    }
+
+
+def decoders(projection):
+    cases = [
+        ("json full", lambda raw: json.loads(raw)),
+        ("json+project", lambda raw: jsonstream.project(json.loads(raw), projection)),
+    ]
+    if jsonstream.orjson is not None:
+        cases.append(("orjson full", lambda raw: jsonstream.orjson.loads(raw)))
+        cases.append(("orjson+project", lambda raw: jsonstream.loads(raw, projection)))
+    if jsonstream.streaming_available():
+        cases.append(("ijson stream", lambda raw: jsonstream.parse(io.BytesIO(raw), projection)))
+    return cases
+
+
+def measure(decode, raw, number):
+    start = time.process_time()
+    for _ in range(number):
+        decode(raw)
+    cpu_ms = (time.process_time() - start) / number * 1000
+
+    tracemalloc.start()
+    result = decode(raw)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return cpu_ms, peak / 1024, retained / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=50, help="decodes per case")
+    args = parser.parse_args()
+
+    projection = PROJECTIONS["forecast.json"]
+    print(f"{'days':<6}{'case':<16}{'cpu ms':>10}{'peak KiB':>12}{'kept KiB':>12}")
+    for days in (3, 7, 14):
+        raw = json.dumps(make_forecast(days)).encode("utf-8")
+        print(f"{days:<6}payload {len(raw) / 1024:.0f} KiB")
+        for name, decode in decoders(projection):
+            cpu_ms, peak, retained = measure(decode, raw, args.number)
+            print(f"{'':<6}{name:<16}{cpu_ms:>10.2f}{peak:>12.0f}{retained:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Benchmark of per-request payload memory under concurrent load
+
+Runs weather flows (API forecasts and MCP weather, structured responses
+with an AI summary) concurrently against a local server standing in for
+WeatherAPI.com and the OpenAI chat completions API, once with payload
+release on and once with it off. The summary's latency is when a request
+holds its payloads longest.
+Each mode runs in a fresh process and reports the growth of its peak RSS
+during the load, the payload memory a request held at its peak and at the
+end of its flow, and throughput. The weather cache is kept small and every
+request asks about a new location, so payloads aren't shared between
+requests through the cache.
+
+Usage:
+    python -m benchmarks.bench_payloads [--requests 1000] [--concurrency 64] [--summary-ms 500]
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from benchmarks.bench_jsonstream import make_forecast
+
+
+class SyntheticWeatherAPI(BaseHTTPRequestHandler):
+    """
+    WeatherAPI.com and OpenAI stand-in: every location exists and has the
+    same weather at its own coordinates (so the geo cache keeps them
+    apart), and every summary is the same. Bulk current-conditions
+    requests (``q=bulk`` POSTs) are answered too. Requests are counted per
+    endpoint in ``calls``, bulk ones as "current.json bulk".
+    """
+
+    latency = 0.0
+    summary_latency = 0.0
+    calls: Counter = Counter()
+    _calls_lock = threading.Lock()
+
+    @staticmethod
+    def _place(location, name):
+        # A stable, distinct spot for every name
+        spot = zlib.crc32(name.encode("utf-8"))
+        return dict(location, name=name, lat=round(spot % 18000 / 100 - 90, 2),
+                    lon=round(spot // 18000 % 36000 / 100 - 180, 2))
+
+    def _count(self, name):
+        with self._calls_lock:
+            self.calls[name] += 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        name = query.get("q", ["Seattle"])[0]
+        days = int(query.get("days", ["1"])[0])
+        payload = make_forecast(days)
+        payload["location"] = self._place(payload["location"], name)
+        if url.path.endswith("/search.json"):
+            location = payload["location"]
+            body = [{"name": name, "region": location["region"], "country": location["country"],
+                     "lat": location["lat"], "lon": location["lon"]}]
+        elif url.path.endswith("/current.json"):
+            body = {"location": payload["location"], "current": payload["current"]}
+        else:
+            body = payload
+        self._count(url.path.rsplit("/", 1)[-1])
+        time.sleep(self.latency)
+        self._reply(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path.endswith("/current.json") and parse_qs(url.query).get("q") == ["bulk"]:
+            self._count("current.json bulk")
+            current = make_forecast(1)
+            results = []
+            for location in json.loads(data).get("locations", []):
+                place = self._place(current["location"], location.get("q") or "")
+                results.append({"query": {"custom_id": location.get("custom_id"), "q": location.get("q"),
+                                          "location": place, "current": current["current"]}})
+            time.sleep(self.latency)
+            self._reply({"bulk": results})
+            return
+        self._count("chat.completions")
+        time.sleep(self.summary_latency)
+        self._reply({
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+            "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "Mild and damp all week.\n\nBring a jacket."}}],
+            "usage": {"prompt_tokens": 400, "completion_tokens": 60, "total_tokens": 460}
+        })
+
+    def _reply(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def child(args):
+    SyntheticWeatherAPI.latency = args.latency_ms / 1000
+    SyntheticWeatherAPI.summary_latency = args.summary_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyntheticWeatherAPI)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    from weather_api import jsonutil, payloads, upstream
+    from weather_api.flow import run_weather_query
+    from weather_api.structured import build_structured_response
+    upstream.WEATHERAPI_BASE_URL = base_url
+
+    def request(index):
+        provider = "mcp" if index % 2 else "api"
+        query = f"What's the weather this week in City{index}?"
+        shared = run_weather_query(query, provider, {"structured": True})
+        return len(jsonutil.dumps(build_structured_response(shared)))
+
+    # The flow prints debug output for every request
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        request(-1)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(request, range(args.requests)))
+        elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stats = payloads.get_stats()
+    print(json.dumps({
+        "rss_growth_mib": (rss_after - rss_before) / 1024,
+        "rss_peak_mib": rss_after / 1024,
+        "avg_peak_kib": stats["avg_peak_bytes"] / 1024,
+        "avg_final_kib": stats["avg_final_bytes"] / 1024,
+        "requests_per_second": args.requests / elapsed
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=1000, help="flows per mode")
+    parser.add_argument("--concurrency", type=int, default=64, help="flows running at once")
+    parser.add_argument("--latency-ms", type=float, default=20, help="synthetic upstream latency")
+    parser.add_argument("--summary-ms", type=float, default=500, help="synthetic completion latency")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    env = dict(os.environ, WEATHER_CACHE_MAX_ENTRIES="64", LOCATION_CACHE_MAX_ENTRIES="64",
+               HISTORY_STORE_ENABLED="false", CACHE_SNAPSHOT_ENABLED="false", PREFETCH_ENABLED="false",
+               WEATHERAPI_KEY="bench", OPENAI_API_KEY="bench", SUMMARY_ROUTER_LOG="false",
+               PAYLOAD_ACCOUNTING_ENABLED="true",
+               NODE_POLICY_MAX_WORKERS=str(args.concurrency * 2))
+    print(f"{args.requests} flows, {args.concurrency} concurrent, upstream latency {args.latency_ms:.0f} ms, "
+          f"summary latency {args.summary_ms:.0f} ms")
+    print(f"{'release':<10}{'RSS growth MiB':>16}{'RSS peak MiB':>14}{'peak KiB/req':>14}"
+          f"{'final KiB/req':>15}{'req/s':>8}")
+    for release in ("true", "false"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_payloads", "--child", "--requests", str(args.requests),
+             "--concurrency", str(args.concurrency), "--latency-ms", str(args.latency_ms),
+             "--summary-ms", str(args.summary_ms)],
+            env=dict(env, PAYLOAD_RELEASE_ENABLED=release), capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{release:<10}{result['rss_growth_mib']:>16.1f}{result['rss_peak_mib']:>14.1f}"
+              f"{result['avg_peak_kib']:>14.1f}{result['avg_final_kib']:>15.1f}"
+              f"{result['requests_per_second']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
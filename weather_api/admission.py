@@ -0,0 +1,226 @@
+"""
+Admission control with staged degradation under load
+
+Load is the larger of two ratios: requests in flight against a limit, and
+recent flow latency (a percentile, once there are enough samples) against a
+target. Time spent in the AI summary is left out of the latency (see
+exclude()): the first stage skips the summary, so counting it would make
+the service swing between stages as summaries switch on and off. As load rises, requests are answered more cheaply instead of
+queueing until everything times out:
+
+    normal        full answer
+    no_summary    skip the OpenAI summary          (load >= summary_off)
+    cache_only    cached or stale data, no summary (load >= cache_only)
+    reject        503 with Retry-After             (load >= 1.0)
+
+Slow answers alone degrade to cache_only at most. Only saturation of the
+in-flight limit rejects requests, so a few slow summaries at idle can't
+turn every following request away.
+
+Work that can't be degraded, such as a bulk export, is only admitted at
+the normal stage and rejected otherwise. It counts as in flight for as
+long as it streams, without adding its duration to the latency samples.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from .settings import settings
+
+# Requests allowed in flight before new ones are rejected
+ADMISSION_MAX_IN_FLIGHT = settings.get_int("ADMISSION_MAX_IN_FLIGHT", 64)
+# Flow latency percentile over the window that counts as full load, and the
+# samples needed before latency counts at all
+ADMISSION_TARGET_LATENCY_MS = settings.get_float("ADMISSION_TARGET_LATENCY_MS", 6000)
+ADMISSION_LATENCY_PERCENTILE = settings.get_float("ADMISSION_LATENCY_PERCENTILE", 75)
+ADMISSION_MIN_SAMPLES = settings.get_int("ADMISSION_MIN_SAMPLES", 5)
+ADMISSION_WINDOW_SECONDS = settings.get_float("ADMISSION_WINDOW_SECONDS", 10)
+# Load at which the AI summary is skipped, and at which upstream is skipped
+ADMISSION_SUMMARY_OFF_LOAD = settings.get_float("ADMISSION_SUMMARY_OFF_LOAD", 0.5)
+ADMISSION_CACHE_ONLY_LOAD = settings.get_float("ADMISSION_CACHE_ONLY_LOAD", 0.75)
+ADMISSION_RETRY_AFTER_SECONDS = settings.get_int("ADMISSION_RETRY_AFTER_SECONDS", 2)
+
+STAGES = ("normal", "no_summary", "cache_only", "reject")
+
+# Milliseconds of the admitted request's time that don't count as latency
+_excluded_ms: ContextVar[Optional[List[float]]] = ContextVar("admission_excluded_ms", default=None)
+
+
+class OverloadedError(Exception):
+    """Raised when a request is rejected to shed load"""
+
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(f"Service overloaded, retry in {retry_after}s")
+
+
+class AdmissionController:
+    """Tracks in-flight requests and recent latency to pick a degradation stage"""
+
+    def __init__(self, max_in_flight: int, target_latency_ms: float, window_seconds: float,
+                 summary_off_load: float, cache_only_load: float, retry_after: int,
+                 latency_percentile: float = ADMISSION_LATENCY_PERCENTILE,
+                 min_samples: int = ADMISSION_MIN_SAMPLES):
+        """
+        Args:
+            max_in_flight: Requests in flight that count as full load
+            target_latency_ms: Latency percentile that counts as full load
+            window_seconds: How long latency samples are remembered
+            summary_off_load: Load from which the AI summary is skipped
+            cache_only_load: Load from which only cached data is served
+            retry_after: Retry-After seconds sent with rejections
+            latency_percentile: Percentile of recent latencies compared
+                with the target
+            min_samples: Recent samples needed before latency counts
+        """
+        self.max_in_flight = max_in_flight
+        self.target_latency_ms = target_latency_ms
+        self.window_seconds = window_seconds
+        self.summary_off_load = summary_off_load
+        self.cache_only_load = cache_only_load
+        self.retry_after = retry_after
+        self.latency_percentile = latency_percentile
+        self.min_samples = min_samples
+        self.in_flight = 0
+        self._latencies: Deque[Tuple[float, float]] = deque()
+        self._lock = threading.Lock()
+        self.counts = {stage: 0 for stage in STAGES}
+
+    def _recent_latency_ms(self, now: float) -> float:
+        # Caller holds the lock. Samples age out, so a quiet period (or one
+        # spent rejecting) brings the service back to normal.
+        while self._latencies and self._latencies[0][0] < now - self.window_seconds:
+            self._latencies.popleft()
+        if len(self._latencies) < self.min_samples:
+            return 0.0
+        samples = sorted(ms for _, ms in self._latencies)
+        index = min(len(samples) - 1, int(len(samples) * self.latency_percentile / 100))
+        return samples[index]
+
+    def _load(self, in_flight: int, now: float) -> float:
+        # Latency can degrade answers but never reject them on its own
+        latency_load = min(self._recent_latency_ms(now) / self.target_latency_ms, self.cache_only_load)
+        return max(in_flight / self.max_in_flight, latency_load)
+
+    def _stage(self, load: float) -> str:
+        if load >= 1.0:
+            return "reject"
+        if load >= self.cache_only_load:
+            return "cache_only"
+        if load >= self.summary_off_load:
+            return "no_summary"
+        return "normal"
+
+    def acquire(self, normal_only: bool = False) -> str:
+        """
+        Admit a request until release() is called
+
+        Args:
+            normal_only: Reject the request unless the stage is normal
+
+        Returns:
+            The stage the request should be answered at
+
+        Raises:
+            OverloadedError: If the request is rejected
+        """
+        now = time.monotonic()
+        with self._lock:
+            stage = self._stage(self._load(self.in_flight + 1, now))
+            if normal_only and stage != "normal":
+                stage = "reject"
+            self.counts[stage] += 1
+            if stage == "reject":
+                raise OverloadedError(self.retry_after)
+            self.in_flight += 1
+        return stage
+
+    def release(self, started: Optional[float] = None, excluded_ms: float = 0.0) -> None:
+        """
+        End a request admitted by acquire()
+
+        Args:
+            started: time.monotonic() when it was admitted, to record its
+                latency (None records nothing)
+            excluded_ms: Time to leave out of the recorded latency
+        """
+        end = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if started is not None:
+                self._latencies.append((end, max((end - started) * 1000 - excluded_ms, 0.0)))
+
+    @contextmanager
+    def admit(self) -> Iterator[str]:
+        """
+        Admit a request for the duration of the block
+
+        Yields:
+            The stage the request should be answered at
+
+        Raises:
+            OverloadedError: If the request is rejected
+        """
+        stage = self.acquire()
+        excluded = [0.0]
+        token = _excluded_ms.set(excluded)
+        start = time.monotonic()
+        try:
+            yield stage
+        finally:
+            _excluded_ms.reset(token)
+            self.release(start, excluded[0])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            load = self._load(self.in_flight, now)
+            return {
+                "stage": self._stage(load),
+                "load": round(load, 3),
+                "in_flight": self.in_flight,
+                "recent_latency_ms": round(self._recent_latency_ms(now), 2),
+                "requests_by_stage": dict(self.counts)
+            }
+
+
+def exclude(elapsed_ms: float) -> None:
+    """
+    Leave time spent by the current request out of its admission latency
+
+    Args:
+        elapsed_ms: Milliseconds spent in a stage load shedding removes
+            (the AI summary)
+    """
+    excluded = _excluded_ms.get()
+    if excluded is not None:
+        excluded[0] += elapsed_ms
+
+
+def degrade_options(options: Dict[str, Any], stage: str) -> Dict[str, Any]:
+    """
+    Response options for a request admitted at a degradation stage
+
+    Args:
+        options: Options the client asked for
+        stage: Stage from AdmissionController.admit()
+
+    Returns:
+        Options with the expensive parts switched off
+    """
+    if stage == "no_summary":
+        return {**options, "summary": False}
+    if stage == "cache_only":
+        return {**options, "summary": False, "cache_only": True}
+    return options
+
+
+controller = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_TARGET_LATENCY_MS, ADMISSION_WINDOW_SECONDS,
+                                 ADMISSION_SUMMARY_OFF_LOAD, ADMISSION_CACHE_ONLY_LOAD,
+                                 ADMISSION_RETRY_AFTER_SECONDS, ADMISSION_LATENCY_PERCENTILE, ADMISSION_MIN_SAMPLES)
+
+
+def get_stats() -> Dict[str, Any]:
+    return controller.stats()
@@ -1,30 +1,64 @@
 """
 AI Summary Node for generating intelligent weather summaries using OpenAI
 """
-import os
 import json
+import hashlib
+import threading
+import time
 from typing import Dict, Any, Optional
 from pocketflow import BaseNode
-from openai import OpenAI
-from dotenv import load_dotenv
+from . import startup
+from .summary_router import COMPLETION_SETTINGS, router
+from .cache import TTLCache
+from .settings import settings
 
-# Load environment variables
-load_dotenv()
+# Summaries by (model, question, weather text). The text changes whenever
+# the underlying data does, so a short TTL is enough.
+AI_SUMMARY_CACHE_TTL = settings.get_int("AI_SUMMARY_CACHE_TTL", 600)
+summary_cache = TTLCache(max_entries=settings.get_int("AI_SUMMARY_CACHE_MAX_ENTRIES", 1024))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Shared OpenAI client, created on first use
+
+    Importing the OpenAI SDK takes most of a second, so it waits until the
+    first summary (or the startup pre-warm) needs it.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=settings.get('OPENAI_API_KEY'))
+    return _client
+
+
+def _prewarm_client() -> None:
+    if settings.get('OPENAI_API_KEY'):
+        get_client()
+
+
+startup.add_prewarm("openai_client", _prewarm_client)
+
+
+def summary_key(model: str, user_query: str, weather_response: str) -> str:
+    """Cache key for a summary of the given weather text"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model, " ".join(user_query.lower().split()), weather_response):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
 
 class AISummaryNode(BaseNode):
     """Node to generate AI-powered summaries of weather responses"""
     
     def __init__(self):
         super().__init__()
-        try:
-            self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            self.model = "gpt-4o-mini"  # Cost-effective small model
-            self.client_initialized = True
-        except Exception as e:
-            print(f"Warning: Failed to initialize OpenAI client: {e}")
-            self.client = None
-            self.client_initialized = False
-            self.model = "gpt-4o-mini"
+        self.model = "gpt-4o-mini"  # Cost-effective small model
     
     def prep(self, shared):
         """Prepare data for AI summary generation"""
@@ -33,15 +67,24 @@ class AISummaryNode(BaseNode):
             "final_response": shared.get("final_response", ""),
             "parameters": shared.get("parameters", {}),
             "provider": shared.get("provider", "api"),
+            "options": shared.get("options", {}),
+            # Only the payloads template answers read; the prompt is built
+            # from final_response
             "weather_data": {
                 "current_weather": shared.get("current_weather", {}),
-                "forecast": shared.get("forecast", {}),
-                "mcp_weather": shared.get("mcp_weather", {}),
-                "current_weather_response": shared.get("current_weather_response", ""),
-                "forecast_response": shared.get("forecast_response", "")
+                "forecast": shared.get("forecast", {})
             }
         }
     
+    def _create_short_prompt(self, user_query: str, weather_response: str) -> str:
+        """Create a prompt for a brief, direct answer"""
+        return f"""Answer the user's weather question directly in 1-2 sentences (under 40 words), using only the data below.
+
+User asked: "{user_query}"
+
+Weather Data Response:
+{weather_response}"""
+    
     def _create_summary_prompt(self, user_query: str, weather_response: str, weather_data: Dict[str, Any]) -> str:
         """Create a focused prompt for weather summary generation"""
         
@@ -73,32 +116,47 @@ Generate the response in this two-part format."""
 
         return prompt
     
-    def _generate_ai_summary(self, user_query: str, weather_response: str, weather_data: Dict[str, Any]) -> str:
+    def _generate_ai_summary(self, user_query: str, weather_response: str, weather_data: Dict[str, Any],
+                             route: Optional[Dict[str, Any]] = None) -> str:
         """Generate AI summary using OpenAI with error handling"""
+        route = route or {"strategy": "full", **COMPLETION_SETTINGS["full"]}
         try:
-            # Check if OpenAI client was initialized successfully
-            if not self.client_initialized or not self.client:
-                return "AI summary unavailable - OpenAI client initialization failed."
-            
             # Check if OpenAI API key is available
-            if not os.getenv('OPENAI_API_KEY'):
+            if not settings.get('OPENAI_API_KEY'):
                 return "AI summary unavailable - OpenAI API key not configured."
             
             if not weather_response or weather_response.strip() == "":
                 return "No weather data available to summarize."
             
-            prompt = self._create_summary_prompt(user_query, weather_response, weather_data)
+            try:
+                client = get_client()
+            except Exception as e:
+                print(f"Warning: Failed to initialize OpenAI client: {e}")
+                return "AI summary unavailable - OpenAI client initialization failed."
+            
+            if route["strategy"] == "short":
+                prompt = self._create_short_prompt(user_query, weather_response)
+            else:
+                prompt = self._create_summary_prompt(user_query, weather_response, weather_data)
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful weather assistant that provides concise, friendly weather summaries."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=200,
-                temperature=0.7,
-                timeout=10  # 10 second timeout
-            )
+            start = time.perf_counter()
+            try:
+                response = client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": "You are a helpful weather assistant that provides concise, friendly weather summaries."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=route["max_tokens"],
+                    temperature=route["temperature"],
+                    timeout=10  # 10 second timeout
+                )
+            except Exception:
+                # Failed and timed-out calls count towards the latency budget too
+                router.record(route["strategy"], time.perf_counter() - start)
+                raise
+            usage = getattr(response, "usage", None)
+            router.record(route["strategy"], time.perf_counter() - start, getattr(usage, "total_tokens", None))
             
             summary = response.choices[0].message.content.strip()
             return summary if summary else "Unable to generate weather summary."
@@ -123,12 +181,49 @@ Generate the response in this two-part format."""
         weather_response = prep_res["final_response"]
         weather_data = prep_res["weather_data"]
         
+        # Data-only requests skip the AI summary entirely
+        if not prep_res["options"].get("summary", True):
+            return {"ai_summary": None, "original_response": weather_response}
+        
+        # Pick skip / template / short / full from the query and current load
+        start = time.perf_counter()
+        route = router.choose(user_query, prep_res["parameters"], weather_response, weather_data,
+                              can_complete=bool(settings.get('OPENAI_API_KEY')))
+        ai_summary = None
+        if route["strategy"] in COMPLETION_SETTINGS:
+            # Reuse a summary made for the same question and data; the token
+            # budget is only charged for a completion actually requested
+            ai_summary = summary_cache.get(self._summary_key(route, user_query, weather_response))
+            if ai_summary is None:
+                route = router.reserve(route)
+        summary_route = {"strategy": route["strategy"], "reason": route["reason"]}
+        if route["strategy"] in ("skip", "template"):
+            router.record(route["strategy"], time.perf_counter() - start)
+            return {"ai_summary": route.get("answer"), "original_response": weather_response,
+                    "summary_route": summary_route}
+        
         # Generate AI summary
-        ai_summary = self._generate_ai_summary(user_query, weather_response, weather_data)
+        if ai_summary is None:
+            key = self._summary_key(route, user_query, weather_response)
+            ai_summary = self._generate_ai_summary(user_query, weather_response, weather_data, route)
+            if not ai_summary.startswith(("AI summary unavailable", "No weather data", "Unable to generate")):
+                summary_cache.set(key, ai_summary, AI_SUMMARY_CACHE_TTL)
         
         return {
             "ai_summary": ai_summary,
-            "original_response": weather_response
+            "original_response": weather_response,
+            "summary_route": summary_route
+        }
+    
+    def _summary_key(self, route, user_query, weather_response):
+        """Summary cache key for a completion route"""
+        return summary_key(f"{self.model}/{route['strategy']}", user_query, weather_response or "")
+    
+    def timeout_fallback(self, prep_res, error):
+        """Policy fallback: answer without a summary when OpenAI is too slow"""
+        return {
+            "ai_summary": "AI summary unavailable - service timeout.",
+            "original_response": prep_res["final_response"]
         }
     
     def post(self, shared, prep_res, exec_res):
@@ -138,6 +233,13 @@ Generate the response in this two-part format."""
         
         # Store AI summary in shared context
         shared["ai_summary"] = ai_summary
+        if "summary_route" in exec_res:
+            shared["summary_route"] = exec_res["summary_route"]
+        
+        # Structured responses carry the summary as its own field, so the
+        # text and summary are not serialized into final_response
+        if ai_summary is None or shared.get("options", {}).get("structured"):
+            return "success"
         
         # Check if AI summary generation failed
         if ai_summary.startswith("AI summary unavailable"):
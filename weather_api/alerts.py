@@ -0,0 +1,449 @@
+"""
+Threshold alert rules evaluated against incoming weather data
+
+A rule such as "chance of rain above 70 tomorrow in Seattle" is indexed by
+(location, day, field), where the location is the weather cache's key for
+the place (its geohash cell with the geo cache on). Each index keeps its
+thresholds sorted, one list per comparison. When a current.json or
+forecast.json payload is stored, by a query, the prefetch refresher, a live
+subscription or an export, only the indexes for its location are looked at. Each
+field's hourly column is reduced to its minimum and maximum once, and a
+binary search over the sorted thresholds returns every matching rule. The
+cost doesn't depend on how many rules other locations have.
+
+A rule fires at most once per (location-local) day. Notifications are kept
+on the rule and POSTed to its webhook if it has one. Rules belong to the
+tenant that created them; only that tenant can read or remove them. Webhooks
+may only point at ALERT_WEBHOOK_ALLOWED_HOSTS when that is set, and never at
+loopback, private or link-local addresses otherwise, so a rule can't make
+the service call into its own network. Deliveries connect to the address
+that passed this check, so the host can't be re-pointed in between.
+"""
+import bisect
+import ipaddress
+import operator
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from . import upstream
+from .settings import settings
+from .upstream import normalize_location
+
+ALERT_MAX_RULES = settings.get_int("ALERT_MAX_RULES", 100000)
+ALERT_WEBHOOK_TIMEOUT_SECONDS = settings.get_float("ALERT_WEBHOOK_TIMEOUT_SECONDS", 5)
+# Most recent notifications kept in memory
+ALERT_RECENT_NOTIFICATIONS = settings.get_int("ALERT_RECENT_NOTIFICATIONS", 1000)
+# Comma-separated hosts webhooks may be sent to; empty allows any public host
+ALERT_WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in
+                               (settings.get("ALERT_WEBHOOK_ALLOWED_HOSTS", "") or "").split(",") if host.strip()}
+
+# Fields of the "current" block rules can watch with when="now"
+CURRENT_FIELDS = ("temp_c", "feelslike_c", "wind_kph", "precip_mm", "humidity", "uv")
+# Hourly forecast fields, as MCPWeatherNode._get_forecast extracts them and
+# the forecast projection keeps them
+HOURLY_FIELDS = ("temp_c", "wind_kph", "precip_mm", "humidity", "chance_of_rain", "chance_of_snow")
+# Days ahead of the location's local date; None means current conditions
+WHEN = {"now": None, "today": 0, "tomorrow": 1}
+OPS = (">", ">=", "<", "<=")
+_COMPARE = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+_webhooks = ThreadPoolExecutor(max_workers=4, thread_name_prefix="alert-webhook")
+
+
+class AlertRule:
+    """One registered threshold rule and its last notification"""
+
+    __slots__ = ("id", "owner", "location", "location_id", "field", "op", "threshold", "when", "webhook",
+                 "last_fired", "notification")
+
+    def __init__(self, rule_id: str, location: str, location_id: str, field: str, op: str, threshold: float,
+                 when: str, webhook: Optional[str] = None, owner: Optional[str] = None):
+        self.id = rule_id
+        self.owner = owner
+        self.location = location
+        self.location_id = location_id
+        self.field = field
+        self.op = op
+        self.threshold = threshold
+        self.when = when
+        self.webhook = webhook
+        self.last_fired: Optional[str] = None
+        self.notification: Optional[Dict[str, Any]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "location": self.location, "field": self.field, "op": self.op,
+                "threshold": self.threshold, "when": self.when, "webhook": self.webhook,
+                "last_notification": self.notification}
+
+
+def resolve_webhook(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Check that a webhook URL may be called and pick the address to call
+
+    With ALERT_WEBHOOK_ALLOWED_HOSTS set, the host must be one of them.
+    Otherwise every address the host resolves to must be public.
+
+    Args:
+        url: Webhook URL
+
+    Returns:
+        (why the URL is refused, None) or (None, address to connect to);
+        the address is None for allow-listed hosts, which are trusted by name
+    """
+    parsed = urlparse(str(url))
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return "webhook must be an http(s) URL", None
+    host = parsed.hostname.lower()
+    if ALERT_WEBHOOK_ALLOWED_HOSTS:
+        if host not in ALERT_WEBHOOK_ALLOWED_HOSTS:
+            return f"webhook host '{host}' is not allowed", None
+        return None, None
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = sorted({info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)})
+    except (OSError, ValueError, UnicodeError):
+        return f"webhook host '{host}' does not resolve", None
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            return f"webhook host '{host}' resolves to a non-public address", None
+    return None, addresses[0]
+
+
+def webhook_error(url: str) -> Optional[str]:
+    """Why a webhook URL is refused, or None if it may be called"""
+    return resolve_webhook(url)[0]
+
+
+class _PinnedHostAdapter(HTTPAdapter):
+    """HTTPS adapter that connects by address but does SNI and certificate
+    checks against the webhook's host name"""
+
+    def __init__(self, hostname: str):
+        self.hostname = hostname
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["server_hostname"] = self.hostname
+        kwargs["assert_hostname"] = self.hostname
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _post_pinned(url: str, address: str, payload: Dict[str, Any]) -> requests.Response:
+    """
+    POST to a webhook through the address that was checked, so a host that
+    resolves differently on the next lookup (DNS rebinding) can't redirect
+    the request to an internal address
+
+    Args:
+        url: Webhook URL
+        address: Checked address of its host
+        payload: JSON body
+    """
+    parsed = urlparse(url)
+    port = f":{parsed.port}" if parsed.port else ""
+    hostname = parsed.hostname
+    target = parsed._replace(netloc=(f"[{address}]" if ":" in address else address) + port).geturl()
+    host_header = (f"[{hostname}]" if ":" in hostname else hostname) + port
+    with requests.Session() as session:
+        if parsed.scheme == "https":
+            session.mount("https://", _PinnedHostAdapter(hostname))
+        return session.post(target, json=payload, headers={"Host": host_header},
+                            timeout=ALERT_WEBHOOK_TIMEOUT_SECONDS, allow_redirects=False)
+
+
+def parse_rule(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate a rule definition
+
+    Args:
+        spec: {"location", "field", "op", "threshold", "when", "webhook"};
+            ``when`` is "now", "today" or "tomorrow" (default "now")
+
+    Returns:
+        Normalized rule fields, or {"error": message}
+    """
+    location = normalize_location(spec.get("location") or "")
+    if not location:
+        return {"error": "No location provided"}
+    when = spec.get("when", "now")
+    if when not in WHEN:
+        return {"error": "Invalid when. Must be 'now', 'today' or 'tomorrow'"}
+    fields = CURRENT_FIELDS if when == "now" else HOURLY_FIELDS
+    field = spec.get("field")
+    if field not in fields:
+        return {"error": f"Invalid field for when='{when}'. Must be one of: {', '.join(fields)}"}
+    op = spec.get("op", ">")
+    if op not in OPS:
+        return {"error": f"Invalid op. Must be one of: {', '.join(OPS)}"}
+    try:
+        threshold = float(spec["threshold"])
+    except (KeyError, TypeError, ValueError):
+        return {"error": "threshold must be a number"}
+    webhook = spec.get("webhook")
+    if webhook is not None:
+        error = webhook_error(webhook)
+        if error:
+            return {"error": error}
+    return {"location": location, "field": field, "op": op, "threshold": threshold, "when": when,
+            "webhook": webhook}
+
+
+class ThresholdIndex:
+    """Rules on one (location, when, field), sorted by threshold per operator"""
+
+    def __init__(self):
+        self._thresholds: Dict[str, List[float]] = {op: [] for op in OPS}
+        self._ids: Dict[str, List[str]] = {op: [] for op in OPS}
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._ids.values())
+
+    def add(self, rule: AlertRule) -> None:
+        thresholds = self._thresholds[rule.op]
+        position = bisect.bisect_right(thresholds, rule.threshold)
+        thresholds.insert(position, rule.threshold)
+        self._ids[rule.op].insert(position, rule.id)
+
+    def remove(self, rule: AlertRule) -> None:
+        thresholds, ids = self._thresholds[rule.op], self._ids[rule.op]
+        position = bisect.bisect_left(thresholds, rule.threshold)
+        while position < len(ids) and ids[position] != rule.id:
+            position += 1
+        if position < len(ids):
+            del thresholds[position]
+            del ids[position]
+
+    def matches(self, low: float, high: float) -> List[str]:
+        """
+        Rules triggered by values ranging from low to high
+
+        Args:
+            low: Smallest value (checked by "<" and "<=" rules)
+            high: Largest value (checked by ">" and ">=" rules)
+
+        Returns:
+            Ids of the matching rules
+        """
+        t = self._thresholds
+        return (self._ids[">"][:bisect.bisect_left(t[">"], high)]
+                + self._ids[">="][:bisect.bisect_right(t[">="], high)]
+                + self._ids["<"][bisect.bisect_right(t["<"], low):]
+                + self._ids["<="][bisect.bisect_left(t["<="], low):])
+
+
+def _value_range(values: List[Any]) -> Optional[Tuple[float, float]]:
+    numbers = [value for value in values if isinstance(value, (int, float))]
+    if not numbers:
+        return None
+    return min(numbers), max(numbers)
+
+
+def _value_ranges(endpoint: str, data: Dict[str, Any]) -> Dict[Tuple[str, str], Tuple[str, Tuple[float, float]]]:
+    """
+    Reduce a payload to the value range of every watchable field
+
+    Args:
+        endpoint: "current.json" or "forecast.json"
+        data: The payload
+
+    Returns:
+        {(when, field): (date, (min, max))}
+    """
+    place = data.get("location") or {}
+    # Local date at the location, so "tomorrow" means its tomorrow
+    local_date = str(place.get("localtime") or "")[:10] or date.today().isoformat()
+    ranges = {}
+    if endpoint == "current.json":
+        current = data.get("current") or {}
+        for field in CURRENT_FIELDS:
+            value = current.get(field)
+            if isinstance(value, (int, float)):
+                ranges[("now", field)] = (local_date, (value, value))
+        return ranges
+
+    days = {day.get("date"): day for day in (data.get("forecast") or {}).get("forecastday", [])}
+    for when, offset in WHEN.items():
+        if offset is None:
+            continue
+        day_date = (date.fromisoformat(local_date) + timedelta(days=offset)).isoformat()
+        hours = (days.get(day_date) or {}).get("hour") or []
+        # One pass per field over the day's hourly column
+        for field in HOURLY_FIELDS:
+            value_range = _value_range([hour.get(field) for hour in hours])
+            if value_range is not None:
+                ranges[(when, field)] = (day_date, value_range)
+    return ranges
+
+
+class AlertEngine:
+    """Registered rules and the per-location index they are evaluated through"""
+
+    def __init__(self, max_rules: int = ALERT_MAX_RULES):
+        self.max_rules = max_rules
+        self.rules: Dict[str, AlertRule] = {}
+        self._index: Dict[Tuple[str, str, str], ThresholdIndex] = {}
+        # (when, field) pairs with rules, per location
+        self._by_location: Dict[str, Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=ALERT_RECENT_NOTIFICATIONS)
+        self.counts = {"evaluations": 0, "rules_checked": 0, "fired": 0, "webhook_errors": 0}
+
+    def add(self, spec: Dict[str, Any], owner: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Register a rule and check it against any data already cached
+
+        Args:
+            spec: Rule definition (see parse_rule)
+            owner: Name of the tenant registering it (None without tenants)
+
+        Returns:
+            The rule as a dictionary, or {"error": message}
+        """
+        fields = parse_rule(spec)
+        if "error" in fields:
+            return fields
+        # Resolving a new place name costs one (cached) location search
+        location_id = upstream.history_location_id(fields["location"])
+        with self._lock:
+            if len(self.rules) >= self.max_rules:
+                return {"error": f"Rule limit of {self.max_rules} reached"}
+            # Ids can't be guessed, so they don't reveal other tenants' rules
+            rule = AlertRule(f"r{secrets.token_urlsafe(12)}", location_id=location_id, owner=owner, **fields)
+            self.rules[rule.id] = rule
+            index_key = (location_id, rule.when, rule.field)
+            self._index.setdefault(index_key, ThresholdIndex()).add(rule)
+            self._by_location.setdefault(location_id, set()).add((rule.when, rule.field))
+
+        if rule.when == "now":
+            cached = upstream.peek("current.json", rule.location, aqi="no")
+            endpoint = "current.json"
+        else:
+            cached = upstream.peek("forecast.json", rule.location, days=3, aqi="no", alerts="no")
+            endpoint = "forecast.json"
+        if isinstance(cached, dict) and "error" not in cached:
+            # Only the new rule; the others have seen this data already
+            ranges = _value_ranges(endpoint, cached)
+            if (rule.when, rule.field) in ranges:
+                day_date, (low, high) = ranges[(rule.when, rule.field)]
+                value = high if rule.op in (">", ">=") else low
+                if _COMPARE[rule.op](value, rule.threshold):
+                    with self._lock:
+                        self._fire(rule, day_date, low, high)
+                    if rule.webhook:
+                        _webhooks.submit(self._deliver, rule.webhook, rule.notification)
+        return rule.to_dict()
+
+    def remove(self, rule_id: str, owner: Optional[str] = None) -> bool:
+        """Remove one of ``owner``'s rules; False if it has no such rule"""
+        with self._lock:
+            rule = self.rules.get(rule_id)
+            if rule is None or rule.owner != owner:
+                return False
+            del self.rules[rule_id]
+            index_key = (rule.location_id, rule.when, rule.field)
+            index = self._index[index_key]
+            index.remove(rule)
+            if not len(index):
+                del self._index[index_key]
+                pairs = self._by_location[rule.location_id]
+                pairs.discard((rule.when, rule.field))
+                if not pairs:
+                    del self._by_location[rule.location_id]
+            return True
+
+    def get(self, rule_id: str, owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """One of ``owner``'s rules as a dictionary, or None"""
+        with self._lock:
+            rule = self.rules.get(rule_id)
+            return rule.to_dict() if rule is not None and rule.owner == owner else None
+
+    def evaluate(self, endpoint: str, location_id: str, data: Dict[str, Any]) -> int:
+        """
+        Check the rules a newly stored payload can affect
+
+        Args:
+            endpoint: "current.json" or "forecast.json" (others are ignored)
+            location_id: Cache-key location the payload was stored under
+            data: The payload
+
+        Returns:
+            Number of rules that fired
+        """
+        if endpoint not in ("current.json", "forecast.json"):
+            return 0
+        with self._lock:
+            watched = list(self._by_location.get(location_id, ()))
+        if not watched:
+            return 0
+        ranges = _value_ranges(endpoint, data)
+
+        fired = []
+        with self._lock:
+            self.counts["evaluations"] += 1
+            for when, field in watched:
+                if (when, field) not in ranges:
+                    continue
+                index = self._index.get((location_id, when, field))
+                if index is None:
+                    continue
+                day_date, (low, high) = ranges[(when, field)]
+                self.counts["rules_checked"] += len(index)
+                for rule_id in index.matches(low, high):
+                    rule = self.rules[rule_id]
+                    if rule.last_fired != day_date:
+                        self._fire(rule, day_date, low, high)
+                        fired.append(rule)
+        for rule in fired:
+            if rule.webhook:
+                _webhooks.submit(self._deliver, rule.webhook, rule.notification)
+        return len(fired)
+
+    def _fire(self, rule: AlertRule, day_date: str, low: float, high: float) -> None:
+        # Caller holds the lock
+        rule.last_fired = day_date
+        rule.notification = {
+            "rule_id": rule.id, "location": rule.location, "field": rule.field, "op": rule.op,
+            "threshold": rule.threshold, "when": rule.when, "date": day_date,
+            "value": high if rule.op in (">", ">=") else low, "fired_at": time.time()
+        }
+        self.recent.append(rule.notification)
+        self.counts["fired"] += 1
+
+    def _deliver(self, url: str, notification: Dict[str, Any]) -> None:
+        try:
+            # Checked again: the host may resolve differently than when the
+            # rule was added. The request then goes to the address checked.
+            error, address = resolve_webhook(url)
+            if error:
+                raise ValueError(error)
+            if address is None:
+                response = upstream.http_session().post(url, json=notification,
+                                                        timeout=ALERT_WEBHOOK_TIMEOUT_SECONDS, allow_redirects=False)
+            else:
+                response = _post_pinned(url, address, notification)
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Alert webhook {url} failed: {e}")
+            with self._lock:
+                self.counts["webhook_errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"rules": len(self.rules), "locations": len(self._by_location), **self.counts}
+
+
+engine = AlertEngine()
+upstream.add_store_listener(engine.evaluate)
+
+
+def get_stats() -> Dict[str, Any]:
+    return engine.stats()
@@ -0,0 +1,114 @@
+"""
+Micro-batching of per-location lookups into WeatherAPI.com bulk requests
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+# A pending lookup: the location query and the future its caller waits on
+Pending = Tuple[str, Future]
+
+
+class BulkBatcher:
+    """
+    Collects lookups for a short window and sends them as one bulk request.
+
+    WeatherAPI.com accepts ``q=bulk`` with a POST body of
+    ``{"locations": [{"q": ..., "custom_id": ...}, ...]}`` and answers with
+    ``{"bulk": [{"query": {"custom_id": ..., "q": ..., <payload>}}, ...]}``.
+    Lookups with different query parameters (e.g. aqi) go in separate
+    batches. Identical locations within a batch share one slot.
+    """
+
+    def __init__(self, send: Callable[[List[Dict[str, str]], Dict[str, Any]], Any],
+                 window: float = 0.02, max_batch: int = 50):
+        """
+        Args:
+            send: Callable taking (locations, params) and returning the
+                decoded bulk response; raises on transport errors
+            window: Seconds to wait for more lookups before sending
+            max_batch: Maximum locations per bulk request
+        """
+        self.send = send
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Hashable, List[Pending]] = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.locations = 0
+
+    def submit(self, location: str, params: Dict[str, Any]) -> Future:
+        """
+        Queue a lookup for the next bulk request
+
+        Args:
+            location: Location query
+            params: Extra query parameters shared by the batch
+
+        Returns:
+            Future resolving to the location's payload, or to an
+            upstream error payload ({"error": {...}}) for that location
+        """
+        params_key = tuple(sorted(params.items()))
+        ready = None
+        with self._lock:
+            batch = self._pending.get(params_key)
+            if batch is None:
+                batch = self._pending[params_key] = []
+                timer = threading.Timer(self.window, self._flush, args=(params_key, batch))
+                timer.daemon = True
+                timer.start()
+            normalized = " ".join(location.lower().split())
+            for queued_location, queued_future in batch:
+                if " ".join(queued_location.lower().split()) == normalized:
+                    return queued_future
+            future: Future = Future()
+            batch.append((location, future))
+            if len(batch) >= self.max_batch:
+                ready = self._pending.pop(params_key)
+        if ready is not None:
+            self._send_batch(ready, params)
+        return future
+
+    def _flush(self, params_key: Hashable, batch: List[Pending]) -> None:
+        with self._lock:
+            # The batch may already have been sent because it filled up
+            if self._pending.get(params_key) is not batch:
+                return
+            del self._pending[params_key]
+        self._send_batch(batch, dict(params_key))
+
+    def _send_batch(self, batch: List[Pending], params: Dict[str, Any]) -> None:
+        with self._lock:
+            self.batches += 1
+            self.locations += len(batch)
+        locations = [{"q": location, "custom_id": str(index)} for index, (location, _) in enumerate(batch)]
+        try:
+            response = self.send(locations, params)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        results: Dict[str, Dict[str, Any]] = {}
+        for item in (response or {}).get("bulk", []):
+            query = item.get("query", {})
+            results[str(query.get("custom_id"))] = query
+        for index, (location, future) in enumerate(batch):
+            result = results.get(str(index))
+            if result is None:
+                future.set_result({"error": {"message": f"No bulk result for '{location}'"}})
+            elif "error" in result:
+                future.set_result({"error": result["error"]})
+            else:
+                # Strip the echoed query fields, leaving the normal payload
+                future.set_result({k: v for k, v in result.items() if k not in ("custom_id", "q")})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batches, locations = self.batches, self.locations
+        return {
+            "batches": batches,
+            "locations": locations,
+            "locations_per_batch": round(locations / batches, 2) if batches else 0.0
+        }
@@ -0,0 +1,187 @@
+"""
+In-memory TTL cache for upstream weather payloads
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# Monotonic version counter shared by every cache so entries are globally unique
+_versions = itertools.count(1)
+_versions_lock = threading.Lock()
+
+
+def next_version() -> int:
+    """Allocate a new, globally unique data version"""
+    return next(_versions)
+
+
+def advance_versions(past: int) -> None:
+    """Make sure future versions are greater than ``past`` (e.g. restored ones)"""
+    global _versions
+    with _versions_lock:
+        current = next(_versions)
+        _versions = itertools.count(max(current, past + 1))
+
+
+class CacheEntry:
+    """A cached value with its freshness metadata"""
+    __slots__ = ("value", "stored_at", "expires_at", "version", "meta")
+
+    def __init__(self, value: Any, ttl: float, meta: Optional[Dict[str, Any]] = None,
+                 version: Optional[int] = None):
+        self.value = value
+        self.stored_at = time.time()
+        self.expires_at = self.stored_at + ttl
+        self.version = version if version is not None else next_version()
+        self.meta = meta or {}
+
+    @property
+    def age(self) -> float:
+        """Seconds since the value was stored"""
+        return time.time() - self.stored_at
+
+    @property
+    def ttl_remaining(self) -> float:
+        """Seconds until the value expires (negative once expired)"""
+        return self.expires_at - time.time()
+
+    def is_fresh(self) -> bool:
+        return self.ttl_remaining > 0
+
+    @classmethod
+    def restored(cls, value: Any, stored_at: float, expires_at: float, version: int,
+                 meta: Optional[Dict[str, Any]] = None) -> "CacheEntry":
+        """Rebuild an entry with its original timestamps (e.g. from a snapshot)"""
+        entry = cls.__new__(cls)
+        entry.value = value
+        entry.stored_at = stored_at
+        entry.expires_at = expires_at
+        entry.version = version
+        entry.meta = meta or {}
+        return entry
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a per-entry TTL.
+
+    Expired entries are kept until they are evicted so that background
+    refreshers can still see what used to be cached.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a fresh value from the cache
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.is_fresh():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def lookup(self, key: Hashable) -> Optional[CacheEntry]:
+        """
+        Get the entry for a key even if it has expired
+
+        Fresh entries count as hits, expired or missing ones as misses.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cache entry, or None if the key was never cached or was evicted
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.is_fresh():
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def get_entry(self, key: Hashable) -> Optional[CacheEntry]:
+        """Get the raw entry for a key, fresh or not, without touching stats"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: Hashable, value: Any, ttl: float,
+            meta: Optional[Dict[str, Any]] = None, version: Optional[int] = None) -> CacheEntry:
+        """
+        Store a value in the cache
+
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl: Time-to-live in seconds
+            meta: Optional metadata describing how the value was produced
+            version: Data version to record (allocated if omitted)
+
+        Returns:
+            The new cache entry
+        """
+        return self.put_entry(key, CacheEntry(value, ttl, meta, version))
+
+    def put_entry(self, key: Hashable, entry: CacheEntry) -> CacheEntry:
+        """Store a prebuilt entry, evicting the least recently used if full"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def entries(self, predicate: Optional[Callable[[Hashable, CacheEntry], bool]] = None
+                ) -> List[Tuple[Hashable, CacheEntry]]:
+        """
+        Snapshot the cache contents
+
+        Args:
+            predicate: Optional filter applied to each (key, entry) pair
+
+        Returns:
+            List of (key, entry) pairs
+        """
+        with self._lock:
+            items = list(self._entries.items())
+        if predicate is None:
+            return items
+        return [(key, entry) for key, entry in items if predicate(key, entry)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0
+        }
@@ -0,0 +1,128 @@
+"""
+Single-flight coalescing of identical in-flight work
+
+When many identical requests arrive together, the first one runs and the
+rest wait for its result instead of repeating the work (including the
+OpenAI call behind the AI summary).
+"""
+import importlib
+import re
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Sentence punctuation only: decimal points, minus signs and hyphens are
+# part of coordinates and place names ("40.7,-74.0", "Wilkes-Barre")
+_PUNCTUATION = re.compile(r"[?!'\"\u2018\u2019\u201c\u201d]|\.(?=\s|$)")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Default query normalization: case, whitespace and sentence punctuation
+    insensitive
+
+    "What's the weather in Paris?" and "whats the weather in  paris" coalesce;
+    "weather at 40.7,-74.0" and "weather at 40.7,74.0" don't.
+
+    Args:
+        query: User's natural language query
+
+    Returns:
+        Normalized query
+    """
+    return " ".join(_PUNCTUATION.sub("", str(query).lower()).split())
+
+
+def load_normalizer(path: str) -> Callable[[str], str]:
+    """
+    Import a normalization function from a "module:function" path
+
+    Args:
+        path: e.g. "myapp.text:canonical_query"
+
+    Returns:
+        The function
+    """
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers share it
+
+    Results are not kept once a call finishes, so this only merges work
+    that overlaps in time. A waiter that has waited ``wait_timeout`` seconds
+    stops waiting and runs the work itself, so one hung call can't hold up
+    every caller behind it.
+    """
+
+    def __init__(self, wait_timeout: Optional[float] = None):
+        """
+        Args:
+            wait_timeout: Seconds a caller waits for another caller's run
+                (None waits as long as it takes)
+        """
+        self.wait_timeout = wait_timeout
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+        self.wait_timeouts = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn for a key, or wait for the run already in flight
+
+        Args:
+            key: Identity of the work
+            fn: Function doing the work
+
+        Returns:
+            Tuple of (result, whether it came from another caller's run)
+            (False too when the wait timed out and the caller ran fn)
+
+        Raises:
+            Whatever fn raised, in the caller that ran it and in every waiter
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._calls[key] = Future()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            try:
+                return future.result(timeout=self.wait_timeout), True
+            except FutureTimeoutError:
+                with self._lock:
+                    self.wait_timeouts += 1
+                return fn(), False
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.executions + self.coalesced
+            return {
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "wait_timeouts": self.wait_timeouts,
+                "coalescing_ratio": round(self.coalesced / total, 4) if total else 0.0
+            }
@@ -0,0 +1,283 @@
+"""
+Streaming bulk export of weather data for many locations
+
+Rows are produced location by location, as NDJSON or CSV, straight from
+the normalized payloads (no text formatting, no AI summary). Data comes
+from the weather cache and the local history store first. A bounded window
+of locations is fetched at once, and only that window's rows are held in
+memory, so exports of any size stream in constant memory.
+
+Each task (one location of a daily export, one batch of a current export)
+counts as a request against the tenant's quota. The whole export is charged
+before it starts (see task_count), so it never waits on the quota while
+holding a worker and an admission slot.
+"""
+import csv
+import io
+import json
+import math
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+from . import upstream
+from .cache import TTLCache
+from .settings import settings
+from .structured import api_daily, api_observation
+from .utils import get_current_weather_many, get_forecast, get_historical_weather
+
+# Largest export accepted, and how many locations are fetched at once
+EXPORT_MAX_LOCATIONS = settings.get_int("EXPORT_MAX_LOCATIONS", 1000)
+EXPORT_MAX_DAYS = settings.get_int("EXPORT_MAX_DAYS", 31)
+EXPORT_CONCURRENCY = settings.get_int("EXPORT_CONCURRENCY", 4)
+# Current-conditions exports fetch this many locations per task, so bulk
+# mode can send them as one upstream request
+EXPORT_CURRENT_BATCH = settings.get_int("EXPORT_CURRENT_BATCH", 50)
+# WeatherAPI.com forecasts reach at most this many days ahead
+FORECAST_MAX_DAYS = 14
+
+PLACE_FIELDS = ["location", "name", "region", "country"]
+DAILY_FIELDS = PLACE_FIELDS + [
+    "date", "source", "condition", "max_temp_c", "max_temp_f", "min_temp_c", "min_temp_f",
+    "avg_temp_c", "avg_humidity", "total_precip_mm", "max_wind_kph", "chance_of_rain",
+    "chance_of_snow", "sunrise", "sunset", "error"
+]
+CURRENT_FIELDS = PLACE_FIELDS + [
+    "observed_at", "condition", "temp_c", "temp_f", "feelslike_c", "feelslike_f", "humidity",
+    "precip_mm", "wind_kph", "wind_mph", "wind_dir", "uv", "vis_miles", "error"
+]
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+_stats_lock = threading.Lock()
+_stats = {"exports": 0, "completed": 0, "cancelled": 0, "rows": 0, "error_rows": 0, "in_flight": 0}
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def plan_export(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate an export request
+
+    Args:
+        data: Request body with ``locations``, ``kind`` ("daily" or
+            "current"), ``start_date`` / ``end_date`` (daily only, YYYY-MM-DD)
+            and ``format`` ("ndjson" or "csv")
+
+    Returns:
+        Normalized export plan, or {"error": message}
+    """
+    locations = data.get("locations")
+    if isinstance(locations, str):
+        locations = locations.split(",")
+    if not isinstance(locations, list):
+        return {"error": "locations must be a list of location names"}
+    locations = [str(location).strip() for location in locations if str(location).strip()]
+    if not locations:
+        return {"error": "No locations provided"}
+    if len(locations) > EXPORT_MAX_LOCATIONS:
+        return {"error": f"Exports are limited to {EXPORT_MAX_LOCATIONS} locations"}
+
+    export_format = data.get("format", "ndjson")
+    if export_format not in FORMATS:
+        return {"error": "Invalid format. Must be 'ndjson' or 'csv'"}
+    kind = data.get("kind", "daily")
+    if kind == "current":
+        return {"kind": kind, "format": export_format, "locations": locations}
+    if kind != "daily":
+        return {"error": "Invalid kind. Must be 'daily' or 'current'"}
+
+    today = datetime.now().date()
+    try:
+        end = datetime.strptime(data["end_date"], "%Y-%m-%d").date() if data.get("end_date") else today
+        start = datetime.strptime(data["start_date"], "%Y-%m-%d").date() if data.get("start_date") else end
+    except ValueError:
+        return {"error": "Dates must be YYYY-MM-DD"}
+    if start > end:
+        return {"error": "start_date is after end_date"}
+    if (end - start).days + 1 > EXPORT_MAX_DAYS:
+        return {"error": f"Exports are limited to {EXPORT_MAX_DAYS} days"}
+    if (end - today).days >= FORECAST_MAX_DAYS:
+        return {"error": f"end_date can be at most {FORECAST_MAX_DAYS - 1} days ahead"}
+    return {"kind": kind, "format": export_format, "locations": locations,
+            "start_date": start.isoformat(), "end_date": end.isoformat()}
+
+
+def _place(location: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    place = payload.get("location") or {}
+    return {"location": location, "name": place.get("name"), "region": place.get("region"),
+            "country": place.get("country")}
+
+
+def daily_rows(location: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """
+    One row per day for a location: observed days from history, later days
+    from the forecast
+
+    Args:
+        location: Location query
+        start_date: First date (YYYY-MM-DD)
+        end_date: Last date (YYYY-MM-DD)
+
+    Returns:
+        Rows in date order; days that couldn't be fetched carry an error
+    """
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    today = datetime.now().date()
+    rows = []
+
+    day = start
+    while day <= end and day < today:
+        payload = get_historical_weather(location, day.isoformat())
+        if "error" in payload:
+            rows.append({"location": location, "date": day.isoformat(), "source": "history",
+                         "error": payload["error"]})
+        else:
+            place = _place(location, payload)
+            rows.extend({**place, **entry, "source": "history"} for entry in api_daily(payload)
+                        if entry["date"] == day.isoformat())
+        day += timedelta(days=1)
+
+    if end >= today:
+        payload = get_forecast(location, days=(end - today).days + 1)
+        if "error" in payload:
+            rows.append({"location": location, "date": max(start, today).isoformat(), "source": "forecast",
+                         "error": payload["error"]})
+        else:
+            place = _place(location, payload)
+            rows.extend({**place, **entry, "source": "forecast"} for entry in api_daily(payload)
+                        if start_date <= entry["date"] <= end_date)
+    return rows
+
+
+def current_rows(locations: List[str]) -> List[Dict[str, Any]]:
+    """
+    Current conditions for a batch of locations, one row each
+
+    Args:
+        locations: Location queries
+
+    Returns:
+        Rows in the order given
+    """
+    results = get_current_weather_many(locations)
+    rows = []
+    for location in locations:
+        payload = results.get(location) or {"error": "No data"}
+        if "error" in payload:
+            rows.append({"location": location, "error": payload["error"]})
+        else:
+            rows.append({**_place(location, payload), **(api_observation(payload.get("current")) or {})})
+    return rows
+
+
+def _tasks(plan: Dict[str, Any]) -> Iterator[Callable[[], List[Dict[str, Any]]]]:
+    locations = plan["locations"]
+    if plan["kind"] == "current":
+        for i in range(0, len(locations), EXPORT_CURRENT_BATCH):
+            batch = locations[i:i + EXPORT_CURRENT_BATCH]
+            yield lambda batch=batch: current_rows(batch)
+    else:
+        for location in locations:
+            yield lambda location=location: daily_rows(location, plan["start_date"], plan["end_date"])
+
+
+def task_count(plan: Dict[str, Any]) -> int:
+    """
+    Requests an export counts as
+
+    Args:
+        plan: Plan from plan_export()
+
+    Returns:
+        One per location of a daily export, one per batch of a current one
+    """
+    if plan["kind"] == "current":
+        return math.ceil(len(plan["locations"]) / EXPORT_CURRENT_BATCH)
+    return len(plan["locations"])
+
+
+def _in_namespace(namespace: Optional[TTLCache], task: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    with upstream.cache_namespace(namespace):
+        return task()
+
+
+def export_rows(plan: Dict[str, Any], namespace: Optional[TTLCache] = None,
+                concurrency: int = EXPORT_CONCURRENCY) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the rows of an export in location order
+
+    At most ``concurrency`` tasks run at once. The next one starts as soon
+    as the oldest has been streamed, so memory stays bounded.
+
+    Args:
+        plan: Plan from plan_export()
+        namespace: Tenant cache namespace to read through (None for the
+            shared cache only)
+        concurrency: Tasks fetched at once
+
+    Yields:
+        Row dictionaries
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="weather-export")
+    window: Deque[Future] = deque()
+    finished = False
+    _count("exports")
+    _count("in_flight")
+    try:
+        for task in _tasks(plan):
+            window.append(executor.submit(_in_namespace, namespace, task))
+            if len(window) >= concurrency:
+                yield from _counted(window.popleft().result())
+        while window:
+            yield from _counted(window.popleft().result())
+        finished = True
+    finally:
+        # The client may disconnect mid-export; don't keep fetching for it
+        executor.shutdown(wait=False, cancel_futures=True)
+        _count("in_flight", -1)
+        _count("completed" if finished else "cancelled")
+
+
+def _counted(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    _count("rows", len(rows))
+    _count("error_rows", sum(1 for row in rows if "error" in row))
+    return rows
+
+
+def encode(plan: Dict[str, Any], rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """
+    Serialize export rows as NDJSON lines or CSV (with a header row)
+
+    Args:
+        plan: Plan from plan_export()
+        rows: Rows from export_rows()
+
+    Yields:
+        Text chunks, one per row
+    """
+    if plan["format"] == "ndjson":
+        for row in rows:
+            yield json.dumps(row) + "\n"
+        return
+
+    fields = CURRENT_FIELDS if plan["kind"] == "current" else DAILY_FIELDS
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return dict(_stats)
@@ -1,6 +1,9 @@
 """
 PocketFlow flow definition for the Weather API POC
 """
+import copy
+import time
+from typing import Any, Dict, Optional
 from pocketflow import Flow
 from .nodes import (
     InputNode,
@@ -9,11 +12,80 @@ from .nodes import (
     CurrentWeatherNode,
     ForecastNode,
     HistoricalWeatherNode,
+    ProviderSwitchNode,
     ResponseFormatterNode,
     ErrorHandlerNode
 )
 from .mcp_nodes import MCPWeatherNode
 from .ai_summary_node import AISummaryNode
+from . import admission, profiling, upstream
+from .payloads import PayloadTracker
+from .coalesce import SingleFlight, load_normalizer, normalize_query
+from .policies import NodePolicy, retryable_error
+from .settings import settings
+
+# Response options and their defaults (see run_weather_query)
+DEFAULT_OPTIONS = {
+    "structured": False,  # Build a typed response instead of a text blob
+    "text": True,         # Format the weather data as text
+    "summary": True,      # Generate an AI summary
+    "cache_only": False   # Answer from cached data only (see upstream.cache_only)
+}
+
+# Merge concurrent identical queries into one flow run. The normalizer can
+# be swapped for a "module:function" of your own (or via set_normalizer).
+FLOW_COALESCE_ENABLED = settings.get_bool("FLOW_COALESCE_ENABLED", True)
+FLOW_COALESCE_NORMALIZER = settings.get("FLOW_COALESCE_NORMALIZER", "")
+# How long a merged query waits for the run it joined before running its own
+FLOW_COALESCE_WAIT_SECONDS = settings.get_float("FLOW_COALESCE_WAIT_SECONDS", 30)
+
+# Node policies: time budget per attempt for nodes that call upstream, how
+# often they retry, and the budget for the OpenAI summary
+NODE_TIMEOUT_SECONDS = settings.get_float("NODE_TIMEOUT_SECONDS", 8)
+NODE_MAX_RETRIES = settings.get_int("NODE_MAX_RETRIES", 1)
+NODE_RETRY_BACKOFF_SECONDS = settings.get_float("NODE_RETRY_BACKOFF_SECONDS", 0.2)
+AI_SUMMARY_TIMEOUT_SECONDS = settings.get_float("AI_SUMMARY_TIMEOUT_SECONDS", 12)
+
+_in_flight = SingleFlight(wait_timeout=FLOW_COALESCE_WAIT_SECONDS)
+_normalize = load_normalizer(FLOW_COALESCE_NORMALIZER) if FLOW_COALESCE_NORMALIZER else normalize_query
+
+def set_normalizer(normalizer):
+    """
+    Set the function that decides which queries count as identical
+    
+    Args:
+        normalizer: Function mapping a query string to its coalescing key
+    """
+    global _normalize
+    _normalize = normalizer
+
+class TimedFlow(Flow):
+    """
+    Flow that records the wall-clock time of each node in shared["timings"]
+    
+    After each node, payloads it was the last to need in full are released
+    (see payloads.RELEASES), and the payload memory the run holds is
+    accounted in shared["payload_memory"].
+    """
+    def _orch(self, shared, params=None):
+        curr, p, last_action = copy.copy(self.start_node), (params or {**self.params}), None
+        timings = shared.setdefault("timings", {})
+        tracker = PayloadTracker()
+        while curr:
+            curr.set_params(p)
+            start = time.perf_counter()
+            policy = getattr(curr, "policy", None)
+            last_action = policy.run(curr, shared) if policy is not None else curr._run(shared)
+            name = type(curr).__name__
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            timings[name] = timings.get(name, 0.0) + elapsed_ms
+            profiling.record_stage(name, elapsed_ms)
+            if name == "AISummaryNode":
+                admission.exclude(elapsed_ms)
+            tracker.after_node(name, shared)
+            curr = copy.copy(self.get_next_node(curr, last_action))
+        shared["payload_memory"] = tracker.finish(shared)
+        return last_action
 
 def create_weather_flow():
     """
@@ -23,7 +95,7 @@ def create_weather_flow():
         Configured PocketFlow flow
     """
     # Create flow
-    flow = Flow()
+    flow = TimedFlow()
     
     # Create nodes
     input_node = InputNode()
@@ -36,6 +108,21 @@ def create_weather_flow():
     response_formatter = ResponseFormatterNode()
     ai_summary = AISummaryNode()
     error_handler = ErrorHandlerNode()
+    switch_to_api = ProviderSwitchNode("api")
+    
+    # Retry upstream hiccups; past the time budget, serve cached data, or
+    # answer from the API provider when the MCP path fails
+    upstream_policy = dict(max_retries=NODE_MAX_RETRIES, backoff=NODE_RETRY_BACKOFF_SECONDS,
+                           timeout=NODE_TIMEOUT_SECONDS)
+    # An unknown location is an answer, not a failure, so only time out
+    location_resolver.policy = NodePolicy(timeout=NODE_TIMEOUT_SECONDS, fallback=location_resolver.cached_fallback,
+                                          failed=lambda exec_res: False)
+    current_weather.policy = NodePolicy(**upstream_policy, fallback=current_weather.cached_fallback)
+    forecast.policy = NodePolicy(**upstream_policy, fallback=forecast.cached_fallback)
+    # Only upstream failures reroute to the API provider; it would give
+    # the same answer to a location upstream doesn't know
+    mcp_weather.policy = NodePolicy(**upstream_policy, fallback="api", failed=retryable_error)
+    ai_summary.policy = NodePolicy(timeout=AI_SUMMARY_TIMEOUT_SECONDS, fallback=ai_summary.timeout_fallback)
     
     # Connect nodes
     flow.start(input_node)
@@ -63,6 +150,8 @@ def create_weather_flow():
     mcp_weather - "historical" >> response_formatter
     mcp_weather - "success" >> response_formatter
     mcp_weather - "error" >> error_handler
+    mcp_weather - "api" >> switch_to_api
+    switch_to_api.next(location_resolver)
     
     # Add conditional transitions from current weather node
     current_weather - "forecast" >> forecast
@@ -75,41 +164,94 @@ def create_weather_flow():
     
     return flow
 
-def process_weather_query(query: str, provider: str = "api") -> str:
+def run_weather_query(query: str, provider: str = "api",
+                      options: Optional[Dict[str, Any]] = None,
+                      session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Process a weather query using the PocketFlow
+    Run the weather flow and return its shared context
     
     Args:
         query: User's natural language query about weather
         provider: Weather data provider to use ("api" or "mcp")
+        options: Response options overriding DEFAULT_OPTIONS
+        session: Conversation context from sessions.load(); follow-ups reuse
+            its location, parameters and still-fresh payloads
         
     Returns:
-        Formatted response to the user's query
+        The shared context after the flow has finished
     """
+    if not FLOW_COALESCE_ENABLED or session is not None:
+        # Session turns depend on their own history, so they never merge
+        return _run_weather_query(query, provider, options, session)
+    
+    # Identical queries in flight share one run; each caller gets its own
+    # copy of the top-level context. Tenants with their own cache namespace
+    # only share runs among themselves.
+    key = (_normalize(query), provider, tuple(sorted({**DEFAULT_OPTIONS, **(options or {})}.items())),
+           upstream.namespace_id())
+    shared, coalesced = _in_flight.do(key, lambda: _run_weather_query(query, provider, options, session))
+    if not coalesced:
+        return shared
+    # A follower waited through the leader's summary too
+    admission.exclude(shared.get("timings", {}).get("AISummaryNode", 0.0))
+    return {**shared, "user_query": query, "coalesced": True}
+
+def _run_weather_query(query: str, provider: str, options: Optional[Dict[str, Any]],
+                       session: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     # Create shared context
     shared = {
         "user_query": query,
-        "provider": provider
+        "provider": provider,
+        "options": {**DEFAULT_OPTIONS, **(options or {})}
     }
+    if session is not None:
+        shared["session"] = session
     
     # Create flow
     flow = create_weather_flow()
     
-    # Run flow
+    # Run flow, recording which cached data the answer was built from
     print(f"DEBUG: Processing query: {query} with provider: {provider}")
-    flow.run(shared)
+    shared["upstream_trace"] = upstream.start_trace()
+    start = time.perf_counter()
+    try:
+        if shared["options"]["cache_only"]:
+            with upstream.cache_only():
+                flow.run(shared)
+        else:
+            flow.run(shared)
+    finally:
+        shared["total_ms"] = (time.perf_counter() - start) * 1000
+        upstream.stop_trace()
     
     # Print debug info
     print(f"DEBUG: Parameters: {shared.get('parameters', {})}")
     print(f"DEBUG: Provider: {shared.get('provider', 'api')}")
-    print(f"DEBUG: Current weather response: {shared.get('current_weather_response', 'None')}")
-    print(f"DEBUG: Forecast response: {shared.get('forecast_response', 'None')}")
+    print(f"DEBUG: Weather text: {shared.get('weather_text', 'None')}")
     print(f"DEBUG: MCP weather data: {shared.get('mcp_weather', {})}")
     print(f"DEBUG: Final response: {shared.get('final_response', 'None')}")
     print(f"DEBUG: AI summary: {shared.get('ai_summary', 'None')}")
     print(f"DEBUG: Error message: {shared.get('error_message', 'None')}")
     print(f"DEBUG: Error response: {shared.get('error_response', 'None')}")
     
+    return shared
+
+def get_stats() -> Dict[str, Any]:
+    """Coalescing statistics for /metrics"""
+    return {"enabled": FLOW_COALESCE_ENABLED, **_in_flight.stats()}
+
+def process_weather_query(query: str, provider: str = "api") -> str:
+    """
+    Process a weather query using the PocketFlow
+    
+    Args:
+        query: User's natural language query about weather
+        provider: Weather data provider to use ("api" or "mcp")
+        
+    Returns:
+        Formatted response to the user's query
+    """
+    shared = run_weather_query(query, provider)
     
     # Return final response
     return shared.get("final_response", "Sorry, I couldn't process your weather query.")
@@ -0,0 +1,360 @@
+"""
+Template-based formatting engine shared by the API and MCP providers
+"""
+from datetime import datetime
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Callable, Dict, Hashable
+from .cache import TTLCache
+from .settings import settings
+
+# Rendered output is keyed by data version, so it never goes stale by
+# itself; the TTL only bounds how long unused renders are kept around.
+RENDER_CACHE_TTL = 3600
+render_cache = TTLCache(max_entries=settings.get_int("RENDER_CACHE_MAX_ENTRIES", 1024))
+
+
+class Template:
+    """
+    A response template compiled once at import time.
+
+    Templates use str.format placeholder syntax and are compiled into an
+    f-string function, so rendering is a single string build instead of a
+    chain of concatenations.
+    """
+    __slots__ = ("text", "fields", "_render")
+
+    def __init__(self, text: str):
+        self.text = text
+        body = []
+        fields = []
+        for literal, field, _, _ in Formatter().parse(text):
+            body.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is not None:
+                if not field.isidentifier():
+                    raise ValueError(f"Unsupported template field: {field!r}")
+                body.append("{" + field + "}")
+                if field not in fields:
+                    fields.append(field)
+        self.fields = tuple(fields)
+        source = f"lambda *, {', '.join(fields + ['**_'])}: f{''.join(body)!r}"
+        self._render = eval(compile(source, "<template>", "eval"))
+
+    def render(self, fields: Dict[str, Any]) -> str:
+        return self._render(**fields)
+
+
+# WeatherAPI.com provider templates
+API_CURRENT = Template(
+    "Current weather for {location_name}:\n"
+    "• Condition: {condition}\n"
+    "• Temperature: {temp_f}°F ({temp_c}°C)\n"
+    "• Feels like: {feelslike_f}°F ({feelslike_c}°C)\n"
+    "• Humidity: {humidity}%\n"
+    "• Wind: {wind_mph} mph ({wind_kph} km/h) {wind_dir}\n"
+    "• UV Index: {uv}\n"
+    "• Visibility: {vis_miles} miles\n"
+    "{stale_note}"
+)
+API_TOMORROW = Template(
+    "Tomorrow's forecast for {location_name} ({formatted_date}):\n"
+    "• Condition: {condition}\n"
+    "• High: {maxtemp_f}°F ({maxtemp_c}°C)\n"
+    "• Low: {mintemp_f}°F ({mintemp_c}°C)\n"
+    "• Humidity: {avghumidity}%\n"
+    "• Precipitation: {totalprecip_in} in ({totalprecip_mm} mm)\n"
+    "• Max Wind: {maxwind_mph} mph ({maxwind_kph} km/h)\n"
+    "• Sunrise: {sunrise}\n"
+    "• Sunset: {sunset}\n"
+)
+API_WEEK_HEADER = Template("Weather forecast for {location_name}:\n\n")
+API_WEEK_DAY = Template(
+    "📅 {formatted_date}:\n"
+    "   • {condition}\n"
+    "   • High: {maxtemp_f}°F ({maxtemp_c}°C)\n"
+    "   • Low: {mintemp_f}°F ({mintemp_c}°C)\n"
+    "   • Humidity: {avghumidity}%\n"
+    "   • Precipitation: {totalprecip_in} in ({totalprecip_mm} mm)\n"
+    "   • Max Wind: {maxwind_mph} mph ({maxwind_kph} km/h)\n"
+    "   • Sunrise: {sunrise}\n"
+    "   • Sunset: {sunset}\n\n"
+)
+API_HISTORICAL = Template(
+    "Historical weather for {location_name} on {formatted_date}:\n\n"
+    "• Condition: {condition}\n"
+    "• High: {maxtemp_f}°F ({maxtemp_c}°C)\n"
+    "• Low: {mintemp_f}°F ({mintemp_c}°C)\n"
+    "• Average Humidity: {avghumidity}%\n"
+    "• Total Precipitation: {totalprecip_in} in ({totalprecip_mm} mm)\n"
+    "• Max Wind: {maxwind_mph} mph ({maxwind_kph} km/h)\n"
+    "{stale_note}"
+)
+API_HISTORY_SUMMARY = Template(
+    "Weather in {location_name} from {start} to {end} ({days} days observed):\n\n"
+    "• Total Precipitation: {total_precip_in} in ({total_precip_mm} mm)\n"
+    "• Rainy Days: {rainy_days}\n"
+    "• Average High: {avg_high_f}°F ({avg_high_c}°C)\n"
+    "• Average Low: {avg_low_f}°F ({avg_low_c}°C)\n"
+    "• Warmest: {max_temp_f}°F ({max_temp_c}°C) on {warmest_date}\n"
+    "• Coldest: {min_temp_f}°F ({min_temp_c}°C) on {coldest_date}\n"
+    "• Average Humidity: {avg_humidity}%\n"
+    "• Max Wind: {max_wind_mph} mph ({max_wind_kph} km/h)\n"
+    "{missing_note}"
+)
+
+# MCP provider templates
+MCP_CURRENT = Template(
+    "Current weather for {location}, {region}, {country}:\n"
+    "• Condition: {weather_text}\n"
+    "• Temperature: {temp_value}°{temp_unit}\n"
+    "• Humidity: {humidity}%\n"
+    "• Wind: {wind_speed} km/h {wind_dir}\n"
+    "• Precipitation: {precip} mm\n"
+    "• Observation time: {obs_time}\n"
+    "{stale_note}"
+)
+MCP_TOMORROW = Template(
+    "Tomorrow's forecast for {location}, {region}, {country} ({formatted_date}):\n"
+    "• Condition: {condition}\n"
+    "• High: {max_temp_c}°C\n"
+    "• Low: {min_temp_c}°C\n"
+    "• Chance of rain: {chance_of_rain}%\n"
+    "• Chance of snow: {chance_of_snow}%\n"
+    "{stale_note}"
+)
+MCP_WEEK_HEADER = Template("Weather forecast for {location}, {region}, {country} (up to {days} days):\n\n")
+MCP_WEEK_DAY = Template(
+    "📅 {formatted_date}:\n"
+    "   • Condition: {condition}\n"
+    "   • High: {max_temp_c}°C\n"
+    "   • Low: {min_temp_c}°C\n"
+    "   • Chance of rain: {chance_of_rain}%\n"
+    "   • Chance of snow: {chance_of_snow}%\n\n"
+)
+MCP_HISTORICAL = Template(
+    "Historical weather for {location}:\n"
+    "• Date: {date}\n"
+    "• High: {high}°F\n"
+    "• Low: {low}°F\n"
+    "• Condition: {condition}\n"
+)
+
+API_DAY_FIELDS = ("maxtemp_f", "mintemp_f", "maxtemp_c", "mintemp_c", "avghumidity",
+                  "totalprecip_mm", "totalprecip_in", "maxwind_mph", "maxwind_kph")
+
+
+@lru_cache(maxsize=512)
+def format_date(date: str, fmt: str = "%A, %B %d") -> str:
+    """
+    Reformat a YYYY-MM-DD date, parsing each distinct date only once
+
+    Args:
+        date: Date string from the upstream payload
+        fmt: Output strftime format
+
+    Returns:
+        The formatted date, or the input unchanged if it cannot be parsed
+    """
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").strftime(fmt)
+    except (TypeError, ValueError):
+        return date
+
+
+def stale_note(weather_data: Any) -> str:
+    """
+    Describe the age of weather data served from a stale cache entry
+
+    Args:
+        weather_data: Weather data that may carry a "stale" marker
+
+    Returns:
+        A bullet line describing the data age, or an empty string if fresh
+    """
+    stale = weather_data.get("stale") if isinstance(weather_data, dict) else None
+    if not stale:
+        return ""
+
+    minutes = max(1, int(stale.get("age_seconds", 0)) // 60)
+    if stale.get("reason") == "revalidating":
+        return f"• Note: data from {minutes} min ago (refreshing)\n"
+    return f"• Note: data from {minutes} min ago (live data temporarily unavailable)\n"
+
+
+def _api_day_fields(day: Dict[str, Any], date_fmt: str = "%A, %B %d") -> Dict[str, Any]:
+    """Extract the fields used by every WeatherAPI.com day template"""
+    day_info = day.get("day", {})
+    astro = day.get("astro", {})
+    fields = {name: day_info.get(name, "N/A") for name in API_DAY_FIELDS}
+    fields["condition"] = day_info.get("condition", {}).get("text", "Unknown")
+    fields["formatted_date"] = format_date(day.get("date", "Unknown"), date_fmt)
+    fields["sunrise"] = astro.get("sunrise", "N/A")
+    fields["sunset"] = astro.get("sunset", "N/A")
+    return fields
+
+
+def _mcp_day_fields(day: Dict[str, Any], default_date: str) -> Dict[str, Any]:
+    """Extract the fields used by every MCP day template"""
+    return {
+        "formatted_date": format_date(day.get("date", default_date)),
+        "condition": day.get("condition", "Unknown conditions"),
+        "max_temp_c": day.get("max_temp_c", "N/A"),
+        "min_temp_c": day.get("min_temp_c", "N/A"),
+        "chance_of_rain": day.get("chance_of_rain", "N/A"),
+        "chance_of_snow": day.get("chance_of_snow", "N/A")
+    }
+
+
+def render_api_current(weather_data: Dict[str, Any], location_name: str) -> str:
+    current = weather_data.get("current", {})
+    return API_CURRENT.render({
+        "location_name": location_name,
+        "condition": current.get("condition", {}).get("text", "Unknown conditions"),
+        "temp_f": current.get("temp_f", "N/A"),
+        "temp_c": current.get("temp_c", "N/A"),
+        "feelslike_f": current.get("feelslike_f", "N/A"),
+        "feelslike_c": current.get("feelslike_c", "N/A"),
+        "humidity": current.get("humidity", "N/A"),
+        "wind_mph": current.get("wind_mph", "N/A"),
+        "wind_kph": current.get("wind_kph", "N/A"),
+        "wind_dir": current.get("wind_dir", "N/A"),
+        "uv": current.get("uv", "N/A"),
+        "vis_miles": current.get("vis_miles", "N/A"),
+        "stale_note": stale_note(weather_data)
+    })
+
+
+def render_api_forecast(forecast_data: Dict[str, Any], location_name: str, timeframe: str) -> str:
+    forecast_days = forecast_data.get("forecast", {}).get("forecastday", [])
+    if not forecast_days:
+        return f"No forecast data available for {location_name}"
+
+    # If the user asked for tomorrow, only show the second day
+    if timeframe == "tomorrow" and len(forecast_days) > 1:
+        fields = _api_day_fields(forecast_days[1])
+        fields["location_name"] = location_name
+        return (API_TOMORROW.render(fields) + stale_note(forecast_data)).strip()
+
+    parts = [API_WEEK_HEADER.render({"location_name": location_name})]
+    parts.extend(API_WEEK_DAY.render(_api_day_fields(day)) for day in forecast_days)
+    parts.append(stale_note(forecast_data))
+    return "".join(parts).strip()
+
+
+def render_api_historical(historical_data: Dict[str, Any], location_name: str) -> str:
+    forecast_day = historical_data.get("forecast", {}).get("forecastday", [])
+    if not forecast_day:
+        return f"No historical data available for {location_name}"
+
+    fields = _api_day_fields(forecast_day[0], "%A, %B %d, %Y")
+    fields["location_name"] = location_name
+    fields["stale_note"] = stale_note(historical_data)
+    return API_HISTORICAL.render(fields)
+
+
+def render_api_history_summary(summary_data: Dict[str, Any], location_name: str) -> str:
+    fields = {key: "N/A" if value is None else value for key, value in summary_data["summary"].items()}
+    fields.update(
+        location_name=location_name,
+        start=format_date(summary_data["start_date"], "%B %d, %Y"),
+        end=format_date(summary_data["end_date"], "%B %d, %Y"),
+        warmest_date=format_date(fields["warmest_date"]),
+        coldest_date=format_date(fields["coldest_date"])
+    )
+    missing = summary_data.get("missing_days") or []
+    fields["missing_note"] = f"\n(No data for {len(missing)} of the days in this range.)" if missing else ""
+    return API_HISTORY_SUMMARY.render(fields)
+
+
+def render_mcp_current(weather_data: Dict[str, Any]) -> str:
+    if not weather_data or "current_conditions" not in weather_data:
+        return "Sorry, I couldn't get the current weather information."
+
+    current = weather_data["current_conditions"]
+    temp = current.get("temperature", {})
+    wind = current.get("wind", {})
+    return MCP_CURRENT.render({
+        "location": weather_data.get("location", "Unknown location"),
+        "region": weather_data.get("region", ""),
+        "country": weather_data.get("country", ""),
+        "weather_text": current.get("weather_text", "Unknown conditions"),
+        "temp_value": temp.get("value", "N/A"),
+        "temp_unit": temp.get("unit", "C"),
+        "humidity": current.get("relative_humidity", "N/A"),
+        "wind_speed": wind.get("speed", "N/A"),
+        "wind_dir": wind.get("direction", "N/A"),
+        "precip": current.get("precipitation", "N/A"),
+        "obs_time": current.get("observation_time", "N/A"),
+        "stale_note": stale_note(weather_data)
+    })
+
+
+def render_mcp_tomorrow(weather_data: Dict[str, Any]) -> str:
+    forecast = weather_data.get("forecast", [])
+    if not forecast or len(forecast) < 2:
+        return "Sorry, I couldn't get tomorrow's weather forecast."
+
+    fields = _mcp_day_fields(forecast[1], "tomorrow")  # Second day is tomorrow
+    fields["location"] = weather_data.get("location", "Unknown location")
+    fields["region"] = weather_data.get("region", "")
+    fields["country"] = weather_data.get("country", "")
+    fields["stale_note"] = stale_note(weather_data)
+    return MCP_TOMORROW.render(fields)
+
+
+def render_mcp_week(weather_data: Dict[str, Any]) -> str:
+    forecast = weather_data.get("forecast", [])
+    if not forecast:
+        return "Sorry, I couldn't get the weekly weather forecast."
+
+    parts = [MCP_WEEK_HEADER.render({
+        "location": weather_data.get("location", "Unknown location"),
+        "region": weather_data.get("region", ""),
+        "country": weather_data.get("country", ""),
+        "days": len(forecast)
+    })]
+    parts.extend(MCP_WEEK_DAY.render(_mcp_day_fields(day, "Unknown")) for day in forecast)
+    parts.append(stale_note(weather_data))
+    return "".join(parts).strip()
+
+
+def render_mcp_historical(weather_data: Dict[str, Any]) -> str:
+    if not weather_data or "historical" not in weather_data:
+        return "Sorry, I couldn't get the historical weather information."
+
+    historical = weather_data["historical"]
+    return MCP_HISTORICAL.render({
+        "location": weather_data.get("location", "Unknown location"),
+        "date": historical.get("date", "N/A"),
+        "high": historical.get("high", "N/A"),
+        "low": historical.get("low", "N/A"),
+        "condition": historical.get("condition", "N/A")
+    })
+
+
+def render(key: Hashable, weather_data: Any, renderer: Callable[[], str]) -> str:
+    """
+    Render weather data, reusing the output for an unchanged data version
+
+    Output is memoized per (data version, key) where the key identifies
+    the provider, timeframe and anything else the rendering depends on.
+    Stale data is rendered fresh each time because its age note changes.
+
+    Args:
+        key: Hashable description of the rendering, e.g. ("api", "week", name)
+        weather_data: The data being rendered
+        renderer: Zero-argument callable producing the output
+
+    Returns:
+        The rendered string
+    """
+    version = weather_data.get("data_version") if isinstance(weather_data, dict) else None
+    if version is None or "stale" in weather_data:
+        return renderer()
+
+    memo_key = (version, key)
+    rendered = render_cache.get(memo_key)
+    if rendered is None:
+        rendered = renderer()
+        render_cache.set(memo_key, rendered, RENDER_CACHE_TTL)
+    return rendered
@@ -0,0 +1,229 @@
+"""
+Geohash cells and a small spatial index for location-keyed caching
+"""
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {char: index for index, char in enumerate(_BASE32)}
+EARTH_RADIUS_KM = 6371.0
+
+
+def encode(lat: float, lon: float, precision: int = 5) -> str:
+    """
+    Encode coordinates as a geohash
+
+    Args:
+        lat: Latitude in degrees
+        lon: Longitude in degrees
+        precision: Number of characters (5 is roughly a 5 km cell)
+
+    Returns:
+        Geohash string
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                value = (value << 1) | 1
+                lon_range[0] = mid
+            else:
+                value <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_range[0] = mid
+            else:
+                value <<= 1
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def bounds(cell: str) -> Tuple[float, float, float, float]:
+    """
+    Get the bounding box of a geohash cell
+
+    Args:
+        cell: Geohash string
+
+    Returns:
+        Tuple of (min_lat, max_lat, min_lon, max_lon)
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            target[1 - bit] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def neighbors(cell: str) -> List[str]:
+    """
+    Get a cell and the (up to) eight cells around it
+
+    Args:
+        cell: Geohash string
+
+    Returns:
+        List of geohash strings at the same precision
+    """
+    min_lat, max_lat, min_lon, max_lon = bounds(cell)
+    lat_step = max_lat - min_lat
+    lon_step = max_lon - min_lon
+    center_lat = (min_lat + max_lat) / 2
+    center_lon = (min_lon + max_lon) / 2
+    cells = []
+    for dlat in (-1, 0, 1):
+        lat = center_lat + dlat * lat_step
+        if not -90.0 <= lat <= 90.0:
+            continue
+        for dlon in (-1, 0, 1):
+            # Wrap around the antimeridian
+            lon = (center_lon + dlon * lon_step + 180.0) % 360.0 - 180.0
+            neighbor = encode(lat, lon, len(cell))
+            if neighbor not in cells:
+                cells.append(neighbor)
+    return cells
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def precision_for_radius(radius_km: float) -> int:
+    """
+    Finest geohash precision whose cells are at least radius_km across
+
+    Any point within radius_km of a query then lies in the query's cell or
+    one of its eight neighbors.
+    """
+    for precision in range(8, 0, -1):
+        min_lat, max_lat, min_lon, max_lon = bounds("s" * precision)
+        height = (max_lat - min_lat) * 111.0
+        width = (max_lon - min_lon) * 111.0 * math.cos(math.radians(60))
+        if min(height, width) >= radius_km:
+            return precision
+    return 1
+
+
+def parse_coordinates(location: str) -> Optional[Tuple[float, float]]:
+    """
+    Parse a "lat,lon" location query
+
+    Args:
+        location: Location query
+
+    Returns:
+        Tuple of (lat, lon), or None if the query isn't coordinates
+    """
+    parts = str(location).split(",")
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0:
+        return lat, lon
+    return None
+
+
+class GeoIndex:
+    """
+    Anchor points of cached cells, bucketed for nearest-cell lookup
+
+    Each cell keeps the coordinates its data was first fetched for. Buckets
+    are geohashes coarse enough that searching a bucket and its neighbors
+    covers the whole search radius.
+    """
+
+    def __init__(self, radius_km: float, max_cells: int = 4096):
+        """
+        Args:
+            radius_km: Largest distance nearest() will search
+            max_cells: Maximum anchors kept (least recently used are dropped)
+        """
+        self.radius_km = radius_km
+        self.bucket_precision = precision_for_radius(radius_km)
+        self.max_cells = max_cells
+        self._anchors: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._buckets: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def add(self, cell: str, lat: float, lon: float) -> None:
+        """Record the anchor point of a cell (the first anchor wins)"""
+        bucket = encode(lat, lon, self.bucket_precision)
+        with self._lock:
+            if cell in self._anchors:
+                self._anchors.move_to_end(cell)
+                return
+            self._anchors[cell] = (lat, lon)
+            self._buckets.setdefault(bucket, set()).add(cell)
+            while len(self._anchors) > self.max_cells:
+                old_cell, (old_lat, old_lon) = self._anchors.popitem(last=False)
+                old_bucket = encode(old_lat, old_lon, self.bucket_precision)
+                cells = self._buckets.get(old_bucket)
+                if cells is not None:
+                    cells.discard(old_cell)
+                    if not cells:
+                        del self._buckets[old_bucket]
+
+    def anchor(self, cell: str) -> Optional[Tuple[float, float]]:
+        """Coordinates a cell's data is fetched for"""
+        with self._lock:
+            return self._anchors.get(cell)
+
+    def nearest(self, lat: float, lon: float) -> Optional[str]:
+        """
+        Find the indexed cell whose anchor is closest to a point
+
+        Args:
+            lat: Latitude in degrees
+            lon: Longitude in degrees
+
+        Returns:
+            The closest cell within the radius, or None
+        """
+        best = None
+        best_distance = self.radius_km
+        with self._lock:
+            for bucket in neighbors(encode(lat, lon, self.bucket_precision)):
+                for cell in self._buckets.get(bucket, ()):
+                    anchor_lat, anchor_lon = self._anchors[cell]
+                    distance = distance_km(lat, lon, anchor_lat, anchor_lon)
+                    if distance <= best_distance:
+                        best, best_distance = cell, distance
+            if best is not None:
+                self._anchors.move_to_end(best)
+        return best
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._anchors)
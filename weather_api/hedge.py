@@ -0,0 +1,192 @@
+"""
+Hedged requests for long-tailed upstream latency
+
+If a request hasn't answered by a high percentile of the latency observed
+for its endpoint, an identical second request is sent and whichever answers
+first is used. A budget caps hedges to a fraction of all requests, so the
+extra quota spend stays bounded.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+class LatencyTracker:
+    """Recent latencies per endpoint, for percentile lookups"""
+
+    def __init__(self, window: int = 256, min_samples: int = 20):
+        """
+        Args:
+            window: Latencies kept per endpoint
+            min_samples: Samples needed before percentiles are reported
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def endpoints(self) -> List[str]:
+        with self._lock:
+            return list(self._samples)
+
+    def percentile(self, endpoint: str, percent: float) -> Optional[float]:
+        """
+        Latency below which percent of recent requests finished
+
+        Args:
+            endpoint: Endpoint name
+            percent: Percentile, e.g. 95
+
+        Returns:
+            Seconds, or None if there aren't enough samples yet
+        """
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+class HedgeBudget:
+    """
+    Allows hedges up to a fraction of requests
+
+    Every request earns ``ratio`` of a hedge, up to ``burst`` saved hedges.
+    """
+
+    def __init__(self, ratio: float, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def earn(self) -> None:
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class Hedger:
+    """
+    Runs calls with a hedge once they pass the endpoint's latency percentile
+
+    Losing attempts are cancelled if they haven't started. Otherwise their
+    result is discarded when they finish.
+    """
+
+    def __init__(self, percent: float, budget_ratio: float, min_delay: float = 0.05, max_workers: int = 32):
+        """
+        Args:
+            percent: Latency percentile after which a hedge is sent
+            budget_ratio: Largest share of requests that may be hedged
+            min_delay: Never hedge earlier than this many seconds
+            max_workers: Threads available to in-flight attempts
+        """
+        self.percent = percent
+        self.min_delay = min_delay
+        self.latencies = LatencyTracker()
+        self.budget = HedgeBudget(budget_ratio)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="weather-hedge")
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+
+    def _timed(self, endpoint: str, fn: Callable[[], Any]) -> Any:
+        start = time.monotonic()
+        result = fn()
+        self.latencies.record(endpoint, time.monotonic() - start)
+        return result
+
+    def call(self, endpoint: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn, hedging it with a second identical call if it is slow
+
+        fn must be idempotent. Until the endpoint has enough latency samples
+        it runs unhedged in the caller's thread.
+
+        Args:
+            endpoint: Endpoint name the latency percentile is tracked for
+            fn: The request
+
+        Returns:
+            The result of the first attempt to succeed
+
+        Raises:
+            The error of the last attempt when every attempt failed
+        """
+        self.budget.earn()
+        with self._stats_lock:
+            self.requests += 1
+        delay = self.latencies.percentile(endpoint, self.percent)
+        if delay is None:
+            return self._timed(endpoint, fn)
+
+        primary = self._executor.submit(self._timed, endpoint, fn)
+        try:
+            return primary.result(timeout=max(delay, self.min_delay))
+        except FutureTimeoutError:
+            pass
+
+        if not self.budget.try_spend():
+            with self._stats_lock:
+                self.over_budget += 1
+            return primary.result()
+
+        with self._stats_lock:
+            self.hedged += 1
+        hedge = self._executor.submit(self._timed, endpoint, fn)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        with self._stats_lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def delays(self) -> Dict[str, float]:
+        """Current hedge delay (ms) per endpoint with enough samples"""
+        delays = {}
+        for endpoint in self.latencies.endpoints():
+            delay = self.latencies.percentile(endpoint, self.percent)
+            if delay is not None:
+                delays[endpoint] = round(max(delay, self.min_delay) * 1000, 1)
+        return delays
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "over_budget": self.over_budget,
+                "hedge_ratio": round(self.hedged / self.requests, 4) if self.requests else 0.0
+            }
+        stats["delay_ms"] = self.delays()
+        return stats
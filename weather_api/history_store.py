@@ -0,0 +1,565 @@
+"""
+Local append-only store of observed weather, kept as columnar files
+
+Past weather never changes, so every history.json day and every current
+observation is appended here and later history queries and aggregates are
+answered from disk instead of upstream.
+
+Each location gets a directory holding three tables: ``daily`` and
+``hourly`` for history.json days, and ``observations`` for current
+conditions (kept apart so an observation on the hour never takes the key of
+the history row for that hour). Each table is a set of fixed-width column files (one per field,
+``array`` typecodes) that are memory-mapped for reads. Strings such as the
+condition text are dictionary-encoded in the location's ``meta.json``.
+Times are local to the location: days are proleptic ordinals and hours are
+local wall-clock seconds since the epoch.
+
+Every mapped column holds a file descriptor, so only the most recently used
+locations are kept open; older ones are closed and reopened from disk when
+they are needed again.
+"""
+import array
+import bisect
+import calendar
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+NAN = float("nan")
+
+# (column, typecode, path into a forecastday / hour record or None).
+# "s" columns hold string ids ("i"), -1 when missing.
+DAILY_COLUMNS: List[Tuple[str, str, Optional[Tuple[str, ...]]]] = [
+    ("day", "q", None),
+    ("maxtemp_c", "d", ("day", "maxtemp_c")),
+    ("maxtemp_f", "d", ("day", "maxtemp_f")),
+    ("mintemp_c", "d", ("day", "mintemp_c")),
+    ("mintemp_f", "d", ("day", "mintemp_f")),
+    ("avgtemp_c", "d", ("day", "avgtemp_c")),
+    ("avgtemp_f", "d", ("day", "avgtemp_f")),
+    ("totalprecip_mm", "d", ("day", "totalprecip_mm")),
+    ("totalprecip_in", "d", ("day", "totalprecip_in")),
+    ("avghumidity", "d", ("day", "avghumidity")),
+    ("maxwind_kph", "d", ("day", "maxwind_kph")),
+    ("maxwind_mph", "d", ("day", "maxwind_mph")),
+    ("daily_chance_of_rain", "d", ("day", "daily_chance_of_rain")),
+    ("daily_chance_of_snow", "d", ("day", "daily_chance_of_snow")),
+    ("condition", "s", ("day", "condition", "text")),
+    ("sunrise", "s", ("astro", "sunrise")),
+    ("sunset", "s", ("astro", "sunset")),
+]
+HOURLY_COLUMNS: List[Tuple[str, str, Optional[Tuple[str, ...]]]] = [
+    ("time", "q", None),
+    ("temp_c", "d", ("temp_c",)),
+    ("precip_mm", "d", ("precip_mm",)),
+    ("humidity", "d", ("humidity",)),
+    ("wind_kph", "d", ("wind_kph",)),
+    ("chance_of_rain", "d", ("chance_of_rain",)),
+    ("chance_of_snow", "d", ("chance_of_snow",)),
+    ("condition", "s", ("condition", "text")),
+    # 0 for history.json hours, 1 for current observations (which stores
+    # written before observations had their own table still hold in hourly)
+    ("source", "b", None),
+]
+SOURCE_HISTORY = 0
+SOURCE_CURRENT = 1
+
+
+def _typecode(code: str) -> str:
+    return "i" if code == "s" else code
+
+
+def _dig(record: Dict[str, Any], path: Tuple[str, ...]) -> Any:
+    for part in path:
+        if not isinstance(record, dict):
+            return None
+        record = record.get(part)
+    return record
+
+
+def day_ordinal(date_str: str) -> int:
+    """Ordinal of a YYYY-MM-DD date"""
+    return date.fromisoformat(date_str).toordinal()
+
+
+def local_seconds(time_str: str) -> int:
+    """Seconds since the epoch of a local "YYYY-MM-DD HH:MM" wall-clock time"""
+    return calendar.timegm(datetime.strptime(time_str, "%Y-%m-%d %H:%M").timetuple())
+
+
+class Table:
+    """
+    Append-only columnar table with a unique, ordered key column
+
+    Rows can arrive in any order; an in-memory sorted key index turns range
+    queries into a bisect plus a gather over the memory-mapped columns.
+    """
+
+    def __init__(self, directory: str, columns: List[Tuple[str, str, Any]]):
+        self.directory = directory
+        self.columns = [(name, _typecode(code)) for name, code, _ in columns]
+        self.key = self.columns[0][0]
+        os.makedirs(directory, exist_ok=True)
+        self._views: Dict[str, memoryview] = {}
+        self._maps: List[mmap.mmap] = []
+
+        # Columns are written one after another; a crash can leave some a
+        # row longer than others, so only complete rows count
+        self.rows = min(self._file_rows(name, code) for name, code in self.columns)
+        keys = list(self.column(self.key))
+        self._sorted = sorted(zip(keys, range(len(keys))))
+        self._sorted_keys = [key for key, _ in self._sorted]
+        self._row_of = {key: row for key, row in self._sorted}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.col")
+
+    def _file_rows(self, name: str, code: str) -> int:
+        try:
+            return os.path.getsize(self._path(name)) // array.array(code).itemsize
+        except FileNotFoundError:
+            return 0
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._row_of
+
+    def append(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Append rows whose keys aren't already present
+
+        Args:
+            rows: Column values per row; missing columns are stored as
+                NaN / -1 / 0
+
+        Returns:
+            Number of rows written
+        """
+        new_rows = []
+        new_keys = set()
+        for row in rows:
+            key = row[self.key]
+            if key not in self._row_of and key not in new_keys:
+                new_keys.add(key)
+                new_rows.append(row)
+        if not new_rows:
+            return 0
+        for name, code in self.columns:
+            default = NAN if code == "d" else (-1 if code == "i" else 0)
+            values = array.array(code, [default if row.get(name) is None else row[name] for row in new_rows])
+            path = self._path(name)
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                # Overwrite any partial row a crash left behind
+                f.seek(self.rows * values.itemsize)
+                f.write(values.tobytes())
+        for index, row in enumerate(new_rows, self.rows):
+            key = row[self.key]
+            position = bisect.bisect_left(self._sorted_keys, key)
+            self._sorted_keys.insert(position, key)
+            self._sorted.insert(position, (key, index))
+            self._row_of[key] = index
+        self.rows += len(new_rows)
+        self.close()
+        return len(new_rows)
+
+    def close(self) -> None:
+        """Unmap the columns; they are mapped again on the next read"""
+        for view in self._views.values():
+            view.release()
+        self._views.clear()
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                # A caller still holds a view; the map closes once it's gone
+                pass
+        self._maps.clear()
+
+    def column(self, name: str) -> memoryview:
+        """Memory-mapped, typed view of a column's complete rows"""
+        view = self._views.get(name)
+        if view is None:
+            code = dict(self.columns)[name]
+            size = self.rows * array.array(code).itemsize
+            if size == 0:
+                view = memoryview(array.array(code))
+            else:
+                with open(self._path(name), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(mapped)
+                with memoryview(mapped) as whole:
+                    view = whole[:size].cast(code)
+            self._views[name] = view
+        return view
+
+    def row_for(self, key: int) -> Optional[int]:
+        return self._row_of.get(key)
+
+    def range(self, low: int, high: int) -> List[int]:
+        """Row numbers whose key is in [low, high], in key order"""
+        start = bisect.bisect_left(self._sorted_keys, low)
+        end = bisect.bisect_right(self._sorted_keys, high)
+        return [row for _, row in self._sorted[start:end]]
+
+    def gather(self, name: str, rows: List[int]) -> List[Any]:
+        column = self.column(name)
+        return [column[row] for row in rows]
+
+
+class LocationHistory:
+    """Daily, hourly and observation tables plus string dictionary for one location"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.daily = Table(os.path.join(directory, "daily"), DAILY_COLUMNS)
+        self.hourly = Table(os.path.join(directory, "hourly"), HOURLY_COLUMNS)
+        self.observations = Table(os.path.join(directory, "observations"), HOURLY_COLUMNS)
+        self.meta = {"location": {}, "strings": []}
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                self.meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        self._string_ids = {text: index for index, text in enumerate(self.meta["strings"])}
+        self._meta_dirty = False
+
+    def close(self) -> None:
+        self.flush_meta()
+        for table in (self.daily, self.hourly, self.observations):
+            table.close()
+
+    def string_id(self, text: Optional[str]) -> int:
+        if text is None:
+            return -1
+        index = self._string_ids.get(text)
+        if index is None:
+            index = len(self.meta["strings"])
+            self.meta["strings"].append(text)
+            self._string_ids[text] = index
+            self._meta_dirty = True
+        return index
+
+    def string(self, index: int) -> Optional[str]:
+        return self.meta["strings"][index] if 0 <= index < len(self.meta["strings"]) else None
+
+    def set_location(self, location: Dict[str, Any]) -> None:
+        fields = {key: location.get(key) for key in ("name", "region", "country", "lat", "lon", "tz_id")}
+        if fields != self.meta.get("location"):
+            self.meta["location"] = fields
+            self._meta_dirty = True
+
+    def flush_meta(self) -> None:
+        if not self._meta_dirty:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".meta-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.directory, "meta.json"))
+        self._meta_dirty = False
+
+    def row_values(self, table: Table, columns, row: int) -> Dict[str, Any]:
+        values = {}
+        for name, code, _ in columns:
+            value = table.column(name)[row]
+            if code == "s":
+                value = self.string(value)
+            elif code == "d" and math.isnan(value):
+                value = None
+            values[name] = value
+        return values
+
+
+class HistoryStore:
+    """
+    All locations' observation histories under one directory
+
+    Args:
+        root: Directory holding one subdirectory per location
+        max_open: Locations kept open (mapped) at once, least recently
+            used closed first
+    """
+
+    def __init__(self, root: str, max_open: int = 8):
+        self.root = root
+        self.max_open = max(1, max_open)
+        self._locations: "OrderedDict[str, LocationHistory]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.days_written = 0
+        self.hours_written = 0
+        self.local_answers = 0
+
+    def _directory(self, location_id: str) -> str:
+        slug = re.sub(r"[^a-z0-9]+", "-", location_id.lower()).strip("-")[:40]
+        digest = hashlib.blake2b(location_id.encode("utf-8"), digest_size=4).hexdigest()
+        return os.path.join(self.root, f"{slug}-{digest}")
+
+    def _location(self, location_id: str, create: bool = True) -> Optional[LocationHistory]:
+        # Caller holds the lock
+        history = self._locations.get(location_id)
+        if history is not None:
+            self._locations.move_to_end(location_id)
+            return history
+        directory = self._directory(location_id)
+        if not create and not os.path.isdir(directory):
+            return None
+        history = self._locations[location_id] = LocationHistory(directory)
+        while len(self._locations) > self.max_open:
+            _, evicted = self._locations.popitem(last=False)
+            evicted.close()
+        return history
+
+    def record_history(self, location_id: str, payload: Dict[str, Any]) -> int:
+        """
+        Append the days and hours of a history.json payload
+
+        Args:
+            location_id: Stable identifier of the location
+            payload: history.json payload
+
+        Returns:
+            Number of new days written
+        """
+        days = ((payload.get("forecast") or {}).get("forecastday")) or []
+        # Only finished days are immutable. Without the location's local
+        # time, yesterday in UTC may still be under way somewhere.
+        localtime = str((payload.get("location") or {}).get("localtime") or "")[:10]
+        today = localtime or (datetime.now(timezone.utc).date() - timedelta(days=1)).isoformat()
+        written = 0
+        with self._lock:
+            history = self._location(location_id)
+            if isinstance(payload.get("location"), dict):
+                history.set_location(payload["location"])
+            for day in days:
+                if day.get("date", today) >= today:
+                    continue
+                row = self._row(history, DAILY_COLUMNS, day)
+                row["day"] = day_ordinal(day["date"])
+                hour_rows = []
+                for hour in day.get("hour") or []:
+                    hour_row = self._row(history, HOURLY_COLUMNS, hour)
+                    hour_row.update(time=local_seconds(hour["time"]), source=SOURCE_HISTORY)
+                    hour_rows.append(hour_row)
+                self.hours_written += history.hourly.append(hour_rows)
+                # The day goes in last so a day row implies its hours are stored
+                written += history.daily.append([row])
+            history.flush_meta()
+            self.days_written += written
+        return written
+
+    def record_current(self, location_id: str, payload: Dict[str, Any]) -> bool:
+        """
+        Append the observation of a current.json payload
+
+        Args:
+            location_id: Stable identifier of the location
+            payload: current.json payload
+
+        Returns:
+            True if a new observation was written
+        """
+        current = payload.get("current")
+        if not isinstance(current, dict) or not current.get("last_updated"):
+            return False
+        with self._lock:
+            history = self._location(location_id)
+            if isinstance(payload.get("location"), dict):
+                history.set_location(payload["location"])
+            row = self._row(history, HOURLY_COLUMNS, current)
+            row.update(time=local_seconds(current["last_updated"]), source=SOURCE_CURRENT)
+            written = history.observations.append([row]) > 0
+            history.flush_meta()
+            self.hours_written += written
+        return written
+
+    def _row(self, history: LocationHistory, columns, record: Dict[str, Any]) -> Dict[str, Any]:
+        row = {}
+        for name, code, path in columns:
+            if path is None:
+                continue
+            value = _dig(record, path)
+            if code == "s":
+                row[name] = history.string_id(value)
+            elif isinstance(value, (int, float)):
+                row[name] = value
+        return row
+
+    def get_day(self, location_id: str, date_str: str) -> Optional[Dict[str, Any]]:
+        """
+        Rebuild a history.json payload for one stored day
+
+        Args:
+            location_id: Stable identifier of the location
+            date_str: Date as YYYY-MM-DD
+
+        Returns:
+            history.json-shaped payload, or None if the day isn't stored
+        """
+        try:
+            ordinal = day_ordinal(date_str)
+        except (TypeError, ValueError):
+            return None
+        with self._lock:
+            history = self._location(location_id, create=False)
+            if history is None or ordinal not in history.daily:
+                return None
+            days = self._days(history, [history.daily.row_for(ordinal)], with_hours=True)
+            self.local_answers += 1
+            return {"location": dict(history.meta["location"]), "forecast": {"forecastday": days}}
+
+    def get_range(self, location_id: str, start: str, end: str) -> Optional[Dict[str, Any]]:
+        """
+        Stored days between two dates as a history.json-shaped payload
+
+        Args:
+            location_id: Stable identifier of the location
+            start: First date (YYYY-MM-DD)
+            end: Last date (YYYY-MM-DD)
+
+        Returns:
+            Payload with the stored days in date order, or None if the
+            location has no history
+        """
+        with self._lock:
+            history = self._location(location_id, create=False)
+            if history is None:
+                return None
+            rows = history.daily.range(day_ordinal(start), day_ordinal(end))
+            days = self._days(history, rows, with_hours=False)
+            return {"location": dict(history.meta["location"]), "forecast": {"forecastday": days}}
+
+    def missing_days(self, location_id: str, start: str, end: str) -> List[str]:
+        """Dates between start and end (inclusive) with no stored day"""
+        first, last = day_ordinal(start), day_ordinal(end)
+        with self._lock:
+            history = self._location(location_id, create=False)
+            stored = history.daily if history is not None else ()
+            return [date.fromordinal(day).isoformat() for day in range(first, last + 1) if day not in stored]
+
+    def aggregate(self, location_id: str, column: str, start: str, end: str,
+                  op: Callable[[List[float]], float], table: str = "daily") -> Optional[float]:
+        """
+        Aggregate one column over a date range
+
+        Args:
+            location_id: Stable identifier of the location
+            column: Column name, e.g. "totalprecip_mm"
+            start: First date (YYYY-MM-DD)
+            end: Last date (YYYY-MM-DD)
+            op: Reduction over the non-missing values, e.g. sum or max
+            table: "daily" or "hourly"
+
+        Returns:
+            The aggregate, or None if there are no values
+        """
+        first, last = day_ordinal(start), day_ordinal(end)
+        with self._lock:
+            history = self._location(location_id, create=False)
+            if history is None:
+                return None
+            if table == "daily":
+                source, rows = history.daily, history.daily.range(first, last)
+            else:
+                low = (first - date(1970, 1, 1).toordinal()) * 86400
+                high = (last + 1 - date(1970, 1, 1).toordinal()) * 86400 - 1
+                source, rows = history.hourly, history.hourly.range(low, high)
+            values = [value for value in source.gather(column, rows) if value == value]
+        return op(values) if values else None
+
+    def summarize(self, location_id: str, start: str, end: str) -> Optional[Dict[str, Any]]:
+        """
+        Totals and extremes of the stored days between two dates
+
+        Args:
+            location_id: Stable identifier of the location
+            start: First date (YYYY-MM-DD)
+            end: Last date (YYYY-MM-DD)
+
+        Returns:
+            Summary dictionary, or None if no day in the range is stored
+        """
+        with self._lock:
+            history = self._location(location_id, create=False)
+            if history is None:
+                return None
+            daily = history.daily
+            rows = daily.range(day_ordinal(start), day_ordinal(end))
+            if not rows:
+                return None
+            columns = {name: daily.gather(name, rows) for name, code, _ in DAILY_COLUMNS if code != "s"}
+            self.local_answers += 1
+
+        def known(name):
+            return [value for value in columns[name] if value == value]
+
+        def mean(name):
+            values = known(name)
+            return round(sum(values) / len(values), 1) if values else None
+
+        def extreme(name, pick):
+            values = [(value, day) for value, day in zip(columns[name], columns["day"]) if value == value]
+            return pick(values) if values else (None, None)
+
+        warmest, warmest_day = extreme("maxtemp_c", max)
+        coldest, coldest_day = extreme("mintemp_c", min)
+        precip_mm = known("totalprecip_mm")
+        return {
+            "days": len(rows),
+            "total_precip_mm": round(math.fsum(precip_mm), 2),
+            "total_precip_in": round(math.fsum(known("totalprecip_in")), 2),
+            "rainy_days": sum(1 for value in precip_mm if value >= 1.0),
+            "avg_high_c": mean("maxtemp_c"),
+            "avg_high_f": mean("maxtemp_f"),
+            "avg_low_c": mean("mintemp_c"),
+            "avg_low_f": mean("mintemp_f"),
+            "avg_humidity": mean("avghumidity"),
+            "max_temp_c": warmest,
+            "max_temp_f": max(known("maxtemp_f"), default=None),
+            "warmest_date": date.fromordinal(warmest_day).isoformat() if warmest_day else None,
+            "min_temp_c": coldest,
+            "min_temp_f": min(known("mintemp_f"), default=None),
+            "coldest_date": date.fromordinal(coldest_day).isoformat() if coldest_day else None,
+            "max_wind_kph": max(known("maxwind_kph"), default=None),
+            "max_wind_mph": max(known("maxwind_mph"), default=None)
+        }
+
+    def _days(self, history: LocationHistory, rows: List[int], with_hours: bool) -> List[Dict[str, Any]]:
+        epoch_ordinal = date(1970, 1, 1).toordinal()
+        days = []
+        for row in rows:
+            values = history.row_values(history.daily, DAILY_COLUMNS, row)
+            day_date = date.fromordinal(values["day"])
+            day = {
+                "date": day_date.isoformat(),
+                "day": {name: values[name] for name, _, path in DAILY_COLUMNS if path and path[0] == "day"},
+                "astro": {"sunrise": values["sunrise"], "sunset": values["sunset"]}
+            }
+            day["day"]["condition"] = {"text": day["day"].get("condition")}
+            if with_hours:
+                low = (values["day"] - epoch_ordinal) * 86400
+                hours = []
+                for hour_row in history.hourly.range(low, low + 86399):
+                    hour = history.row_values(history.hourly, HOURLY_COLUMNS, hour_row)
+                    if hour.pop("source") != SOURCE_HISTORY:
+                        continue
+                    hour["time"] = datetime.fromtimestamp(hour["time"], timezone.utc).strftime("%Y-%m-%d %H:%M")
+                    hour["condition"] = {"text": hour["condition"]}
+                    hours.append(hour)
+                day["hour"] = hours
+            days.append(day)
+        return days
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "locations_open": len(self._locations),
+                "days_written": self.days_written,
+                "hours_written": self.hours_written,
+                "local_answers": self.local_answers
+            }
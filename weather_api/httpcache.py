@@ -0,0 +1,94 @@
+"""
+HTTP caching support (ETag / Cache-Control) for weather responses
+"""
+import hashlib
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from . import upstream
+from .cache import TTLCache
+from .settings import settings
+
+# Validators for recently answered requests, so a matching If-None-Match
+# can be answered without running the flow
+validators = TTLCache(max_entries=settings.get_int("HTTP_VALIDATOR_MAX_ENTRIES", 4096))
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different spellings share validators"""
+    return " ".join(query.lower().split())
+
+
+def request_key(query: str, provider: str, options: Dict[str, Any]) -> Tuple[Hashable, ...]:
+    """
+    Build the key identifying an HTTP weather request
+
+    Call it inside the request's cache namespace: tenants reading through
+    their own namespace get validators of their own.
+
+    Args:
+        query: User's natural language query
+        provider: Weather data provider ("api" or "mcp")
+        options: Response options that change the body
+
+    Returns:
+        Hashable request key
+    """
+    return (normalize_query(query), provider, tuple(sorted(options.items())), upstream.namespace_id())
+
+
+def remember(key: Tuple[Hashable, ...], trace: List[Dict[str, Any]]) -> Tuple[Optional[str], int]:
+    """
+    Derive an ETag and max-age from the data a response was built from
+
+    Responses built from stale data, upstream errors or no cached data at
+    all get no ETag and a max-age of 0.
+
+    Args:
+        key: Request key from request_key()
+        trace: Cache lookups recorded while answering the request
+
+    Returns:
+        Tuple of (etag or None, max-age in seconds)
+    """
+    if not trace or any(record["status"] not in ("hit", "miss") for record in trace):
+        return None, 0
+
+    # The same cached payload can be looked up more than once per request
+    versions = sorted({(record["key"], record["version"]) for record in trace}, key=repr)
+    max_age = min(record["ttl_remaining"] for record in trace)
+    if max_age <= 0:
+        return None, 0
+
+    digest = hashlib.blake2b(repr((key, versions)).encode("utf-8"), digest_size=12)
+    etag = digest.hexdigest()
+    validators.set(key, {"etag": etag, "versions": versions}, max_age)
+    return etag, max_age
+
+
+def revalidate(key: Tuple[Hashable, ...]) -> Tuple[Optional[str], int]:
+    """
+    Check whether the last response for a request is still current
+
+    A response is current while every cached payload it was built from is
+    still fresh and unchanged, as seen through the current cache namespace.
+
+    Args:
+        key: Request key from request_key()
+
+    Returns:
+        Tuple of (etag, remaining max-age) if current, else (None, 0)
+    """
+    validator = validators.get(key)
+    if validator is None:
+        return None, 0
+
+    max_age = None
+    for cache_key, version in validator["versions"]:
+        entry = upstream._peek_entry(cache_key)
+        if entry is None or entry.version != version or not entry.is_fresh():
+            validators.delete(key)
+            return None, 0
+        remaining = int(entry.ttl_remaining)
+        max_age = remaining if max_age is None else min(max_age, remaining)
+    if not max_age or max_age <= 0:
+        return None, 0
+    return validator["etag"], max_age
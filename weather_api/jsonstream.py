@@ -0,0 +1,162 @@
+"""
+Projected JSON decoding for large WeatherAPI.com payloads
+
+A projection names the parts of a document worth keeping:
+
+    True            keep the value as is
+    {"key": spec}   keep only these keys of an object
+    [spec]          apply spec to every element of an array
+
+Everything else is dropped while decoding, so multi-day forecasts with
+hourly records don't have to be held in full.
+"""
+import json
+import sys
+from typing import Any, BinaryIO, Dict, Iterable, Tuple, Union
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+Projection = Union[bool, Dict[str, Any], list]
+
+_START = {"start_map": dict, "start_array": list}
+_END = ("end_map", "end_array")
+
+
+def streaming_available() -> bool:
+    """Whether documents can be decoded incrementally from a stream"""
+    return ijson is not None
+
+
+def project(value: Any, projection: Projection) -> Any:
+    """
+    Prune an already decoded value down to a projection
+
+    Args:
+        value: Decoded JSON value
+        projection: Projection spec (see module docstring)
+
+    Returns:
+        The projected value; unmatched shapes are kept unchanged
+    """
+    if projection is True:
+        return value
+    if isinstance(projection, dict) and isinstance(value, dict):
+        return {key: project(value[key], spec) for key, spec in projection.items() if key in value}
+    if isinstance(projection, list) and isinstance(value, list):
+        spec = projection[0]
+        return [project(item, spec) for item in value]
+    return value
+
+
+def loads(data: Union[bytes, str], projection: Projection = True) -> Any:
+    """
+    Decode a complete document, using orjson when it is installed
+
+    Args:
+        data: Encoded JSON document
+        projection: Projection spec applied after decoding
+
+    Returns:
+        The projected value
+    """
+    value = orjson.loads(data) if orjson is not None else json.loads(data)
+    return project(value, projection)
+
+
+def parse(stream: BinaryIO, projection: Projection = True, buf_size: int = 16384) -> Any:
+    """
+    Decode a document incrementally from a binary stream
+
+    Only the projected paths are materialized and the stream is read in
+    small chunks, so peak memory stays well below the encoded size. This
+    costs more CPU than loads(). Falls back to reading the whole stream and
+    calling loads() when ijson isn't installed.
+
+    Args:
+        stream: File-like object with a read() method
+        projection: Projection spec
+        buf_size: Bytes read from the stream at a time
+
+    Returns:
+        The projected value
+    """
+    if ijson is None:
+        return loads(stream.read(), projection)
+    return build(ijson.basic_parse(stream, use_float=True, buf_size=buf_size), projection)
+
+
+def build(events: Iterable[Tuple[str, Any]], projection: Projection) -> Any:
+    """
+    Build the projected value from ijson basic_parse (event, value) events
+
+    Args:
+        events: Parser events for one document
+        projection: Projection spec
+
+    Returns:
+        The projected value
+    """
+    # Each frame is [container, spec for its children, pending object key]
+    stack = []
+    skip = 0
+    for event, value in events:
+        if skip:
+            # Inside a subtree the projection drops
+            if event in _START:
+                skip += 1
+            elif event in _END:
+                skip -= 1
+            continue
+
+        if event == "map_key":
+            # Share key strings across records like the buffered decoders do
+            stack[-1][2] = sys.intern(value)
+            continue
+        if event in _END:
+            done = stack.pop()[0]
+            if not stack:
+                return done
+            continue
+
+        if not stack:
+            spec = projection
+        else:
+            container, spec, key = stack[-1]
+            if spec is not True and type(container) is dict:
+                spec = spec.get(key)
+                if spec is None:
+                    if event in _START:
+                        skip = 1
+                    continue
+
+        if event in _START:
+            child = _START[event]()
+            if stack:
+                _attach(stack[-1], child)
+            # Shapes that don't match the projection are kept whole
+            if event == "start_map":
+                child_spec = spec if isinstance(spec, dict) else True
+            else:
+                child_spec = spec[0] if isinstance(spec, list) else True
+            stack.append([child, child_spec, None])
+        elif stack:
+            _attach(stack[-1], value)
+        else:
+            return value
+    raise ValueError("Incomplete JSON document")
+
+
+def _attach(frame: list, value: Any) -> None:
+    container = frame[0]
+    if type(container) is dict:
+        container[frame[2]] = value
+    else:
+        container.append(value)
@@ -2,21 +2,21 @@
 MCP-based weather nodes for the Weather API POC
 Custom implementation without external mcp-weather dependency
 """
-import os
-import json
-import requests
 from typing import Dict, Any
 from datetime import datetime, timedelta
 from pocketflow import BaseNode
-from dotenv import load_dotenv
 from .utils import extract_weather_parameters
+from .upstream import cached_fetch, cached_version
+from .prefetch import record_location
 
-# Load environment variables
-load_dotenv()
-
-# WeatherAPI.com API key
-WEATHERAPI_KEY = os.getenv('WEATHERAPI_KEY')
-WEATHERAPI_BASE_URL = 'http://api.weatherapi.com/v1'
+def _error(message, error):
+    """Error payload, with the upstream HTTP status when there was one"""
+    print(message)
+    payload = {"error": message}
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        payload["status"] = status
+    return payload
 
 class MCPWeatherNode(BaseNode):
     """Node to get weather data from MCP (custom implementation)"""
@@ -33,16 +33,8 @@ class MCPWeatherNode(BaseNode):
     
     def _get_location_info(self, location):
         """Get location information from WeatherAPI.com"""
-        params = {
-            "key": WEATHERAPI_KEY,
-            "q": location
-        }
-        
         try:
-            response = requests.get(f"{WEATHERAPI_BASE_URL}/search.json", params=params)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = cached_fetch("search.json", location)
             if data and len(data) > 0:
                 return {
                     "name": data[0]["name"],
@@ -53,28 +45,18 @@ class MCPWeatherNode(BaseNode):
                 }
             return {"error": f"Location '{location}' not found"}
         except Exception as e:
-            error_msg = f"Error getting location info: {e}"
-            print(error_msg)
-            return {"error": error_msg}
+            return _error(f"Error getting location info: {e}", e)
     
     def _get_current_conditions(self, location):
         """Get current weather conditions from WeatherAPI.com"""
-        params = {
-            "key": WEATHERAPI_KEY,
-            "q": location,
-            "aqi": "yes"  # Include air quality data
-        }
-        
         try:
-            response = requests.get(f"{WEATHERAPI_BASE_URL}/current.json", params=params)
-            response.raise_for_status()
-            
-            data = response.json()
+            # Include air quality data
+            data = cached_fetch("current.json", location, aqi="yes")
             if data and "current" in data:
                 current = data["current"]
                 location_data = data["location"]
                 
-                return {
+                conditions = {
                     "temperature": {
                         "value": current["temp_c"],
                         "unit": "C"
@@ -93,27 +75,17 @@ class MCPWeatherNode(BaseNode):
                         "country": location_data["country"]
                     }
                 }
+                if "stale" in data:
+                    conditions["stale"] = data["stale"]
+                return conditions
             return {"error": "No current conditions available"}
         except Exception as e:
-            error_msg = f"Error getting current conditions: {e}"
-            print(error_msg)
-            return {"error": error_msg}
+            return _error(f"Error getting current conditions: {e}", e)
     
     def _get_forecast(self, location, days=3):
         """Get weather forecast from WeatherAPI.com"""
-        params = {
-            "key": WEATHERAPI_KEY,
-            "q": location,
-            "days": days,
-            "aqi": "yes",
-            "alerts": "yes"
-        }
-        
         try:
-            response = requests.get(f"{WEATHERAPI_BASE_URL}/forecast.json", params=params)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = cached_fetch("forecast.json", location, days=days, aqi="yes", alerts="yes")
             if data and "forecast" in data and "forecastday" in data["forecast"]:
                 forecast_days = []
                 
@@ -149,9 +121,7 @@ class MCPWeatherNode(BaseNode):
                 return forecast_days
             return {"error": "No forecast data available"}
         except Exception as e:
-            error_msg = f"Error getting forecast: {e}"
-            print(error_msg)
-            return {"error": error_msg}
+            return _error(f"Error getting forecast: {e}", e)
     
     def _get_mcp_weather(self, location):
         """Get weather data using MCP approach with WeatherAPI.com"""
@@ -159,7 +129,8 @@ class MCPWeatherNode(BaseNode):
             # Get current conditions (includes location info)
             current_data = self._get_current_conditions(location)
             if "error" in current_data:
-                return {"error": current_data["error"]}
+                # Keeps the status, which decides whether the policy retries
+                return current_data
             
             # Get forecast data
             forecast_data = self._get_forecast(location)
@@ -168,7 +139,7 @@ class MCPWeatherNode(BaseNode):
                 forecast_data = []
             
             # Format response for MCP
-            return {
+            weather = {
                 "location": current_data["location"]["name"],
                 "region": current_data["location"]["region"],
                 "country": current_data["location"]["country"],
@@ -182,29 +153,33 @@ class MCPWeatherNode(BaseNode):
                 },
                 "forecast": forecast_data
             }
+            if "stale" in current_data:
+                weather["stale"] = current_data["stale"]
+            else:
+                weather["data_version"] = self._data_version(location)
+            return weather
         except Exception as e:
             return {"error": f"Error getting weather data from MCP: {str(e)}"}
             
+    def _data_version(self, location, days=3):
+        """Combined version of the cached payloads behind the MCP weather data"""
+        current_version = cached_version("current.json", location, aqi="yes")
+        forecast_version = cached_version("forecast.json", location, days=days, aqi="yes", alerts="yes")
+        if current_version is None:
+            return None
+        return f"{current_version}-{forecast_version or 0}"
+            
     def _get_historical_weather(self, location, days=1):
         """Get historical weather data from WeatherAPI.com"""
-        params = {
-            "key": WEATHERAPI_KEY,
-            "q": location,
-            "dt": (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-        }
+        date_str = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
         
         try:
-            response = requests.get(f"{WEATHERAPI_BASE_URL}/history.json", params=params)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = cached_fetch("history.json", location, dt=date_str)
             if data and "forecast" in data and "forecastday" in data["forecast"]:
                 return data["forecast"]["forecastday"]
             return {"error": "No historical data available"}
         except Exception as e:
-            error_msg = f"Error getting historical weather: {e}"
-            print(error_msg)
-            return {"error": error_msg}
+            return _error(f"Error getting historical weather: {e}", e)
     
     def exec(self, prep_res):
         # Get weather using our custom MCP approach
@@ -224,7 +199,11 @@ class MCPWeatherNode(BaseNode):
         if "error" in weather_data:
             shared["error_message"] = weather_data["error"]
             return "error"
-        elif timeframe == "current":
+        
+        # Track demand for the resolved location so it can be prefetched
+        record_location(weather_data.get("location"))
+        
+        if timeframe == "current":
             return "current"
         elif timeframe == "tomorrow":
             return "tomorrow"
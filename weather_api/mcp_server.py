@@ -0,0 +1,563 @@
+"""
+Model Context Protocol server exposing the weather backend as tools
+
+Speaks JSON-RPC 2.0 over two transports:
+
+- stdio: newline-delimited messages on stdin/stdout
+  (``python -m weather_api.mcp_server``)
+- HTTP: the SSE transport (GET /mcp/sse plus POST /mcp/messages) and a
+  plain request/response POST /mcp, registered on the Flask app
+
+Tool calls run on a shared thread pool, so one session can have many calls
+in flight and every session shares the same upstream and render caches.
+On the HTTP transports, tenants (see tenants.py) authenticate with their
+API key: each tool call takes one of the tenant's request tokens and reads
+through the tenant's cache namespace. Every tool call goes through
+admission control like an /api/weather request.
+"""
+import json
+import queue
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from . import admission, tenants, upstream
+from .flow import run_weather_query
+from .structured import api_daily, api_observation, build_structured_response
+from .utils import (
+    get_current_weather,
+    get_forecast,
+    get_historical_weather,
+    get_history_summary,
+    format_current_weather_for_user,
+    format_forecast_for_user,
+    format_historical_for_user,
+    format_history_summary_for_user
+)
+from .settings import settings
+
+SERVER_INFO = {"name": "weather-api-poc", "version": "1.0.0"}
+PROTOCOL_VERSIONS = ["2025-06-18", "2025-03-26", "2024-11-05"]
+
+MCP_MAX_WORKERS = settings.get_int("MCP_MAX_WORKERS", 32)
+# Seconds between SSE keep-alive comments
+MCP_SSE_KEEPALIVE_SECONDS = settings.get_float("MCP_SSE_KEEPALIVE_SECONDS", 15)
+# Seconds POST /mcp waits for a message's answers before giving up on them
+MCP_REPLY_TIMEOUT_SECONDS = settings.get_float("MCP_REPLY_TIMEOUT_SECONDS", 60)
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+# Implementation-defined: quota exceeded or service overloaded
+SERVER_BUSY = -32000
+
+
+class ToolError(Exception):
+    """A tool call failed in a way the calling model should see"""
+
+
+# Admission stage of the tool call running in this context
+_stage: ContextVar[str] = ContextVar("mcp_admission_stage", default="normal")
+
+
+def _location_of(payload: Dict[str, Any]) -> Dict[str, Any]:
+    raw = payload.get("location") or {}
+    return {key: raw.get(key) for key in ("name", "region", "country", "lat", "lon", "tz_id")}
+
+
+def _require_location(arguments: Dict[str, Any]) -> str:
+    location = str(arguments.get("location", "")).strip()
+    if not location:
+        raise ToolError("location is required")
+    return location
+
+
+def tool_get_current(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    location = _require_location(arguments)
+    data = get_current_weather(location)
+    if "error" in data:
+        raise ToolError(data["error"])
+    location_info = _location_of(data)
+    return {
+        "text": format_current_weather_for_user(data, location_info["name"] or location),
+        "data": {"location": location_info, "observation": api_observation(data.get("current"))}
+    }
+
+
+def tool_get_forecast(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    location = _require_location(arguments)
+    try:
+        days = int(arguments.get("days", 3))
+    except (TypeError, ValueError):
+        raise ToolError("days must be an integer")
+    if not 1 <= days <= 14:
+        raise ToolError("days must be between 1 and 14")
+    data = get_forecast(location, days)
+    if "error" in data:
+        raise ToolError(data["error"])
+    location_info = _location_of(data)
+    return {
+        "text": format_forecast_for_user(data, location_info["name"] or location, "week"),
+        "data": {"location": location_info, "daily": api_daily(data)}
+    }
+
+
+def tool_get_history(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    location = _require_location(arguments)
+    data = get_historical_weather(location, arguments.get("date"))
+    if "error" in data:
+        raise ToolError(data["error"])
+    location_info = _location_of(data)
+    return {
+        "text": format_historical_for_user(data, location_info["name"] or location),
+        "data": {"location": location_info, "daily": api_daily(data)}
+    }
+
+
+def tool_get_history_summary(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    location = _require_location(arguments)
+    try:
+        days = int(arguments.get("days", 7))
+    except (TypeError, ValueError):
+        raise ToolError("days must be an integer")
+    data = get_history_summary(location, arguments.get("start_date"), arguments.get("end_date"), days)
+    if "error" in data:
+        raise ToolError(data["error"])
+    location_info = _location_of(data)
+    return {
+        "text": format_history_summary_for_user(data, location_info["name"] or location),
+        "data": {
+            "location": location_info,
+            "start_date": data["start_date"],
+            "end_date": data["end_date"],
+            "summary": data["summary"],
+            "missing_days": data["missing_days"],
+            "daily": api_daily(data)
+        }
+    }
+
+
+def tool_summarize(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    query = str(arguments.get("query", "")).strip()
+    if not query:
+        raise ToolError("query is required")
+    provider = arguments.get("provider", "api")
+    if provider not in ("api", "mcp"):
+        raise ToolError("provider must be 'api' or 'mcp'")
+    options = admission.degrade_options({"structured": True, "text": True, "summary": True}, _stage.get())
+    shared = run_weather_query(query, provider, options)
+    response = build_structured_response(shared)
+    if response["error"] and not response["text"]:
+        raise ToolError(response["error"])
+    return {"text": response["summary"] or response["text"], "data": response}
+
+
+_LOCATION_SCHEMA = {"type": "string", "description": "City name, postcode or 'lat,lon'"}
+
+TOOLS: List[Dict[str, Any]] = [
+    {
+        "name": "get_current",
+        "description": "Current weather conditions for a location",
+        "inputSchema": {
+            "type": "object",
+            "properties": {"location": _LOCATION_SCHEMA},
+            "required": ["location"]
+        }
+    },
+    {
+        "name": "get_forecast",
+        "description": "Daily weather forecast for a location",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "location": _LOCATION_SCHEMA,
+                "days": {"type": "integer", "minimum": 1, "maximum": 14, "default": 3}
+            },
+            "required": ["location"]
+        }
+    },
+    {
+        "name": "get_history",
+        "description": "Observed weather for a location on a past date",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "location": _LOCATION_SCHEMA,
+                "date": {"type": "string", "description": "YYYY-MM-DD, defaults to yesterday"}
+            },
+            "required": ["location"]
+        }
+    },
+    {
+        "name": "get_history_summary",
+        "description": "Totals and extremes of observed weather over a range of past days, e.g. rain last month",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "location": _LOCATION_SCHEMA,
+                "start_date": {"type": "string", "description": "YYYY-MM-DD, defaults to days before end_date"},
+                "end_date": {"type": "string", "description": "YYYY-MM-DD, defaults to yesterday"},
+                "days": {"type": "integer", "minimum": 1, "default": 7}
+            },
+            "required": ["location"]
+        }
+    },
+    {
+        "name": "summarize",
+        "description": "Answer a natural language weather question with a short summary",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "e.g. 'Will it rain tomorrow in Paris?'"},
+                "provider": {"type": "string", "enum": ["api", "mcp"], "default": "api"}
+            },
+            "required": ["query"]
+        }
+    }
+]
+
+TOOL_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "get_current": tool_get_current,
+    "get_forecast": tool_get_forecast,
+    "get_history": tool_get_history,
+    "get_history_summary": tool_get_history_summary,
+    "summarize": tool_summarize
+}
+
+# Shared by every session so calls never wait on the transport's reader
+_executor = ThreadPoolExecutor(max_workers=MCP_MAX_WORKERS, thread_name_prefix="mcp-tool")
+_stats_lock = threading.Lock()
+_tool_calls: Dict[str, int] = {}
+_tool_errors: Dict[str, int] = {}
+_in_flight = 0
+
+
+def call_tool(name: str, arguments: Dict[str, Any], tenant: Optional[tenants.Tenant] = None) -> Dict[str, Any]:
+    """
+    Run a tool and wrap its outcome as an MCP tool result
+
+    The call is admitted like an /api/weather request: under load the
+    summary is skipped, then only cached data is served.
+
+    Args:
+        name: Tool name
+        arguments: Tool arguments
+        tenant: Tenant the call is charged to (None without tenants)
+
+    Returns:
+        MCP CallToolResult dictionary
+
+    Raises:
+        admission.OverloadedError: The service is saturated
+    """
+    global _in_flight
+    with _stats_lock:
+        _tool_calls[name] = _tool_calls.get(name, 0) + 1
+        _in_flight += 1
+    start = time.perf_counter()
+    try:
+        with admission.controller.admit() as stage:
+            if stage == "normal" and name == "summarize" and tenant is not None and not tenant.take_summary():
+                stage = "no_summary"
+            token = _stage.set(stage)
+            try:
+                with upstream.cache_namespace(tenant.cache if tenant is not None else None), \
+                        tenants.acting_for(tenant), \
+                        (upstream.cache_only() if stage == "cache_only" else nullcontext()):
+                    outcome = TOOL_HANDLERS[name](arguments)
+            finally:
+                _stage.reset(token)
+        return {
+            "content": [{"type": "text", "text": outcome["text"] or ""}],
+            "structuredContent": outcome["data"],
+            "isError": False
+        }
+    except ToolError as e:
+        with _stats_lock:
+            _tool_errors[name] = _tool_errors.get(name, 0) + 1
+        return {"content": [{"type": "text", "text": str(e)}], "isError": True}
+    except admission.OverloadedError:
+        with _stats_lock:
+            _tool_errors[name] = _tool_errors.get(name, 0) + 1
+        raise
+    finally:
+        with _stats_lock:
+            _in_flight -= 1
+        if tenant is not None:
+            tenant.record_latency(time.perf_counter() - start)
+
+
+class Session:
+    """
+    One MCP client connection
+
+    Requests are answered through the send callback, possibly out of order
+    and from pool threads; the transport serializes the writes.
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], None], tenant: Optional[tenants.Tenant] = None):
+        self.id = uuid.uuid4().hex
+        self.send = send
+        self.tenant = tenant
+        self.protocol_version: Optional[str] = None
+        self.client_info: Dict[str, Any] = {}
+
+    def handle(self, message: Any) -> int:
+        """
+        Handle one decoded JSON-RPC message or batch
+
+        Args:
+            message: Decoded message (dict) or batch (list)
+
+        Returns:
+            Number of replies that will be sent for it
+        """
+        if isinstance(message, list):
+            return sum(self.handle(item) for item in message)
+        if not isinstance(message, dict) or message.get("jsonrpc") != "2.0":
+            self.send(_error(None, INVALID_REQUEST, "Invalid JSON-RPC message"))
+            return 1
+        if "method" not in message:
+            return 0  # A response to a server request; we never send any
+
+        request_id = message.get("id")
+        method = message["method"]
+        params = message.get("params") or {}
+        if request_id is None:
+            return 0  # Notifications (initialized, cancelled) need no answer
+        if not isinstance(params, dict):
+            self.send(_error(request_id, INVALID_PARAMS, "params must be an object"))
+            return 1
+
+        if method == "tools/call":
+            name = params.get("name")
+            if not isinstance(name, str) or name not in TOOL_HANDLERS:
+                self.send(_error(request_id, INVALID_PARAMS, f"Unknown tool: {name}"))
+                return 1
+            arguments = params.get("arguments") or {}
+            if not isinstance(arguments, dict):
+                self.send(_error(request_id, INVALID_PARAMS, "arguments must be an object"))
+                return 1
+            if self.tenant is not None:
+                retry_after = self.tenant.admit()
+                if retry_after is not None:
+                    self.send(_error(request_id, SERVER_BUSY, f"Request quota exceeded for tenant '{self.tenant.name}'",
+                                     {"retry_after": retry_after}))
+                    return 1
+            future = _executor.submit(call_tool, name, arguments, self.tenant)
+            future.add_done_callback(lambda f: self._reply(request_id, f))
+            return 1
+
+        try:
+            self.send(_result(request_id, self._dispatch(method, params)))
+        except KeyError:
+            self.send(_error(request_id, METHOD_NOT_FOUND, f"Method not found: {method}"))
+        return 1
+
+    def _dispatch(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        if method == "initialize":
+            requested = params.get("protocolVersion")
+            self.protocol_version = requested if requested in PROTOCOL_VERSIONS else PROTOCOL_VERSIONS[0]
+            self.client_info = params.get("clientInfo") or {}
+            return {
+                "protocolVersion": self.protocol_version,
+                "capabilities": {"tools": {"listChanged": False}},
+                "serverInfo": SERVER_INFO
+            }
+        if method == "ping":
+            return {}
+        if method == "tools/list":
+            return {"tools": TOOLS}
+        raise KeyError(method)
+
+    def _reply(self, request_id: Any, future) -> None:
+        try:
+            self.send(_result(request_id, future.result()))
+        except admission.OverloadedError as e:
+            self.send(_error(request_id, SERVER_BUSY, str(e), {"retry_after": e.retry_after}))
+        except Exception as e:
+            print(f"MCP tool error: {e}")
+            self.send(_error(request_id, INTERNAL_ERROR, str(e)))
+
+
+def _result(request_id: Any, result: Dict[str, Any]) -> Dict[str, Any]:
+    return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+def _error(request_id: Any, code: int, message: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    error = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return {"jsonrpc": "2.0", "id": request_id, "error": error}
+
+
+def run_stdio(stdin=None, stdout=None) -> None:
+    """
+    Serve one session over newline-delimited JSON-RPC on stdin/stdout
+
+    Args:
+        stdin: Input stream (defaults to sys.stdin)
+        stdout: Output stream (defaults to sys.stdout)
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    write_lock = threading.Lock()
+
+    def send(message):
+        line = json.dumps(message, ensure_ascii=False)
+        with write_lock:
+            stdout.write(line + "\n")
+            stdout.flush()
+
+    session = Session(send)
+    for line in stdin:
+        if not line.strip():
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            send(_error(None, PARSE_ERROR, "Parse error"))
+            continue
+        session.handle(message)
+    # Let calls still in flight answer before the process exits
+    _executor.shutdown(wait=True)
+
+
+# Sessions of the SSE transport, keyed by session id
+_sse_sessions: Dict[str, Tuple[Session, queue.Queue]] = {}
+_sse_lock = threading.Lock()
+
+
+def register(app) -> None:
+    """
+    Add the MCP HTTP endpoints to a Flask app
+
+    Args:
+        app: Flask application
+    """
+    from flask import Response, jsonify, request, stream_with_context
+
+    def authenticate():
+        """
+        Identify the request's tenant
+
+        Returns:
+            (tenant, None) - the tenant is None when no tenants are
+            configured - or (None, error response)
+        """
+        if not tenants.registry.enabled:
+            return None, None
+        tenant = tenants.registry.authenticate(request.headers)
+        if tenant is None:
+            return None, (jsonify({"error": "Missing or invalid API key"}), 401)
+        return tenant, None
+
+    @app.route('/mcp/sse', methods=['GET'])
+    def mcp_sse():
+        """Open an SSE stream; messages are POSTed to the announced endpoint"""
+        tenant, refused = authenticate()
+        if refused is not None:
+            return refused
+        if tenant is not None:
+            retry_after = tenant.admit()
+            if retry_after is not None:
+                response = jsonify({"error": f"Request quota exceeded for tenant '{tenant.name}'"})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+        outbox: queue.Queue = queue.Queue()
+        session = Session(outbox.put, tenant)
+        with _sse_lock:
+            _sse_sessions[session.id] = (session, outbox)
+
+        def events():
+            try:
+                yield f"event: endpoint\ndata: /mcp/messages?session_id={session.id}\n\n"
+                while True:
+                    try:
+                        message = outbox.get(timeout=MCP_SSE_KEEPALIVE_SECONDS)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield f"event: message\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+            finally:
+                with _sse_lock:
+                    _sse_sessions.pop(session.id, None)
+
+        response = Response(stream_with_context(events()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    @app.route('/mcp/messages', methods=['POST'])
+    def mcp_messages():
+        """Accept a client message for an open SSE session"""
+        tenant, refused = authenticate()
+        if refused is not None:
+            return refused
+        with _sse_lock:
+            entry = _sse_sessions.get(request.args.get('session_id', ''))
+        # Only the tenant that opened the session may post to it
+        if entry is None or entry[0].tenant is not tenant:
+            return jsonify({"error": "Unknown or closed session"}), 404
+        message = request.get_json(silent=True)
+        if message is None:
+            entry[1].put(_error(None, PARSE_ERROR, "Parse error"))
+        else:
+            entry[0].handle(message)
+        return Response(status=202)
+
+    @app.route('/mcp', methods=['POST'])
+    def mcp_post():
+        """Request/response transport: answers come back in the HTTP response"""
+        tenant, refused = authenticate()
+        if refused is not None:
+            return refused
+        message = request.get_json(silent=True)
+        if message is None:
+            return jsonify(_error(None, PARSE_ERROR, "Parse error")), 400
+
+        replies: queue.Queue = queue.Queue()
+        expected = Session(replies.put, tenant).handle(message)
+        if not expected:
+            return Response(status=202)
+        deadline = time.monotonic() + MCP_REPLY_TIMEOUT_SECONDS
+        answers = []
+        try:
+            for _ in range(expected):
+                answers.append(replies.get(timeout=max(deadline - time.monotonic(), 0)))
+        except queue.Empty:
+            # Answer every request that is still running with an error; ids
+            # already answered are left out
+            answered = {answer.get("id") for answer in answers}
+            pending = [item.get("id") for item in (message if isinstance(message, list) else [message])
+                       if isinstance(item, dict) and item.get("id") is not None and "method" in item
+                       and item.get("id") not in answered]
+            answers.extend(_error(request_id, INTERNAL_ERROR,
+                                  f"No answer within {MCP_REPLY_TIMEOUT_SECONDS:g}s") for request_id in pending)
+        return jsonify(answers if isinstance(message, list) else answers[0])
+
+
+def get_stats() -> Dict[str, Any]:
+    """Tool call counters and open sessions"""
+    with _stats_lock:
+        calls = dict(_tool_calls)
+        errors = dict(_tool_errors)
+        in_flight = _in_flight
+    with _sse_lock:
+        sessions = len(_sse_sessions)
+    return {"tool_calls": calls, "tool_errors": errors, "in_flight": in_flight, "sse_sessions": sessions}
+
+
+if __name__ == "__main__":
+    # stdout carries the protocol, so route diagnostic prints to stderr
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+    run_stdio(sys.stdin, protocol_out)
@@ -5,14 +5,27 @@ from pocketflow import BaseNode
 from typing import Dict, Any
 from .utils import (
     extract_weather_parameters,
+    merge_followup_parameters,
     get_location_key,
     get_current_weather,
     get_forecast,
     get_historical_weather,
+    get_history_summary,
     format_current_weather_for_user,
     format_forecast_for_user,
-    format_historical_for_user
+    format_historical_for_user,
+    format_history_summary_for_user
 )
+from . import formatting
+from .policies import NodeFailedError
+from .upstream import peek
+from .prefetch import record_location
+from .sessions import resolved_location, reusable_payload
+
+def wants_text(shared):
+    """Whether the request needs formatted text (for the reply or the AI summary)"""
+    options = shared.get("options", {})
+    return options.get("text", True) or options.get("summary", True)
 
 class InputNode(BaseNode):
     """Node to handle user input and initialize the flow"""
@@ -33,14 +46,18 @@ class InputNode(BaseNode):
 class ParameterExtractionNode(BaseNode):
     """Node to extract parameters from user query"""
     def prep(self, shared):
-        # Get user query from shared context
+        # Get user query and the previous turn's parameters (in a session)
         user_query = shared.get("user_query", "")
-        return {"user_query": user_query}
+        previous = shared.get("session", {}).get("parameters")
+        return {"user_query": user_query, "previous": previous}
     
     def exec(self, prep_res):
-        # Extract parameters from user query
+        # Extract parameters from user query, filling gaps from the last turn
         user_query = prep_res["user_query"]
-        parameters = extract_weather_parameters(user_query)
+        if prep_res["previous"]:
+            parameters = merge_followup_parameters(prep_res["previous"], user_query)
+        else:
+            parameters = extract_weather_parameters(user_query)
         return {"parameters": parameters}
     
     def post(self, shared, prep_res, exec_res):
@@ -56,7 +73,7 @@ class LocationResolverNode(BaseNode):
         location = parameters.get("location", "")
         provider = shared.get("provider", "api")  # Default to API if not specified
         
-        return {"location": location, "provider": provider}
+        return {"location": location, "provider": provider, "resolved": resolved_location(shared, location)}
     
     def exec(self, prep_res):
         # Get location information from WeatherAPI.com if using API provider
@@ -67,11 +84,26 @@ class LocationResolverNode(BaseNode):
         if provider == "mcp":
             return {"location_data": {"name": location}}
         
+        # A follow-up about the same place reuses the session's resolution
+        if prep_res["resolved"] is not None:
+            return {"location_data": prep_res["resolved"]}
+        
         # Otherwise, validate location with WeatherAPI.com
         location_data = get_location_key(location)
         
         return {"location_data": location_data}
     
+    def cached_fallback(self, prep_res, error):
+        """Policy fallback: resolve from cached conditions when upstream is too slow"""
+        if prep_res["provider"] == "mcp":
+            return {"location_data": {"name": prep_res["location"]}}
+        data = peek("current.json", prep_res["location"], aqi="no")
+        if data is None:
+            return {"location_data": {"error": f"Error validating location: {error}"}}
+        location = data["location"]
+        return {"location_data": {"name": location["name"], "region": location["region"],
+                                  "country": location["country"]}}
+    
     def post(self, shared, prep_res, exec_res):
         # Store location data in shared context
         location_data = exec_res["location_data"]
@@ -92,6 +124,9 @@ class LocationResolverNode(BaseNode):
         shared["location_region"] = location_data.get("region", "")
         shared["location_country"] = location_data.get("country", "")
         
+        # Track demand for the resolved location so it can be prefetched
+        record_location(location_data["name"])
+        
         return "success"
 
 class CurrentWeatherNode(BaseNode):
@@ -99,12 +134,22 @@ class CurrentWeatherNode(BaseNode):
     def prep(self, shared):
         # Get location name from shared context
         location_name = shared.get("location_name")
-        return {"location_name": location_name}
+        return {"location_name": location_name, "loaded": reusable_payload(shared, "current_weather")}
     
     def exec(self, prep_res):
-        # Get current weather from WeatherAPI.com
+        # Get current weather from WeatherAPI.com (unless loaded earlier in the session)
         location_name = prep_res["location_name"]
-        weather_data = get_current_weather(location_name)
+        weather_data = prep_res["loaded"] or get_current_weather(location_name)
+        return {"weather_data": weather_data}
+    
+    def cached_fallback(self, prep_res, error):
+        """Policy fallback: the last cached conditions, however old"""
+        weather_data = peek("current.json", prep_res["location_name"], aqi="no")
+        if weather_data is None:
+            if isinstance(error, NodeFailedError):
+                # Already an "Error getting current weather" payload
+                return error.exec_res
+            weather_data = {"error": f"Error getting current weather: {error}"}
         return {"weather_data": weather_data}
     
     def post(self, shared, prep_res, exec_res):
@@ -112,12 +157,13 @@ class CurrentWeatherNode(BaseNode):
         shared["current_weather"] = exec_res["weather_data"]
         
         # Format weather data for user
-        formatted_response = format_current_weather_for_user(
-            exec_res["weather_data"], 
-            prep_res["location_name"]
-        )
-        
-        shared["current_weather_response"] = formatted_response
+        if wants_text(shared):
+            formatted_response = format_current_weather_for_user(
+                exec_res["weather_data"], 
+                prep_res["location_name"]
+            )
+            
+            shared["current_weather_response"] = formatted_response
         
         # Return a string action based on timeframe
         timeframe = shared.get("parameters", {}).get("timeframe", "current")
@@ -133,12 +179,22 @@ class ForecastNode(BaseNode):
     def prep(self, shared):
         # Get location name from shared context
         location_name = shared.get("location_name")
-        return {"location_name": location_name}
+        return {"location_name": location_name, "loaded": reusable_payload(shared, "forecast")}
     
     def exec(self, prep_res):
-        # Get forecast from WeatherAPI.com
+        # Get forecast from WeatherAPI.com (unless loaded earlier in the session)
         location_name = prep_res["location_name"]
-        forecast_data = get_forecast(location_name)
+        forecast_data = prep_res["loaded"] or get_forecast(location_name)
+        return {"forecast_data": forecast_data}
+    
+    def cached_fallback(self, prep_res, error):
+        """Policy fallback: the last cached forecast, however old"""
+        forecast_data = peek("forecast.json", prep_res["location_name"], days=3, aqi="no", alerts="no")
+        if forecast_data is None:
+            if isinstance(error, NodeFailedError):
+                # Already an "Error getting forecast" payload
+                return error.exec_res
+            forecast_data = {"error": f"Error getting forecast: {error}"}
         return {"forecast_data": forecast_data}
     
     def post(self, shared, prep_res, exec_res):
@@ -149,26 +205,35 @@ class ForecastNode(BaseNode):
         timeframe = shared.get("parameters", {}).get("timeframe", "week")
         
         # Format forecast data for user
-        formatted_response = format_forecast_for_user(
-            exec_res["forecast_data"], 
-            prep_res["location_name"],
-            timeframe
-        )
-        
-        shared["forecast_response"] = formatted_response
+        if wants_text(shared):
+            formatted_response = format_forecast_for_user(
+                exec_res["forecast_data"], 
+                prep_res["location_name"],
+                timeframe
+            )
+            
+            shared["forecast_response"] = formatted_response
         return "default"  # Return a string action instead of a dict
 
 class HistoricalWeatherNode(BaseNode):
     """Node to get historical weather data"""
     def prep(self, shared):
-        # Get location name from shared context
+        # Get location name and requested range from shared context
         location_name = shared.get("location_name")
-        return {"location_name": location_name}
+        history_days = shared.get("parameters", {}).get("history_days")
+        loaded = reusable_payload(shared, "historical_weather")
+        return {"location_name": location_name, "history_days": history_days, "loaded": loaded}
     
     def exec(self, prep_res):
-        # Get historical weather from WeatherAPI.com
+        # Get historical weather from WeatherAPI.com (or the local history store,
+        # or the session)
         location_name = prep_res["location_name"]
-        historical_data = get_historical_weather(location_name)
+        if prep_res["loaded"]:
+            historical_data = prep_res["loaded"]
+        elif prep_res["history_days"]:
+            historical_data = get_history_summary(location_name, days=prep_res["history_days"])
+        else:
+            historical_data = get_historical_weather(location_name)
         return {"historical_data": historical_data}
     
     def post(self, shared, prep_res, exec_res):
@@ -176,14 +241,32 @@ class HistoricalWeatherNode(BaseNode):
         shared["historical_weather"] = exec_res["historical_data"]
         
         # Format historical data for user
-        formatted_response = format_historical_for_user(
-            exec_res["historical_data"], 
-            prep_res["location_name"]
-        )
-        
-        shared["historical_response"] = formatted_response
+        if wants_text(shared):
+            format_historical = format_history_summary_for_user if prep_res["history_days"] else format_historical_for_user
+            formatted_response = format_historical(
+                exec_res["historical_data"], 
+                prep_res["location_name"]
+            )
+            
+            shared["historical_response"] = formatted_response
         return "default"  # Return a string action instead of a dict
 
+class ProviderSwitchNode(BaseNode):
+    """Node that reroutes the rest of the flow to another data provider"""
+    def __init__(self, provider="api"):
+        super().__init__()
+        self.provider = provider
+    
+    def prep(self, shared):
+        return {"from_provider": shared.get("provider", "api")}
+    
+    def post(self, shared, prep_res, exec_res):
+        # Answer with the other provider's data and formatting
+        print(f"Switching provider from {prep_res['from_provider']} to {self.provider}")
+        shared["provider"] = self.provider
+        shared.pop("mcp_weather", None)
+        return "default"
+
 class ResponseFormatterNode(BaseNode):
     """Node to format the final response to the user"""
     def prep(self, shared):
@@ -203,6 +286,7 @@ class ResponseFormatterNode(BaseNode):
         return {
             "timeframe": timeframe,
             "provider": provider,
+            "render": wants_text(shared),
             "current_weather_response": current_weather_response,
             "forecast_response": forecast_response,
             "historical_response": historical_response,
@@ -218,6 +302,10 @@ class ResponseFormatterNode(BaseNode):
         historical_response = prep_res["historical_response"]
         mcp_weather = prep_res["mcp_weather"]
         
+        # Data-only requests skip text formatting entirely
+        if not prep_res["render"]:
+            return {"final_response": None}
+        
         if provider == "mcp":
             # Handle MCP weather responses
             if timeframe == "current":
@@ -243,126 +331,37 @@ class ResponseFormatterNode(BaseNode):
     
     def _format_mcp_current(self, weather_data):
         """Format MCP current weather data"""
-        if not weather_data or "current_conditions" not in weather_data:
-            return "Sorry, I couldn't get the current weather information."
-        
-        current = weather_data["current_conditions"]
-        location = weather_data.get("location", "Unknown location")
-        region = weather_data.get("region", "")
-        country = weather_data.get("country", "")
-        
-        temp = current.get("temperature", {})
-        temp_value = temp.get("value", "N/A")
-        temp_unit = temp.get("unit", "C")
-        weather_text = current.get("weather_text", "Unknown conditions")
-        humidity = current.get("relative_humidity", "N/A")
-        wind = current.get("wind", {})
-        wind_speed = wind.get("speed", "N/A")
-        wind_dir = wind.get("direction", "N/A")
-        precip = current.get("precipitation", "N/A")
-        obs_time = current.get("observation_time", "N/A")
-        
-        response = f"Current weather for {location}, {region}, {country}:\n"
-        response += f"• Condition: {weather_text}\n"
-        response += f"• Temperature: {temp_value}°{temp_unit}\n"
-        response += f"• Humidity: {humidity}%\n"
-        response += f"• Wind: {wind_speed} km/h {wind_dir}\n"
-        response += f"• Precipitation: {precip} mm\n"
-        response += f"• Observation time: {obs_time}\n"
-        
-        return response
+        return self._render_mcp("current", weather_data, formatting.render_mcp_current)
     
     def _format_mcp_tomorrow(self, weather_data):
         """Format MCP tomorrow's weather data"""
-        forecast = weather_data.get("forecast", [])
-        location = weather_data.get("location", "Unknown location")
-        region = weather_data.get("region", "")
-        country = weather_data.get("country", "")
-        
-        if not forecast or len(forecast) < 2:
-            return f"Sorry, I couldn't get tomorrow's weather forecast."
-        
-        tomorrow = forecast[1]  # Second day is tomorrow
-        date = tomorrow.get("date", "tomorrow")
-        max_temp_c = tomorrow.get("max_temp_c", "N/A")
-        min_temp_c = tomorrow.get("min_temp_c", "N/A")
-        condition = tomorrow.get("condition", "Unknown conditions")
-        chance_of_rain = tomorrow.get("chance_of_rain", "N/A")
-        chance_of_snow = tomorrow.get("chance_of_snow", "N/A")
-        
-        try:
-            from datetime import datetime
-            date_obj = datetime.strptime(date, "%Y-%m-%d")
-            formatted_date = date_obj.strftime("%A, %B %d")
-        except:
-            formatted_date = date
-        
-        response = f"Tomorrow's forecast for {location}, {region}, {country} ({formatted_date}):\n"
-        response += f"• Condition: {condition}\n"
-        response += f"• High: {max_temp_c}°C\n"
-        response += f"• Low: {min_temp_c}°C\n"
-        response += f"• Chance of rain: {chance_of_rain}%\n"
-        response += f"• Chance of snow: {chance_of_snow}%\n"
-        return response
+        return self._render_mcp("tomorrow", weather_data, formatting.render_mcp_tomorrow)
     
     def _format_mcp_week(self, weather_data):
         """Format MCP weekly weather data"""
-        forecast = weather_data.get("forecast", [])
-        location = weather_data.get("location", "Unknown location")
-        region = weather_data.get("region", "")
-        country = weather_data.get("country", "")
-        
-        if not forecast:
-            return "Sorry, I couldn't get the weekly weather forecast."
-        
-        response = f"Weather forecast for {location}, {region}, {country} (up to {len(forecast)} days):\n\n"
-        for day in forecast:
-            date = day.get("date", "Unknown")
-            condition = day.get("condition", "Unknown conditions")
-            max_temp_c = day.get("max_temp_c", "N/A")
-            min_temp_c = day.get("min_temp_c", "N/A")
-            chance_of_rain = day.get("chance_of_rain", "N/A")
-            chance_of_snow = day.get("chance_of_snow", "N/A")
-            try:
-                from datetime import datetime
-                date_obj = datetime.strptime(date, "%Y-%m-%d")
-                formatted_date = date_obj.strftime("%A, %B %d")
-            except:
-                formatted_date = date
-            response += f"📅 {formatted_date}:\n"
-            response += f"   • Condition: {condition}\n"
-            response += f"   • High: {max_temp_c}°C\n"
-            response += f"   • Low: {min_temp_c}°C\n"
-            response += f"   • Chance of rain: {chance_of_rain}%\n"
-            response += f"   • Chance of snow: {chance_of_snow}%\n\n"
-        return response.strip()
+        return self._render_mcp("week", weather_data, formatting.render_mcp_week)
     
     def _format_mcp_historical(self, weather_data):
         """Format MCP historical weather data"""
-        if not weather_data or "historical" not in weather_data:
-            return "Sorry, I couldn't get the historical weather information."
-        
-        historical = weather_data["historical"]
-        location = weather_data.get("location", "Unknown location")
-        
-        response = f"Historical weather for {location}:\n"
-        response += f"• Date: {historical.get('date', 'N/A')}\n"
-        response += f"• High: {historical.get('high', 'N/A')}°F\n"
-        response += f"• Low: {historical.get('low', 'N/A')}°F\n"
-        response += f"• Condition: {historical.get('condition', 'N/A')}\n"
-        
-        return response
+        return self._render_mcp("historical", weather_data, formatting.render_mcp_historical)
+    
+    def _render_mcp(self, timeframe, weather_data, renderer):
+        """Render MCP weather data, reusing output for an unchanged data version"""
+        # Nearby places can share cached data, so the name is part of the key
+        key = ("mcp", timeframe, weather_data.get("location") if isinstance(weather_data, dict) else None)
+        return formatting.render(key, weather_data, lambda: renderer(weather_data))
     
     def post(self, shared, prep_res, exec_res):
         # Store final response in shared context
         shared["final_response"] = exec_res["final_response"]
+        shared["weather_text"] = exec_res["final_response"]
         return "default"  # Return a string action instead of a dict
 
 class ErrorHandlerNode(BaseNode):
     """Node to handle errors and format error messages"""
     def prep(self, shared):
-        # Get error message if any
-        error = shared.get("error", "Unknown error occurred")
+        # Get error message if any (MCPWeatherNode reports its own as error_message)
+        error = shared.get("error") or shared.get("error_message") or "Unknown error occurred"
         return {"error": error}
     
     def exec(self, prep_res):
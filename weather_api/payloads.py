@@ -0,0 +1,199 @@
+"""
+Explicit lifetimes for the payloads a flow keeps in ``shared``
+
+Nodes leave payloads and intermediate text in the shared context, where
+they would stay reachable until the response is sent (and, for sessions,
+for as long as the session lives). Instead, each payload is released once
+the node that last needs it in full has finished:
+
+    MCPWeatherNode
+        MCP weather -> the same without the hourly forecast
+    ResponseFormatterNode
+        per-section text -> released (it lives on in final_response)
+    ForecastNode, HistoricalWeatherNode
+        raw payload -> compact projection without the hourly records
+
+The MCP weather dicts and the section texts are built for the request, so
+releasing them frees memory during the rest of the flow (the OpenAI call
+included). Forecast and history payloads are the weather cache's own
+objects: projecting them frees nothing while the cache entry lives. It
+only keeps sessions from holding the hourly records after the cache has
+let go of them, so these keys don't count as released bytes.
+
+Later readers (the summary router's templates, structured responses and
+sessions) only use what the projections keep: the location, the current
+block and the daily and astro data of each day.
+
+With PAYLOAD_ACCOUNTING_ENABLED, each flow run also accounts for the
+payload memory it holds: the deep size of the tracked keys after every node
+gives the run's peak, and releases report the bytes they gave back. The
+totals are per request in ``shared["payload_memory"]`` and aggregated for
+/metrics. Measuring walks every payload, so it is off by default and meant
+for benchmarks and investigations.
+"""
+import sys
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from .settings import settings
+
+PAYLOAD_RELEASE_ENABLED = settings.get_bool("PAYLOAD_RELEASE_ENABLED", True)
+PAYLOAD_ACCOUNTING_ENABLED = settings.get_bool("PAYLOAD_ACCOUNTING_ENABLED", False)
+
+# Keys holding payloads or text derived from them
+TRACKED_KEYS = ("current_weather", "forecast", "historical_weather", "mcp_weather", "current_weather_response",
+                "forecast_response", "historical_response", "weather_text", "final_response", "ai_summary")
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "peak_bytes_total": 0, "peak_bytes_max": 0, "final_bytes_total": 0, "released_bytes": 0}
+
+
+def compact_api_payload(payload: Any) -> Any:
+    """
+    WeatherAPI.com forecast or history payload without its hourly records
+
+    Args:
+        payload: forecast.json / history.json payload (anything else is
+            returned as is)
+
+    Returns:
+        A shallow copy whose days keep everything but ``hour``
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get("forecast"), dict):
+        return payload
+    days = payload["forecast"].get("forecastday")
+    if not isinstance(days, list) or not any(isinstance(day, dict) and "hour" in day for day in days):
+        return payload
+    compact_days = [{key: value for key, value in day.items() if key != "hour"} if isinstance(day, dict) else day
+                    for day in days]
+    return {**payload, "forecast": {**payload["forecast"], "forecastday": compact_days}}
+
+
+def compact_mcp_weather(weather: Any) -> Any:
+    """MCP weather data without the hourly forecast of each day"""
+    if not isinstance(weather, dict) or not isinstance(weather.get("forecast"), list):
+        return weather
+    days = [{key: value for key, value in day.items() if key != "hourly"} if isinstance(day, dict) else day
+            for day in weather["forecast"]]
+    return {**weather, "forecast": days}
+
+
+# Keys holding the weather cache's payloads, which a release doesn't free
+CACHED_KEYS = ("forecast", "historical_weather")
+
+# Node -> {key: projection to keep, or None to drop the key}
+RELEASES: Dict[str, Dict[str, Optional[Callable[[Any], Any]]]] = {
+    "ForecastNode": {"forecast": compact_api_payload},
+    "HistoricalWeatherNode": {"historical_weather": compact_api_payload},
+    "MCPWeatherNode": {"mcp_weather": compact_mcp_weather},
+    "ResponseFormatterNode": {"current_weather_response": None, "forecast_response": None,
+                              "historical_response": None}
+}
+
+
+def deep_size(value: Any) -> int:
+    """Approximate bytes held by a JSON-like value (objects counted once)"""
+    seen = set()
+    pending = [value]
+    size = 0
+    while pending:
+        item = pending.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            pending.extend(item)
+    return size
+
+
+class PayloadTracker:
+    """Payload lifetimes and memory accounting for one flow run"""
+
+    def __init__(self, release: bool = PAYLOAD_RELEASE_ENABLED, accounting: bool = PAYLOAD_ACCOUNTING_ENABLED):
+        """
+        Args:
+            release: Release payloads after their last consumer
+            accounting: Measure the payload memory held
+        """
+        self.release = release
+        self.accounting = accounting
+        # Key -> (id of the value measured, its size); values are only
+        # measured again when a node replaces them
+        self._sizes: Dict[str, Tuple[int, int]] = {}
+        self.peak_bytes = 0
+        self.released_bytes = 0
+
+    def _size(self, key: str, value: Any) -> int:
+        measured = self._sizes.get(key)
+        if measured is None or measured[0] != id(value):
+            measured = self._sizes[key] = (id(value), deep_size(value))
+        return measured[1]
+
+    def held_bytes(self, shared: Dict[str, Any]) -> int:
+        """Bytes held by the tracked keys right now"""
+        return sum(self._size(key, shared[key]) for key in TRACKED_KEYS if key in shared)
+
+    def after_node(self, name: str, shared: Dict[str, Any]) -> None:
+        """
+        Account for a node's output, then release what it was the last to need
+
+        Args:
+            name: Class name of the node that just finished
+            shared: Shared context
+        """
+        if self.accounting:
+            self.peak_bytes = max(self.peak_bytes, self.held_bytes(shared))
+        if not self.release:
+            return
+        for key, projection in RELEASES.get(name, {}).items():
+            if key not in shared:
+                continue
+            before = self._size(key, shared[key]) if self.accounting else 0
+            if projection is None:
+                del shared[key]
+                self._sizes.pop(key, None)
+                self.released_bytes += before
+            else:
+                shared[key] = projection(shared[key])
+                if self.accounting:
+                    self._sizes.pop(key, None)
+                    if key not in CACHED_KEYS:
+                        self.released_bytes += before - self._size(key, shared[key])
+
+    def finish(self, shared: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Close the run's accounting and add it to the statistics
+
+        Returns:
+            {"peak_bytes", "final_bytes", "released_bytes"} (empty with
+            accounting off)
+        """
+        if not self.accounting:
+            return {}
+        final_bytes = self.held_bytes(shared)
+        self.peak_bytes = max(self.peak_bytes, final_bytes)
+        with _stats_lock:
+            _stats["requests"] += 1
+            _stats["peak_bytes_total"] += self.peak_bytes
+            _stats["peak_bytes_max"] = max(_stats["peak_bytes_max"], self.peak_bytes)
+            _stats["final_bytes_total"] += final_bytes
+            _stats["released_bytes"] += self.released_bytes
+        return {"peak_bytes": self.peak_bytes, "final_bytes": final_bytes, "released_bytes": self.released_bytes}
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    requests = stats["requests"]
+    return {
+        "release_enabled": PAYLOAD_RELEASE_ENABLED,
+        "accounting_enabled": PAYLOAD_ACCOUNTING_ENABLED,
+        "requests": requests,
+        "avg_peak_bytes": round(stats["peak_bytes_total"] / requests) if requests else None,
+        "max_peak_bytes": stats["peak_bytes_max"],
+        "avg_final_bytes": round(stats["final_bytes_total"] / requests) if requests else None,
+        "released_bytes": stats["released_bytes"]
+    }
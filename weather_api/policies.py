@@ -0,0 +1,203 @@
+"""
+Retry, timeout and fallback policies for flow nodes
+
+A policy is attached to a node in create_weather_flow and applied by the
+flow when the node runs:
+
+    current_weather.policy = NodePolicy(max_retries=1, timeout=8,
+                                        fallback=current_weather.cached_fallback)
+    mcp_weather.policy = NodePolicy(timeout=8, fallback="api")
+
+Each attempt runs the node's exec() with an optional time budget. An
+attempt fails if exec() raises, runs past the budget, or returns a result
+the policy's ``failed`` check rejects. Failed attempts are retried with
+exponential backoff. When every attempt has failed, the fallback decides
+what happens:
+
+    None          the node behaves as it would without a policy
+    "action"      post() is skipped and the flow follows this action
+    callable      fallback(prep_res, error) supplies the exec result
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Union
+from . import profiling
+from .settings import settings
+
+# Threads running node attempts that have a time budget. An attempt that
+# runs out of time keeps its thread until it finishes on its own.
+NODE_POLICY_MAX_WORKERS = settings.get_int("NODE_POLICY_MAX_WORKERS", 32)
+
+_executor = ThreadPoolExecutor(max_workers=NODE_POLICY_MAX_WORKERS, thread_name_prefix="flow-node")
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+class NodeTimeoutError(Exception):
+    """Raised when a node attempt runs past its time budget"""
+
+
+class NodeFailedError(Exception):
+    """Raised when a node returned a result its policy treats as a failure"""
+
+    def __init__(self, exec_res: Any):
+        self.exec_res = exec_res
+        super().__init__(describe_error(exec_res) or "node reported an error")
+
+
+def describe_error(exec_res: Any) -> Optional[str]:
+    """
+    Error message carried by a node result, if any
+
+    Nodes report upstream problems as {"error": ...} payloads inside their
+    result rather than raising.
+
+    Args:
+        exec_res: Result of a node's exec()
+
+    Returns:
+        The first error message found, or None
+    """
+    if not isinstance(exec_res, dict):
+        return None
+    if "error" in exec_res:
+        return str(exec_res["error"])
+    for value in exec_res.values():
+        if isinstance(value, dict) and "error" in value:
+            return str(value["error"])
+    return None
+
+
+def retryable_error(exec_res: Any) -> bool:
+    """
+    Whether a node result carries an error worth retrying
+
+    Error payloads may record the upstream HTTP ``status``. Client errors
+    such as an unknown location (4xx other than 429) are answers, not
+    failures: retrying or falling back won't change them.
+
+    Args:
+        exec_res: Result of a node's exec()
+
+    Returns:
+        True for errors without a status, server errors and rate limiting
+    """
+    if describe_error(exec_res) is None:
+        return False
+    payloads = [exec_res] + [value for value in exec_res.values() if isinstance(value, dict)]
+    for payload in payloads:
+        if "error" in payload:
+            status = payload.get("status")
+            return not (isinstance(status, int) and 400 <= status < 500 and status != 429)
+    return True
+
+
+class NodePolicy:
+    """Declarative retry / timeout / fallback settings for one node"""
+
+    def __init__(self, max_retries: int = 0, backoff: float = 0.2, backoff_factor: float = 2.0,
+                 timeout: Optional[float] = None,
+                 fallback: Union[None, str, Callable[[Any, Exception], Any]] = None,
+                 failed: Optional[Callable[[Any], bool]] = None):
+        """
+        Args:
+            max_retries: Attempts after the first one
+            backoff: Seconds to wait before the first retry
+            backoff_factor: Multiplier applied to the wait after each retry
+            timeout: Time budget per attempt in seconds (None for no limit)
+            fallback: Action to follow, or function producing the exec
+                result, once every attempt failed (see module docstring)
+            failed: Check marking a returned result as a failed attempt
+                (defaults to results carrying an error payload)
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.fallback = fallback
+        self.failed = failed if failed is not None else (lambda exec_res: describe_error(exec_res) is not None)
+
+    def _attempt(self, node: Any, prep_res: Any) -> Any:
+        if self.timeout is None:
+            return node._exec(prep_res)
+        name = type(node).__name__
+        began: List[float] = []
+        running = threading.Event()
+
+        def attempt() -> Any:
+            began.append(time.monotonic())
+            running.set()
+            return profiling.traced(node._exec)(prep_res)
+
+        # Run in the caller's context so request-scoped state (the upstream
+        # trace, a request profile) still sees the attempt's work
+        context = contextvars.copy_context()
+        future = _executor.submit(context.run, attempt)
+        # The budget starts when a worker picks the attempt up. Waiting for
+        # a worker gets a budget of its own; an attempt still queued after
+        # it is cancelled and never runs.
+        if not running.wait(self.timeout) and future.cancel():
+            raise NodeTimeoutError(f"{name} waited longer than {self.timeout}s for a worker")
+        running.wait()
+        try:
+            return future.result(timeout=max(began[0] + self.timeout - time.monotonic(), 0.0))
+        except FutureTimeoutError:
+            raise NodeTimeoutError(f"{name} took longer than {self.timeout}s")
+
+    def run(self, node: Any, shared: Dict[str, Any]) -> Any:
+        """
+        Run a node's prep / exec / post under this policy
+
+        Args:
+            node: Flow node
+            shared: Shared context
+
+        Returns:
+            The action the flow should follow
+        """
+        name = type(node).__name__
+        prep_res = node.prep(shared)
+        wait = self.backoff
+        error: Exception = RuntimeError("no attempt made")
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                _count(name, "retries")
+                time.sleep(wait)
+                wait *= self.backoff_factor
+            try:
+                exec_res = self._attempt(node, prep_res)
+                if self.failed(exec_res):
+                    raise NodeFailedError(exec_res)
+                return node.post(shared, prep_res, exec_res)
+            except NodeTimeoutError as e:
+                _count(name, "timeouts")
+                error = e
+            except Exception as e:
+                error = e
+
+        if self.fallback is None:
+            if isinstance(error, NodeFailedError):
+                # Let the node handle its own error payload as usual
+                return node.post(shared, prep_res, error.exec_res)
+            raise error
+
+        _count(name, "fallbacks")
+        print(f"{name} failed ({error}); falling back")
+        shared.setdefault("fallbacks", []).append({"node": name, "reason": str(error)})
+        if isinstance(self.fallback, str):
+            return self.fallback
+        return node.post(shared, prep_res, self.fallback(prep_res, error))
+
+
+def _count(node_name: str, event: str) -> None:
+    with _stats_lock:
+        counters = _stats.setdefault(node_name, {"retries": 0, "timeouts": 0, "fallbacks": 0})
+        counters[event] += 1
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    with _stats_lock:
+        return {name: dict(counters) for name, counters in _stats.items()}
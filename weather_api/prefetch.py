@@ -0,0 +1,230 @@
+"""
+Background prefetch of weather data for frequently requested locations
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from . import upstream
+from .upstream import weather_cache, geo_cell_for, normalize_location, refresh, refresh_many
+from .settings import settings
+
+PREFETCH_ENABLED = settings.get_bool("PREFETCH_ENABLED", True)
+PREFETCH_TOP_N = settings.get_int("PREFETCH_TOP_N", 25)
+PREFETCH_LEAD_SECONDS = settings.get_float("PREFETCH_LEAD_SECONDS", 60)
+PREFETCH_INTERVAL_SECONDS = settings.get_float("PREFETCH_INTERVAL_SECONDS", 15)
+# Share of the upstream quota the refresher may spend (0.0 - 1.0)
+PREFETCH_QUOTA_SHARE = settings.get_float("PREFETCH_QUOTA_SHARE", 0.2)
+# Upstream quota in calls per minute for the WeatherAPI.com plan in use
+WEATHERAPI_CALLS_PER_MINUTE = settings.get_float("WEATHERAPI_CALLS_PER_MINUTE", 60)
+
+
+class LocationTracker:
+    """
+    Tracks how often each resolved location is requested.
+
+    Counts decay exponentially so that yesterday's trending city does not
+    stay "hot" forever.
+    """
+
+    def __init__(self, half_life: float = 3600.0):
+        self.half_life = half_life
+        self._scores: Dict[str, float] = {}
+        self._updated: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, name: str, now: float) -> float:
+        elapsed = now - self._updated.get(name, now)
+        return self._scores.get(name, 0.0) * 0.5 ** (elapsed / self.half_life)
+
+    def record(self, location: str) -> None:
+        """Record one request for a resolved location name"""
+        if not location:
+            return
+        name = normalize_location(location)
+        now = time.time()
+        with self._lock:
+            self._scores[name] = self._decayed(name, now) + 1.0
+            self._updated[name] = now
+
+    def top(self, n: int) -> List[str]:
+        """Return the n most requested locations, hottest first"""
+        now = time.time()
+        with self._lock:
+            scored = [(self._decayed(name, now), name) for name in self._scores]
+            # Drop locations that have decayed to nothing
+            for score, name in scored:
+                if score < 0.01:
+                    del self._scores[name]
+                    del self._updated[name]
+        scored.sort(reverse=True)
+        return [name for score, name in scored[:n] if score >= 0.01]
+
+
+class TokenBucket:
+    """Simple token bucket used to cap the refresher's upstream spend"""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Seconds until ``tokens`` can be taken (0 if they can be now)"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            return max(tokens - self.tokens, 0.0) / self.rate
+
+    def settle(self, tokens: float) -> None:
+        """
+        Correct an earlier acquisition once its real cost is known
+
+        Args:
+            tokens: Tokens spent beyond what was taken (negative to give
+                unused ones back); the bucket may go into debt, which
+                later refills pay off before anything else is admitted
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate - tokens)
+            self.updated = now
+
+
+class PrefetchRefresher(threading.Thread):
+    """
+    Daemon thread that refreshes cached data for the hottest locations
+    shortly before it expires, so interactive requests stay on the cache.
+    """
+
+    def __init__(self, tracker: LocationTracker, top_n: int = PREFETCH_TOP_N,
+                 lead_seconds: float = PREFETCH_LEAD_SECONDS,
+                 interval: float = PREFETCH_INTERVAL_SECONDS,
+                 quota_share: float = PREFETCH_QUOTA_SHARE,
+                 calls_per_minute: float = WEATHERAPI_CALLS_PER_MINUTE):
+        super().__init__(name="weather-prefetch", daemon=True)
+        self.tracker = tracker
+        self.top_n = top_n
+        self.lead_seconds = lead_seconds
+        self.interval = interval
+        budget_per_minute = max(calls_per_minute * quota_share, 0.0)
+        self.budget = TokenBucket(budget_per_minute / 60.0, max(budget_per_minute, 1.0))
+        self._stop_event = threading.Event()
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped_budget = 0
+
+    def due_keys(self) -> List[Any]:
+        """Cache keys of hot locations that expire within the lead time"""
+        hot = set(self.tracker.top(self.top_n))
+        if not hot:
+            return []
+
+        # Geo-keyed entries are matched by the cells hot locations resolve to
+        hot_cells = {cell for cell in map(geo_cell_for, hot) if cell is not None}
+
+        def is_due(key, entry):
+            # Location lookups live for days; only weather data is kept warm
+            if entry.meta.get("endpoint", "search.json") == "search.json":
+                return False
+            names = {normalize_location(entry.meta["location"]), entry.meta.get("resolved")}
+            return bool(hot & names or key[1] in hot_cells) and entry.ttl_remaining <= self.lead_seconds
+
+        due = weather_cache.entries(is_due)
+        # Refresh whatever expires first
+        due.sort(key=lambda item: item[1].expires_at)
+        return [key for key, entry in due]
+
+    def run_once(self) -> int:
+        """Refresh due entries within budget and return how many were refreshed"""
+        count = 0
+        keys = self.due_keys()
+        if upstream.BULK_ENABLED:
+            # Current conditions go out as bulk requests costing one call each
+            current = [key for key in keys if key[0] == "current.json"]
+            keys = [key for key in keys if key[0] != "current.json"]
+            size = upstream.BULK_MAX_LOCATIONS
+            for start in range(0, len(current), size):
+                if not self.budget.try_acquire():
+                    self.skipped_budget += 1
+                    return count
+                chunk = current[start:start + size]
+                refreshed = refresh_many(chunk)
+                count += refreshed
+                self.refreshed += refreshed
+                self.failed += len(chunk) - refreshed
+
+        for key in keys:
+            if not self.budget.try_acquire():
+                self.skipped_budget += 1
+                break
+            if refresh(key):
+                count += 1
+                self.refreshed += 1
+            else:
+                self.failed += 1
+        return count
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Prefetch error: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+location_tracker = LocationTracker()
+_refresher: Optional[PrefetchRefresher] = None
+_refresher_lock = threading.Lock()
+
+
+def record_location(location: str) -> None:
+    """Record a request for a resolved location name"""
+    location_tracker.record(location)
+
+
+def start_prefetcher() -> Optional[PrefetchRefresher]:
+    """
+    Start the background refresher once per process
+
+    Returns:
+        The running refresher, or None if prefetching is disabled
+    """
+    global _refresher
+    if not PREFETCH_ENABLED:
+        return None
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = PrefetchRefresher(location_tracker)
+            _refresher.start()
+    return _refresher
+
+
+def get_stats() -> Dict[str, Any]:
+    stats = {
+        "enabled": PREFETCH_ENABLED,
+        "hot_locations": location_tracker.top(PREFETCH_TOP_N)
+    }
+    if _refresher is not None:
+        stats.update({
+            "refreshed": _refresher.refreshed,
+            "failed": _refresher.failed,
+            "skipped_budget": _refresher.skipped_budget,
+            "budget_per_minute": round(_refresher.budget.rate * 60, 2)
+        })
+    return stats
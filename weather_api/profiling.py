@@ -0,0 +1,362 @@
+"""
+Request-scoped sampling profiler for production debugging
+
+Profiling is opt-in (PROFILING_ENABLED). A request is profiled when it
+sends the profile token in an ``X-Profile`` header, when it falls in the random sample rate, or
+when an admin has armed the profiler for the next N requests. Every other
+request pays for one flag check.
+
+While profiled requests are running, a sampler thread reads their threads'
+stacks every few milliseconds with ``sys._current_frames()``. Threads that
+run flow nodes on the request's behalf (nodes with a time budget run in a
+worker pool) are sampled too. Each sample is folded into a
+``frame;frame;frame`` stack and classified by where the time went:
+
+    openai       the OpenAI completion, including its HTTP calls
+    parsing      query parameter extraction
+    json_decode  decoding upstream JSON
+    formatting   text and response formatting, response encoding
+    upstream_io  WeatherAPI.com requests (sockets, TLS, bulk and hedged calls)
+    waiting      blocked on another thread (e.g. a node's worker thread)
+    other        everything else
+
+Finished profiles keep their folded stacks, the category breakdown and the
+flow's per-node wall-clock times. The folded stacks download as the
+"collapsed" text format read by flamegraph.pl, speedscope and inferno.
+"""
+import hmac
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from types import CodeType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+from .settings import settings
+
+PROFILING_ENABLED = settings.get_bool("PROFILING_ENABLED", False)
+# The X-Profile header and the admin endpoints must carry this token (as
+# the header value and in X-Profile-Token respectively); without one only
+# random sampling profiles requests
+PROFILE_TOKEN = settings.get("PROFILE_TOKEN", "")
+# Fraction of requests profiled without being asked to
+PROFILE_SAMPLE_RATE = settings.get_float("PROFILE_SAMPLE_RATE", 0.0)
+PROFILE_INTERVAL_MS = settings.get_float("PROFILE_INTERVAL_MS", 5)
+PROFILE_MAX_STORED = settings.get_int("PROFILE_MAX_STORED", 50)
+PROFILE_MAX_DEPTH = settings.get_int("PROFILE_MAX_DEPTH", 96)
+
+PROFILE_HEADER = "X-Profile"
+CATEGORIES = ("openai", "parsing", "json_decode", "formatting", "upstream_io", "waiting", "other")
+
+# Category of a frame by module, checked as a prefix on dotted names
+_MODULE_CATEGORIES = [
+    ("openai", "openai"), ("httpx", "openai"), ("httpcore", "openai"),
+    ("json.decoder", "json_decode"), ("ijson", "json_decode"), ("weather_api.jsonstream", "json_decode"),
+    ("json.encoder", "formatting"), ("weather_api.formatting", "formatting"), ("weather_api.structured", "formatting"),
+    ("requests", "upstream_io"), ("urllib3", "upstream_io"), ("socket", "upstream_io"), ("ssl", "upstream_io"),
+    ("http.client", "upstream_io"), ("weather_api.bulk", "upstream_io"), ("weather_api.hedge", "upstream_io"),
+    ("threading", "waiting"), ("queue", "waiting"), ("concurrent.futures", "waiting")
+]
+# Category of a frame by function, for work inside otherwise mixed modules
+_FUNCTION_CATEGORIES = {
+    "extract_weather_parameters": "parsing",
+    "merge_followup_parameters": "parsing",
+    "_generate_ai_summary": "openai",
+    "Response.json": "json_decode",
+    "loads": "json_decode",
+    "dumps": "formatting"
+}
+_FORMATTING_PREFIXES = ("format_", "_format_", "render_", "_render_")
+
+_current: ContextVar[Optional["Profile"]] = ContextVar("profile", default=None)
+_lock = threading.Condition()
+_active: List["Profile"] = []
+_stored: "OrderedDict[str, Profile]" = OrderedDict()
+_frames: Dict[CodeType, Tuple[str, Optional[str]]] = {}
+_armed = 0
+_sampler: Optional[threading.Thread] = None
+_stats = {"profiled": 0, "samples": 0, "sampler_ms": 0.0}
+
+
+class Profile:
+    """Samples and timings collected for one request"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, trigger: str):
+        """
+        Args:
+            name: What was profiled, e.g. "POST /api/weather"
+            trigger: Why it was profiled ("header", "armed" or "sampled")
+        """
+        self.id = f"{int(time.time())}-{next(self._ids)}"
+        self.name = name
+        self.trigger = trigger
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.status: Optional[int] = None
+        # Thread id -> how many profiled calls it is inside
+        self.threads: Dict[int, int] = {}
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+        self.stages: Dict[str, float] = {}
+        self.samples = 0
+
+    def summary(self) -> Dict[str, Any]:
+        """Profile metadata and wall-clock breakdown, without the stacks"""
+        interval = PROFILE_INTERVAL_MS
+        return {
+            "id": self.id,
+            "name": self.name,
+            "trigger": self.trigger,
+            "started_at": round(self.started_at, 3),
+            "duration_ms": round(self.duration_ms, 2) if self.duration_ms is not None else None,
+            "status": self.status,
+            "samples": self.samples,
+            "interval_ms": interval,
+            "breakdown_ms": {category: round(self.categories[category] * interval, 1)
+                             for category in CATEGORIES if self.categories[category]},
+            "stages_ms": {name: round(ms, 2) for name, ms in self.stages.items()}
+        }
+
+    def folded(self) -> str:
+        """Stacks in collapsed format: one ``root;...;leaf count`` line each"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _frame_info(code: CodeType, module: str) -> Tuple[str, Optional[str]]:
+    # Label and category of a code object, worked out once per code object
+    info = _frames.get(code)
+    if info is None:
+        function = getattr(code, "co_qualname", code.co_name)
+        category = _FUNCTION_CATEGORIES.get(function)
+        if category in ("json_decode", "formatting") and function in ("loads", "dumps") \
+                and module != "weather_api.jsonutil":
+            category = None
+        if category is None and code.co_name.startswith(_FORMATTING_PREFIXES):
+            category = "formatting"
+        if category is None:
+            for prefix, prefix_category in _MODULE_CATEGORIES:
+                if module == prefix or module.startswith(prefix + "."):
+                    category = prefix_category
+                    break
+        info = _frames[code] = (f"{module}:{function}".replace(";", ":").replace(" ", "_"), category)
+    return info
+
+
+def _sample(frame: Any) -> Tuple[Tuple[str, ...], str]:
+    # Fold a thread's stack and pick its category: the OpenAI call wins
+    # wherever it is on the stack, otherwise the innermost classified frame
+    # does, looking through waits to what is being waited on
+    labels = []
+    category = None
+    openai = waiting = False
+    while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+        label, frame_category = _frame_info(frame.f_code, frame.f_globals.get("__name__", "?"))
+        labels.append(label)
+        if frame_category == "openai":
+            openai = True
+        elif frame_category == "waiting":
+            waiting = True
+        elif category is None and frame_category is not None:
+            category = frame_category
+        frame = frame.f_back
+    labels.reverse()
+    if openai:
+        category = "openai"
+    elif category is None:
+        category = "waiting" if waiting else "other"
+    return tuple(labels), category
+
+
+def _run_sampler() -> None:
+    interval = PROFILE_INTERVAL_MS / 1000.0
+    while True:
+        with _lock:
+            while not _active:
+                _lock.wait()
+            start = time.perf_counter()
+            frames = sys._current_frames()
+            taken = 0
+            for profile in _active:
+                for thread_id in profile.threads:
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack, category = _sample(frame)
+                    profile.stacks[stack] += 1
+                    profile.categories[category] += 1
+                    profile.samples += 1
+                    taken += 1
+            del frames
+            _stats["samples"] += taken
+            _stats["sampler_ms"] += (time.perf_counter() - start) * 1000
+        time.sleep(interval)
+
+
+def _ensure_sampler() -> None:
+    # Caller holds the lock
+    global _sampler
+    if _sampler is None:
+        _sampler = threading.Thread(target=_run_sampler, name="request-profiler", daemon=True)
+        _sampler.start()
+
+
+def authorized(token: Optional[str]) -> bool:
+    """Whether a token may trigger profiling or use the admin endpoints"""
+    return PROFILING_ENABLED and bool(PROFILE_TOKEN) and hmac.compare_digest((token or "").encode(), PROFILE_TOKEN.encode())
+
+
+def select(headers: Mapping[str, str]) -> Optional[str]:
+    """
+    Decide whether to profile a request
+
+    Args:
+        headers: Request headers
+
+    Returns:
+        Why the request is profiled ("header", "armed" or "sampled"), or
+        None to run it unprofiled
+    """
+    global _armed
+    if not PROFILING_ENABLED:
+        return None
+    requested = headers.get(PROFILE_HEADER)
+    if requested:
+        return "header" if authorized(requested) else None
+    if _armed:
+        with _lock:
+            if _armed:
+                _armed -= 1
+                return "armed"
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def arm(count: int) -> int:
+    """
+    Profile the next ``count`` requests
+
+    Args:
+        count: Requests to profile (0 disarms)
+
+    Returns:
+        Requests still to be profiled
+    """
+    global _armed
+    with _lock:
+        _armed = max(0, count)
+        return _armed
+
+
+def start(name: str, trigger: str) -> Tuple[Profile, Any]:
+    """
+    Start profiling the calling thread's request
+
+    Args:
+        name: What is being profiled
+        trigger: Why (see select())
+
+    Returns:
+        (profile, token); pass both to finish()
+    """
+    profile = Profile(name, trigger)
+    token = _current.set(profile)
+    with _lock:
+        profile.threads[threading.get_ident()] = 1
+        _active.append(profile)
+        _ensure_sampler()
+        _lock.notify()
+    return profile, token
+
+
+def finish(profile: Profile, token: Any, status: Optional[int] = None) -> None:
+    """
+    Stop profiling a request and store its profile for download
+
+    Args:
+        profile: Profile from start()
+        token: Token from start()
+        status: HTTP status of the response
+    """
+    _current.reset(token)
+    profile.duration_ms = (time.perf_counter() - profile._start) * 1000
+    profile.status = status
+    with _lock:
+        if profile in _active:
+            _active.remove(profile)
+        profile.threads.clear()
+        _stored[profile.id] = profile
+        while len(_stored) > PROFILE_MAX_STORED:
+            _stored.popitem(last=False)
+        _stats["profiled"] += 1
+
+
+def traced(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap a function about to run on another thread for the current request
+
+    The thread running it is sampled as part of the request's profile for
+    as long as the call lasts. Outside a profiled request ``fn`` is returned
+    unchanged.
+
+    Args:
+        fn: Function to be submitted to a thread pool
+
+    Returns:
+        The function to submit
+    """
+    profile = _current.get()
+    if profile is None:
+        return fn
+
+    def run(*args, **kwargs):
+        thread_id = threading.get_ident()
+        with _lock:
+            profile.threads[thread_id] = profile.threads.get(thread_id, 0) + 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with _lock:
+                remaining = profile.threads.get(thread_id, 1) - 1
+                if remaining > 0:
+                    profile.threads[thread_id] = remaining
+                else:
+                    profile.threads.pop(thread_id, None)
+    return run
+
+
+def record_stage(name: str, ms: float) -> None:
+    """Add a flow stage's wall-clock time to the current profile, if any"""
+    profile = _current.get()
+    if profile is not None:
+        profile.stages[name] = profile.stages.get(name, 0.0) + ms
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Summaries of the stored profiles, newest first"""
+    with _lock:
+        return [profile.summary() for profile in reversed(_stored.values())]
+
+
+def get_profile(profile_id: str) -> Optional[Profile]:
+    with _lock:
+        return _stored.get(profile_id)
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "enabled": PROFILING_ENABLED,
+            "sample_rate": PROFILE_SAMPLE_RATE,
+            "armed": _armed,
+            "active": len(_active),
+            "stored": len(_stored),
+            "profiled": _stats["profiled"],
+            "samples": _stats["samples"],
+            "sampler_ms": round(_stats["sampler_ms"], 2)
+        }
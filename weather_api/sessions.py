@@ -0,0 +1,152 @@
+"""
+Conversation sessions for follow-up weather queries
+
+A session remembers the last turn's parameters, resolved location and
+fetched payloads, so "and tomorrow?" or "what about humidity?" reuses the
+location and any data that is still fresh instead of starting over.
+"""
+import secrets
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from .cache import TTLCache
+from .upstream import normalize_location
+from .settings import settings
+
+# Idle time after which a session is forgotten, and how many are kept
+SESSION_TTL_SECONDS = settings.get_float("SESSION_TTL_SECONDS", 1800)
+SESSION_MAX_ENTRIES = settings.get_int("SESSION_MAX_ENTRIES", 2048)
+
+# Payload kinds in the flow's shared context and the endpoint behind each
+PAYLOAD_ENDPOINTS = {
+    "current_weather": "current.json",
+    "forecast": "forecast.json",
+    "historical_weather": "history.json"
+}
+
+session_store = TTLCache(max_entries=SESSION_MAX_ENTRIES)
+_stats_lock = threading.Lock()
+_stats = {"created": 0, "resumed": 0, "expired": 0}
+
+
+def load(session_id: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Get a session's context, starting a new session if needed
+
+    Unknown or expired ids start a new session with a fresh id, so clients
+    can't pick their own.
+
+    Args:
+        session_id: Id returned by an earlier request, or None
+
+    Returns:
+        Tuple of (session id, context)
+    """
+    context = session_store.get(session_id) if session_id else None
+    with _stats_lock:
+        if context is not None:
+            _stats["resumed"] += 1
+            return session_id, context
+        if session_id:
+            _stats["expired"] += 1
+        _stats["created"] += 1
+    return secrets.token_urlsafe(16), {"turns": 0}
+
+
+def save(session_id: str, context: Dict[str, Any], shared: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Record a finished turn and extend the session's lifetime
+
+    Turns that failed keep the previous context, so a typo doesn't lose the
+    conversation's location.
+
+    Args:
+        session_id: Session id from load()
+        context: Context the turn started from
+        shared: Shared context of the finished flow
+
+    Returns:
+        The stored context
+    """
+    if shared.get("error") or shared.get("error_message") or "location_name" not in shared:
+        updated = {**context, "turns": context.get("turns", 0) + 1}
+    else:
+        parameters = shared.get("parameters", {})
+        updated = {
+            "turns": context.get("turns", 0) + 1,
+            "parameters": parameters,
+            "location": {
+                "query": normalize_location(parameters.get("location", "")),
+                "name": shared["location_name"],
+                "region": shared.get("location_region", ""),
+                "country": shared.get("location_country", "")
+            },
+            "payloads": _fresh_payloads(shared, context)
+        }
+    session_store.set(session_id, updated, SESSION_TTL_SECONDS)
+    return updated
+
+
+def _fresh_payloads(shared: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    # A payload may be reused until the cache entry it came from expires
+    ttls: Dict[str, int] = {}
+    for record in shared.get("upstream_trace", []):
+        if record["status"] in ("hit", "miss"):
+            endpoint = record["endpoint"]
+            ttls[endpoint] = min(ttls.get(endpoint, record["ttl_remaining"]), record["ttl_remaining"])
+
+    now = time.time()
+    payloads = {kind: saved for kind, saved in context.get("payloads", {}).items() if saved["expires_at"] > now}
+    for kind, endpoint in PAYLOAD_ENDPOINTS.items():
+        data = shared.get(kind)
+        if not isinstance(data, dict) or "error" in data or "stale" in data or not ttls.get(endpoint):
+            continue
+        payloads[kind] = {
+            "location": shared["location_name"],
+            "history_days": shared.get("parameters", {}).get("history_days") if kind == "historical_weather" else None,
+            "data": data,
+            "expires_at": now + ttls[endpoint]
+        }
+    return payloads
+
+
+def reusable_payload(shared: Dict[str, Any], kind: str) -> Optional[Dict[str, Any]]:
+    """
+    Payload of a kind loaded earlier in the session, if it is still fresh
+
+    Args:
+        shared: Shared context of the running flow
+        kind: Payload kind, e.g. "forecast"
+
+    Returns:
+        The payload for the current location, or None
+    """
+    saved = shared.get("session", {}).get("payloads", {}).get(kind)
+    if saved is None or saved["expires_at"] <= time.time() or saved["location"] != shared.get("location_name"):
+        return None
+    if kind == "historical_weather" and saved["history_days"] != shared.get("parameters", {}).get("history_days"):
+        return None
+    return saved["data"]
+
+
+def resolved_location(shared: Dict[str, Any], location: str) -> Optional[Dict[str, Any]]:
+    """
+    Location the session already resolved for a query, if it is the same one
+
+    Args:
+        shared: Shared context of the running flow
+        location: Location query of the current turn
+
+    Returns:
+        Dictionary with name, region and country, or None
+    """
+    saved = shared.get("session", {}).get("location")
+    if saved is None or saved["query"] != normalize_location(location):
+        return None
+    return {"name": saved["name"], "region": saved["region"], "country": saved["country"]}
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    return {"active": session_store.stats()["entries"], **stats}
@@ -0,0 +1,45 @@
+"""
+Application settings
+
+Configuration comes from the process environment, plus a .env file during
+local development. The file is read once, when this module is first
+imported, and every module reads its configuration through ``settings``:
+
+    PREFETCH_TOP_N = settings.get_int("PREFETCH_TOP_N", 25)
+"""
+import os
+import time
+from typing import Optional
+
+_TRUE = ("1", "true", "yes")
+
+
+class Settings:
+    """Typed access to configuration loaded once per process"""
+
+    def __init__(self):
+        start = time.perf_counter()
+        try:
+            from dotenv import load_dotenv
+        except ImportError:
+            # python-dotenv is only needed to read a local .env file
+            load_dotenv = None
+        if load_dotenv is not None:
+            load_dotenv()
+        self.load_ms = (time.perf_counter() - start) * 1000
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return os.environ.get(name, default)
+
+    def get_bool(self, name: str, default: bool) -> bool:
+        value = os.environ.get(name)
+        return default if value is None else value.lower() in _TRUE
+
+    def get_int(self, name: str, default: int) -> int:
+        return int(os.environ.get(name, default))
+
+    def get_float(self, name: str, default: float) -> float:
+        return float(os.environ.get(name, default))
+
+
+settings = Settings()
@@ -0,0 +1,241 @@
+"""
+Warm-start snapshots of the in-memory caches
+
+Caches are written periodically to one file and reloaded on startup, so a
+restart or deploy doesn't send all traffic upstream at once. The file is:
+
+    header   magic, format version, index length (struct "<8sIQ")
+    index    JSON: schema fingerprint, creation time and one row per entry
+             [cache, key, offset, length, stored_at, expires_at, version]
+    records  JSON {"value": ..., "meta": ...} per entry, back to back
+
+Loading memory-maps the file, checks the header and schema, and decodes
+only the records of entries that are still fresh.
+"""
+import atexit
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from . import jsonutil
+from .ai_summary_node import summary_cache
+from .cache import CacheEntry, TTLCache, advance_versions
+from .sessions import session_store
+from .upstream import PROJECTIONS, location_cache, rebuild_geo_index, weather_cache
+from .settings import settings
+
+MAGIC = b"WXSNAP\x00\x00"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIQ")
+
+# Cached payload shapes depend on the decoding projections, so snapshots
+# written with different projections are not reused
+SCHEMA = hashlib.blake2b(repr(PROJECTIONS).encode("utf-8"), digest_size=8).hexdigest()
+
+SNAPSHOT_ENABLED = settings.get_bool("CACHE_SNAPSHOT_ENABLED", True)
+SNAPSHOT_PATH = settings.get("CACHE_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "weather_api_snapshot.bin"))
+SNAPSHOT_INTERVAL_SECONDS = settings.get_float("CACHE_SNAPSHOT_INTERVAL_SECONDS", 60)
+
+# Registered caches: name -> (cache, callback run after a restore)
+_caches: Dict[str, Tuple[TTLCache, Optional[Callable[[], None]]]] = {}
+_write_lock = threading.Lock()
+_stats: Dict[str, Any] = {"saved": 0, "last_saved_entries": 0, "last_save_ms": 0.0,
+                          "restored_entries": 0, "restore_ms": 0.0, "restore_skipped": None}
+
+
+def register(name: str, cache: TTLCache, on_restore: Optional[Callable[[], None]] = None) -> None:
+    """
+    Include a cache in snapshots
+
+    Args:
+        name: Stable name the cache is stored under
+        cache: The cache
+        on_restore: Called after entries have been restored into the cache
+    """
+    _caches[name] = (cache, on_restore)
+
+
+def _to_key(value: Any) -> Hashable:
+    # JSON turns the tuples in cache keys into lists
+    if isinstance(value, list):
+        return tuple(_to_key(item) for item in value)
+    return value
+
+
+def save(path: str = SNAPSHOT_PATH) -> int:
+    """
+    Write every registered cache's fresh entries to a snapshot file
+
+    The file is replaced atomically, so readers never see a partial write.
+
+    Args:
+        path: Snapshot file path
+
+    Returns:
+        Number of entries written
+    """
+    start = time.perf_counter()
+    index: List[list] = []
+    records: List[bytes] = []
+    offset = 0
+    for name, (cache, _) in _caches.items():
+        for key, entry in cache.entries(lambda key, entry: entry.is_fresh()):
+            try:
+                record = jsonutil.dumps({"value": entry.value, "meta": entry.meta})
+            except (TypeError, ValueError):
+                continue  # Not JSON-serializable; leave it out
+            index.append([name, key, offset, len(record), entry.stored_at, entry.expires_at, entry.version])
+            records.append(record)
+            offset += len(record)
+
+    index_bytes = jsonutil.dumps({"schema": SCHEMA, "created_at": time.time(), "entries": index})
+    directory = os.path.dirname(os.path.abspath(path))
+    with _write_lock:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(index_bytes)))
+                f.write(index_bytes)
+                for record in records:
+                    f.write(record)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    _stats["saved"] += 1
+    _stats["last_saved_entries"] = len(index)
+    _stats["last_save_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return len(index)
+
+
+def restore(path: str = SNAPSHOT_PATH) -> int:
+    """
+    Load fresh entries from a snapshot file into the registered caches
+
+    Missing, corrupt or incompatible snapshots are ignored.
+
+    Args:
+        path: Snapshot file path
+
+    Returns:
+        Number of entries restored
+    """
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            restored, max_version = _restore_from(mm)
+    except FileNotFoundError:
+        _stats["restore_skipped"] = "no snapshot"
+        return 0
+    except (OSError, ValueError, KeyError, IndexError, TypeError, struct.error) as e:
+        # An empty file can't be mapped; anything unreadable is simply skipped
+        _stats["restore_skipped"] = f"unreadable snapshot: {e}"
+        print(f"Ignoring cache snapshot {path}: {e}")
+        return 0
+
+    if max_version:
+        # New data must never reuse a restored entry's version
+        advance_versions(max_version)
+    for _, on_restore in _caches.values():
+        if on_restore is not None:
+            on_restore()
+    _stats["restored_entries"] = restored
+    _stats["restore_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return restored
+
+
+def _restore_from(mm: mmap.mmap) -> Tuple[int, int]:
+    magic, version, index_length = _HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"format {version} is not supported")
+
+    data_start = _HEADER.size + index_length
+    with memoryview(mm) as view:
+        index = jsonutil.loads(view[_HEADER.size:data_start])
+        if index.get("schema") != SCHEMA:
+            raise ValueError("written with a different payload schema")
+
+        now = time.time()
+        restored = 0
+        max_version = 0
+        for name, key, offset, length, stored_at, expires_at, entry_version in index["entries"]:
+            registered = _caches.get(name)
+            if registered is None or expires_at <= now:
+                continue
+            start = data_start + offset
+            record = jsonutil.loads(view[start:start + length])
+            entry = CacheEntry.restored(record["value"], stored_at, expires_at, entry_version, record["meta"])
+            registered[0].put_entry(_to_key(key), entry)
+            restored += 1
+            max_version = max(max_version, entry_version)
+    return restored, max_version
+
+
+register("weather", weather_cache, on_restore=rebuild_geo_index)
+register("locations", location_cache)
+register("summaries", summary_cache)
+register("sessions", session_store)
+
+
+class Snapshotter(threading.Thread):
+    """Daemon thread that saves a snapshot at a fixed interval"""
+
+    def __init__(self, path: str = SNAPSHOT_PATH, interval: float = SNAPSHOT_INTERVAL_SECONDS):
+        super().__init__(name="cache-snapshot", daemon=True)
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                save(self.path)
+            except Exception as e:
+                print(f"Cache snapshot error: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_snapshotter: Optional[Snapshotter] = None
+_snapshotter_lock = threading.Lock()
+
+
+def start_snapshots() -> Optional[Snapshotter]:
+    """
+    Restore the last snapshot and start saving new ones, once per process
+
+    A final snapshot is also written when the interpreter exits.
+
+    Returns:
+        The running snapshotter, or None if snapshots are disabled
+    """
+    global _snapshotter
+    if not SNAPSHOT_ENABLED:
+        return None
+    with _snapshotter_lock:
+        if _snapshotter is None:
+            restored = restore(SNAPSHOT_PATH)
+            if restored:
+                print(f"Restored {restored} cache entries from {SNAPSHOT_PATH}")
+            _snapshotter = Snapshotter(SNAPSHOT_PATH)
+            _snapshotter.start()
+            atexit.register(_save_on_exit)
+    return _snapshotter
+
+
+def _save_on_exit() -> None:
+    try:
+        save(SNAPSHOT_PATH)
+    except Exception as e:
+        print(f"Cache snapshot error: {e}")
+
+
+def get_stats() -> Dict[str, Any]:
+    return {"enabled": SNAPSHOT_ENABLED, "path": SNAPSHOT_PATH, **_stats}
@@ -0,0 +1,94 @@
+"""
+Startup timing and pre-warming
+
+Heavy clients (the OpenAI SDK, the upstream HTTP session) are built on first
+use so the app starts serving quickly. With pre-warming on, they are built
+in the background right after startup instead, and /ready reports ready
+only once every registered warmer has finished:
+
+    startup.add_prewarm("openai_client", get_client)
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from .settings import settings
+
+# Build clients and warm caches in the background at startup
+STARTUP_PREWARM = settings.get_bool("STARTUP_PREWARM", True)
+
+_lock = threading.Lock()
+_phases: Dict[str, float] = {"settings": settings.load_ms}
+_warmers: List[Tuple[str, Callable[[], Any]]] = []
+_warm_errors: Dict[str, str] = {}
+_ready = threading.Event()
+_started = False
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a startup phase, e.g. ``with startup.phase("imports"):``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000)
+
+
+def record(name: str, ms: float) -> None:
+    with _lock:
+        _phases[name] = _phases.get(name, 0.0) + ms
+
+
+def add_prewarm(name: str, fn: Callable[[], Any]) -> None:
+    """
+    Register work to do before the app reports ready
+
+    Args:
+        name: Phase name reported in the startup timings
+        fn: Function building a client or warming a cache
+    """
+    with _lock:
+        _warmers.append((name, fn))
+
+
+def _prewarm() -> None:
+    with _lock:
+        warmers = list(_warmers)
+    for name, fn in warmers:
+        try:
+            with phase(f"prewarm.{name}"):
+                fn()
+        except Exception as e:
+            # A failed warmer leaves the work for the first request
+            print(f"Prewarm {name} failed: {e}")
+            with _lock:
+                _warm_errors[name] = str(e)
+    _ready.set()
+
+
+def start_prewarm() -> None:
+    """Run the registered warmers in the background, once per process"""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    if not STARTUP_PREWARM:
+        _ready.set()
+        return
+    threading.Thread(target=_prewarm, name="startup-prewarm", daemon=True).start()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "ready": _ready.is_set(),
+            "prewarm": STARTUP_PREWARM,
+            "phases_ms": {name: round(ms, 2) for name, ms in _phases.items()},
+            "prewarm_errors": dict(_warm_errors)
+        }
@@ -0,0 +1,204 @@
+"""
+Structured (typed JSON) responses built from the flow's shared context
+"""
+from typing import Any, Dict, List, Optional
+
+
+def _location(shared: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolved location for either provider"""
+    if shared.get("provider") == "mcp":
+        mcp_weather = shared.get("mcp_weather") or {}
+        location = {
+            "name": mcp_weather.get("location", shared.get("location_name")),
+            "region": mcp_weather.get("region"),
+            "country": mcp_weather.get("country")
+        }
+    else:
+        location = {
+            "name": shared.get("location_name"),
+            "region": shared.get("location_region"),
+            "country": shared.get("location_country")
+        }
+
+    # The API provider's raw payloads carry coordinates and the timezone
+    for key in ("current_weather", "forecast", "historical_weather"):
+        payload = shared.get(key)
+        if isinstance(payload, dict) and isinstance(payload.get("location"), dict):
+            raw = payload["location"]
+            location.update({"lat": raw.get("lat"), "lon": raw.get("lon"), "tz_id": raw.get("tz_id")})
+            break
+    return location
+
+
+def api_observation(current: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Normalize a WeatherAPI.com "current" block
+
+    Args:
+        current: The "current" object of a current.json payload
+
+    Returns:
+        Observation dictionary, or None without data
+    """
+    if not current:
+        return None
+    return {
+        "observed_at": current.get("last_updated"),
+        "condition": (current.get("condition") or {}).get("text"),
+        "temp_c": current.get("temp_c"),
+        "temp_f": current.get("temp_f"),
+        "feelslike_c": current.get("feelslike_c"),
+        "feelslike_f": current.get("feelslike_f"),
+        "humidity": current.get("humidity"),
+        "precip_mm": current.get("precip_mm"),
+        "wind_kph": current.get("wind_kph"),
+        "wind_mph": current.get("wind_mph"),
+        "wind_dir": current.get("wind_dir"),
+        "uv": current.get("uv"),
+        "vis_miles": current.get("vis_miles")
+    }
+
+
+def api_daily(payload: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Normalize the daily series of a WeatherAPI.com forecast or history payload
+
+    Args:
+        payload: forecast.json or history.json payload
+
+    Returns:
+        One dictionary per day
+    """
+    days = ((payload or {}).get("forecast") or {}).get("forecastday", [])
+    series = []
+    for day in days:
+        info = day.get("day", {})
+        astro = day.get("astro", {})
+        series.append({
+            "date": day.get("date"),
+            "condition": (info.get("condition") or {}).get("text"),
+            "max_temp_c": info.get("maxtemp_c"),
+            "max_temp_f": info.get("maxtemp_f"),
+            "min_temp_c": info.get("mintemp_c"),
+            "min_temp_f": info.get("mintemp_f"),
+            "avg_temp_c": info.get("avgtemp_c"),
+            "avg_humidity": info.get("avghumidity"),
+            "total_precip_mm": info.get("totalprecip_mm"),
+            "max_wind_kph": info.get("maxwind_kph"),
+            "chance_of_rain": info.get("daily_chance_of_rain"),
+            "chance_of_snow": info.get("daily_chance_of_snow"),
+            "sunrise": astro.get("sunrise"),
+            "sunset": astro.get("sunset")
+        })
+    return series
+
+
+def _observation(shared: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Current conditions normalized across providers"""
+    if shared.get("provider") == "mcp":
+        current = (shared.get("mcp_weather") or {}).get("current_conditions")
+        if not current:
+            return None
+        wind = current.get("wind") or {}
+        return {
+            "observed_at": current.get("observation_time"),
+            "condition": current.get("weather_text"),
+            "temp_c": (current.get("temperature") or {}).get("value"),
+            "humidity": current.get("relative_humidity"),
+            "precip_mm": current.get("precipitation"),
+            "wind_kph": wind.get("speed"),
+            "wind_dir": wind.get("direction")
+        }
+
+    return api_observation((shared.get("current_weather") or {}).get("current"))
+
+
+def _daily(shared: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Daily series (forecast or historical) normalized across providers"""
+    if shared.get("provider") == "mcp":
+        forecast = (shared.get("mcp_weather") or {}).get("forecast") or []
+        return [
+            {
+                "date": day.get("date"),
+                "condition": day.get("condition"),
+                "max_temp_c": day.get("max_temp_c"),
+                "min_temp_c": day.get("min_temp_c"),
+                "avg_temp_c": day.get("avg_temp_c"),
+                "chance_of_rain": day.get("chance_of_rain"),
+                "chance_of_snow": day.get("chance_of_snow")
+            }
+            for day in forecast
+        ]
+
+    for key in ("forecast", "historical_weather"):
+        payload = shared.get(key)
+        if isinstance(payload, dict) and "forecast" in payload:
+            return api_daily(payload)
+    return []
+
+
+def cache_status(trace: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Summarize the upstream cache lookups made while answering a request
+
+    Args:
+        trace: Records collected by upstream.start_trace()
+
+    Returns:
+        Overall status ("hit", "miss", "stale" or "mixed") with per-lookup details
+    """
+    statuses = {record["status"] for record in trace}
+    if not statuses:
+        overall = "none"
+    elif len(statuses) == 1:
+        overall = statuses.pop()
+    else:
+        overall = "stale" if "stale" in statuses else "mixed"
+    return {
+        "status": overall,
+        "lookups": [
+            {"endpoint": record["endpoint"], "status": record["status"],
+             "ttl_remaining": record["ttl_remaining"]}
+            for record in trace
+        ]
+    }
+
+
+def build_structured_response(shared: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build a typed response from the shared context of a finished flow
+
+    Args:
+        shared: Shared context after the weather flow has run
+
+    Returns:
+        Dictionary with location, observation, daily series, summary,
+        optional text, timing, payload memory, cache status and any
+        fallbacks taken
+    """
+    parameters = shared.get("parameters", {})
+    error = shared.get("error") or shared.get("error_message")
+    ai_summary = shared.get("ai_summary")
+    if ai_summary and ai_summary.startswith("AI summary unavailable"):
+        ai_summary = None
+
+    return {
+        "query": shared.get("user_query"),
+        "provider": shared.get("provider", "api"),
+        "timeframe": parameters.get("timeframe"),
+        "specific_info": parameters.get("specific_info", []),
+        "location": _location(shared),
+        "observation": _observation(shared),
+        "daily": _daily(shared),
+        "summary": ai_summary,
+        "summary_route": shared.get("summary_route"),
+        "text": shared.get("weather_text"),
+        "error": error,
+        "timing": {
+            "total_ms": round(shared.get("total_ms", 0.0), 2),
+            "stages_ms": {name: round(ms, 2) for name, ms in shared.get("timings", {}).items()}
+        },
+        "memory": shared.get("payload_memory") or None,
+        "cache": cache_status(shared.get("upstream_trace", [])),
+        "fallbacks": shared.get("fallbacks", [])
+    }
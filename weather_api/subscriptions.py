@@ -0,0 +1,258 @@
+"""
+Push subscriptions for live current conditions
+
+Clients subscribe to locations over Server-Sent Events instead of polling.
+Each distinct location is a topic. One hub thread fetches every topic on
+WeatherAPI.com's update cadence, reading current conditions through the
+shared cache (in bulk when bulk mode is on). Only an observation that
+changed is published, once, to every subscriber of its topic. Upstream work
+grows with the number of distinct locations, not with the number of clients.
+"""
+import heapq
+import itertools
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from .settings import settings
+from .structured import api_observation
+from .upstream import normalize_location, refresh_many, resolve_key
+from .utils import get_current_weather_many
+
+# WeatherAPI.com publishes new current conditions about this often
+SUBSCRIPTION_UPDATE_SECONDS = settings.get_float("SUBSCRIPTION_UPDATE_SECONDS", 900)
+# Wait after an expected update before fetching, and never poll a topic more
+# often than the minimum interval (or retry a failed one sooner)
+SUBSCRIPTION_GRACE_SECONDS = settings.get_float("SUBSCRIPTION_GRACE_SECONDS", 30)
+SUBSCRIPTION_MIN_POLL_SECONDS = settings.get_float("SUBSCRIPTION_MIN_POLL_SECONDS", 60)
+SUBSCRIPTION_MAX_LOCATIONS = settings.get_int("SUBSCRIPTION_MAX_LOCATIONS", 25)
+# Events buffered for a slow client before its oldest ones are dropped
+SUBSCRIPTION_QUEUE_SIZE = settings.get_int("SUBSCRIPTION_QUEUE_SIZE", 64)
+SUBSCRIPTION_KEEPALIVE_SECONDS = settings.get_float("SUBSCRIPTION_KEEPALIVE_SECONDS", 15)
+
+_PARAMS = {"aqi": "no"}
+
+
+class Subscriber:
+    """One client's event queue"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, locations: List[str], queue_size: int = SUBSCRIPTION_QUEUE_SIZE):
+        """
+        Args:
+            locations: Normalized location names (topics)
+            queue_size: Events buffered before the oldest are dropped
+        """
+        self.id = next(self._ids)
+        self.locations = locations
+        self.events: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        # Never block the hub on a slow client; it loses its oldest events
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class Topic:
+    """A subscribed location, its latest event and when to fetch it next"""
+
+    def __init__(self, location: str):
+        self.location = location
+        self.subscribers: Set[Subscriber] = set()
+        self.event: Optional[Dict[str, Any]] = None
+        self.observed_epoch: Optional[int] = None
+        self.due = 0.0
+
+
+class SubscriptionHub(threading.Thread):
+    """Daemon thread fetching subscribed locations and fanning out changes"""
+
+    def __init__(self, update_seconds: float = SUBSCRIPTION_UPDATE_SECONDS,
+                 grace_seconds: float = SUBSCRIPTION_GRACE_SECONDS,
+                 min_poll_seconds: float = SUBSCRIPTION_MIN_POLL_SECONDS):
+        """
+        Args:
+            update_seconds: Upstream update cadence of current conditions
+            grace_seconds: Delay after an expected update before fetching
+            min_poll_seconds: Shortest time between fetches of one topic
+        """
+        super().__init__(name="weather-subscriptions", daemon=True)
+        self.update_seconds = update_seconds
+        self.grace_seconds = grace_seconds
+        self.min_poll_seconds = min_poll_seconds
+        self.topics: Dict[str, Topic] = {}
+        # (due time, location); entries for removed or rescheduled topics are
+        # skipped when they come up
+        self._schedule: List[Tuple[float, str]] = []
+        self._wake = threading.Condition()
+        self.counts = {"polls": 0, "fetched": 0, "refreshed": 0, "changes": 0, "events_sent": 0}
+
+    def subscribe(self, locations: List[str]) -> Subscriber:
+        """
+        Register a client for locations
+
+        The latest known observation of each location is queued straight
+        away; new locations are fetched on the hub's next pass.
+
+        Args:
+            locations: Location queries
+
+        Returns:
+            The subscriber whose queue receives events
+        """
+        names = list(dict.fromkeys(normalize_location(location) for location in locations))
+        subscriber = Subscriber(names)
+        with self._wake:
+            for name in names:
+                topic = self.topics.get(name)
+                if topic is None:
+                    topic = self.topics[name] = Topic(name)
+                    topic.due = time.monotonic()
+                    heapq.heappush(self._schedule, (topic.due, name))
+                    self._wake.notify()
+                topic.subscribers.add(subscriber)
+                if topic.event is not None:
+                    subscriber.publish(topic.event)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Remove a client; topics nobody follows any more are dropped"""
+        with self._wake:
+            for name in subscriber.locations:
+                topic = self.topics.get(name)
+                if topic is None:
+                    continue
+                topic.subscribers.discard(subscriber)
+                if not topic.subscribers:
+                    del self.topics[name]
+
+    def _due_topics(self) -> List[Topic]:
+        # Caller holds the lock; waits until at least one topic is due
+        while True:
+            now = time.monotonic()
+            while self._schedule:
+                due, name = self._schedule[0]
+                topic = self.topics.get(name)
+                if topic is None or topic.due != due:
+                    heapq.heappop(self._schedule)
+                    continue
+                break
+            if self._schedule and self._schedule[0][0] <= now:
+                break
+            self._wake.wait(self._schedule[0][0] - now if self._schedule else None)
+        # Topics coming due within the next second go out with this batch
+        topics = []
+        while self._schedule and self._schedule[0][0] <= now + 1.0:
+            due, name = heapq.heappop(self._schedule)
+            topic = self.topics.get(name)
+            if topic is not None and topic.due == due:
+                topics.append(topic)
+        return topics
+
+    def _next_due(self, topic: Topic, now: float) -> float:
+        if topic.observed_epoch is None:
+            return now + self.min_poll_seconds
+        # Fetch again just after upstream is expected to have newer data
+        expected = topic.observed_epoch + self.update_seconds + self.grace_seconds - time.time()
+        if expected < -self.update_seconds:
+            # A station that has stopped reporting is checked once per cycle
+            expected = self.update_seconds
+        return now + max(self.min_poll_seconds, expected)
+
+    def poll(self, topics: List[Topic]) -> None:
+        """
+        Fetch current conditions for topics and publish the ones that changed
+
+        A topic seen before is due because upstream should have updated it,
+        so its cache entry is refreshed first rather than served as is.
+
+        Args:
+            topics: Due topics
+        """
+        locations = [topic.location for topic in topics]
+        seen = [resolve_key("current.json", topic.location, _PARAMS)[0]
+                for topic in topics if topic.event is not None]
+        if seen:
+            self.counts["refreshed"] += refresh_many(seen)
+        results = get_current_weather_many(locations)
+        self.counts["polls"] += 1
+        self.counts["fetched"] += len(locations)
+
+        now = time.monotonic()
+        with self._wake:
+            for topic in topics:
+                event, epoch = self._event(topic.location, results.get(topic.location) or {"error": "No data"})
+                if event != topic.event:
+                    topic.event = event
+                    self.counts["changes"] += 1
+                    for subscriber in list(topic.subscribers):
+                        subscriber.publish(event)
+                        self.counts["events_sent"] += 1
+                if epoch is not None:
+                    topic.observed_epoch = epoch
+                if self.topics.get(topic.location) is topic:
+                    topic.due = self._next_due(topic, now)
+                    heapq.heappush(self._schedule, (topic.due, topic.location))
+
+    def _event(self, location: str, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[int]]:
+        if "error" in payload:
+            return {"location": location, "error": payload["error"]}, None
+        place = payload.get("location") or {}
+        current = payload.get("current") or {}
+        event = {"location": location, "name": place.get("name"), "region": place.get("region"),
+                 "country": place.get("country"), "observation": api_observation(current)}
+        return event, current.get("last_updated_epoch")
+
+    def run(self):
+        while True:
+            with self._wake:
+                topics = self._due_topics()
+            try:
+                self.poll(topics)
+            except Exception as e:
+                print(f"Subscription poll error: {e}")
+                now = time.monotonic()
+                with self._wake:
+                    for topic in topics:
+                        topic.due = now + self.min_poll_seconds
+                        heapq.heappush(self._schedule, (topic.due, topic.location))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._wake:
+            subscribers = {subscriber for topic in self.topics.values() for subscriber in topic.subscribers}
+            return {
+                "topics": len(self.topics),
+                "subscribers": len(subscribers),
+                "events_dropped": sum(subscriber.dropped for subscriber in subscribers),
+                **self.counts
+            }
+
+
+_hub: Optional[SubscriptionHub] = None
+_hub_lock = threading.Lock()
+
+
+def get_hub() -> SubscriptionHub:
+    """The process-wide hub, started on first use"""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = SubscriptionHub()
+            _hub.start()
+    return _hub
+
+
+def get_stats() -> Dict[str, Any]:
+    if _hub is None:
+        return {"topics": 0, "subscribers": 0}
+    return _hub.stats()
@@ -0,0 +1,279 @@
+"""
+Cost- and latency-aware routing of AI summaries
+
+Each request that wants a summary gets one of four strategies:
+
+    skip      no summary (nothing to summarize, or no way to make one)
+    template  a one-line direct answer rendered locally, no OpenAI call
+    short     a brief completion with a tight token limit
+    full      the full two-part summary
+
+The choice is made from the query (which aspects it asks about, its
+timeframe and length), then adjusted for the state of the service. If
+recent completions are slower than the latency budget, or the token budget
+is spent, the request gets a cheaper strategy instead. Tokens are only
+taken from the budget once a completion is actually requested, so summaries
+served from the summary cache don't spend it. Every decision is
+logged and counted per strategy with latency and token use, so /metrics
+can show what routing saves.
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from .formatting import Template
+from .hedge import LatencyTracker
+from .prefetch import TokenBucket
+from .settings import settings
+
+SUMMARY_ROUTER_ENABLED = settings.get_bool("SUMMARY_ROUTER_ENABLED", True)
+SUMMARY_ROUTER_LOG = settings.get_bool("SUMMARY_ROUTER_LOG", True)
+SUMMARY_SHORT_MAX_TOKENS = settings.get_int("SUMMARY_SHORT_MAX_TOKENS", 80)
+SUMMARY_FULL_MAX_TOKENS = settings.get_int("SUMMARY_FULL_MAX_TOKENS", 200)
+SUMMARY_SHORT_TEMPERATURE = settings.get_float("SUMMARY_SHORT_TEMPERATURE", 0.3)
+SUMMARY_FULL_TEMPERATURE = settings.get_float("SUMMARY_FULL_TEMPERATURE", 0.7)
+# Median completion latency above which summaries are downgraded a step
+SUMMARY_LATENCY_BUDGET_MS = settings.get_float("SUMMARY_LATENCY_BUDGET_MS", 4000)
+# OpenAI tokens the summaries may spend per minute (0 for no limit)
+SUMMARY_TOKENS_PER_MINUTE = settings.get_float("SUMMARY_TOKENS_PER_MINUTE", 0)
+# Queries at least this many words long get the full summary
+SUMMARY_FULL_MIN_WORDS = settings.get_int("SUMMARY_FULL_MIN_WORDS", 15)
+
+STRATEGIES = ("skip", "template", "short", "full")
+COMPLETION_SETTINGS = {
+    "short": {"max_tokens": SUMMARY_SHORT_MAX_TOKENS, "temperature": SUMMARY_SHORT_TEMPERATURE},
+    "full": {"max_tokens": SUMMARY_FULL_MAX_TOKENS, "temperature": SUMMARY_FULL_TEMPERATURE}
+}
+
+# Direct answers for one aspect of current conditions or tomorrow's forecast
+CURRENT_ANSWERS = {
+    "temperature": Template("It's {temp_f}°F ({temp_c}°C) in {name} right now, feeling like {feelslike_f}°F."),
+    "humidity": Template("Humidity in {name} is {humidity}% right now."),
+    "wind": Template("Wind in {name} is {wind_mph} mph ({wind_kph} km/h) from the {wind_dir} right now."),
+    "rain": Template("{name} has {precip_mm} mm of precipitation right now ({condition_text})."),
+    "precipitation": Template("{name} has {precip_mm} mm of precipitation right now."),
+    "uv": Template("The UV index in {name} is {uv} right now."),
+    "visibility": Template("Visibility in {name} is {vis_miles} miles right now."),
+    "pressure": Template("Air pressure in {name} is {pressure_mb} mb right now.")
+}
+TOMORROW_ANSWERS = {
+    "temperature": Template("Tomorrow in {name}: a high of {maxtemp_f}°F ({maxtemp_c}°C) "
+                            "and a low of {mintemp_f}°F ({mintemp_c}°C)."),
+    "humidity": Template("Humidity in {name} will average {avghumidity}% tomorrow."),
+    "wind": Template("Wind in {name} will reach {maxwind_mph} mph ({maxwind_kph} km/h) tomorrow."),
+    "rain": Template("The chance of rain in {name} tomorrow is {daily_chance_of_rain}%."),
+    "precipitation": Template("{name} should see {totalprecip_mm} mm of precipitation tomorrow "
+                              "({daily_chance_of_rain}% chance of rain)."),
+    "uv": Template("The UV index in {name} will be {uv} tomorrow.")
+}
+
+
+def query_features(user_query: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Routing features of a query: asked-about aspects, timeframe and length"""
+    return {
+        "specific_info": list(parameters.get("specific_info", [])),
+        "timeframe": parameters.get("timeframe", "current"),
+        "words": len(user_query.split())
+    }
+
+
+def template_answer(features: Dict[str, Any], weather_data: Dict[str, Any]) -> Optional[str]:
+    """
+    One-line answer to a single-aspect question, without a completion
+
+    Args:
+        features: Features from query_features()
+        weather_data: Raw payloads ("current_weather", "forecast") of the
+            API provider
+
+    Returns:
+        The answer, or None if the question or data doesn't fit a template
+    """
+    if len(features["specific_info"]) != 1:
+        return None
+    aspect = features["specific_info"][0]
+    if features["timeframe"] == "current":
+        payload = weather_data.get("current_weather") or {}
+        template = CURRENT_ANSWERS.get(aspect)
+        fields = dict(payload.get("current") or {})
+        fields["condition_text"] = str((fields.get("condition") or {}).get("text", "")).lower()
+    elif features["timeframe"] == "tomorrow":
+        payload = weather_data.get("forecast") or {}
+        template = TOMORROW_ANSWERS.get(aspect)
+        days = (payload.get("forecast") or {}).get("forecastday") or []
+        fields = dict(days[1].get("day") or {}) if len(days) > 1 else {}
+    else:
+        return None
+    fields["name"] = (payload.get("location") or {}).get("name")
+    if template is None or any(fields.get(field) is None for field in template.fields):
+        return None
+    return template.render(fields)
+
+
+class SummaryRouter:
+    """Picks a summary strategy per request and keeps per-strategy statistics"""
+
+    def __init__(self, latency_budget_ms: float = SUMMARY_LATENCY_BUDGET_MS,
+                 tokens_per_minute: float = SUMMARY_TOKENS_PER_MINUTE,
+                 full_min_words: int = SUMMARY_FULL_MIN_WORDS):
+        """
+        Args:
+            latency_budget_ms: Median completion latency that triggers
+                downgrades
+            tokens_per_minute: Token budget for completions (0 for none)
+            full_min_words: Query length from which the full summary is used
+        """
+        self.latency_budget_ms = latency_budget_ms
+        self.full_min_words = full_min_words
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+        self.latencies = LatencyTracker(window=256, min_samples=1)
+        # Downgrades wait for a few completions, so one slow call doesn't
+        # switch summaries off
+        self.completion_latencies = LatencyTracker(window=64, min_samples=5)
+        self._lock = threading.Lock()
+        self.counts = {strategy: 0 for strategy in STRATEGIES}
+        self.tokens_used = {strategy: 0 for strategy in STRATEGIES}
+        self.completions = {strategy: 0 for strategy in STRATEGIES}
+        self.downgrades = {"latency": 0, "tokens": 0}
+
+    def _preferred(self, features: Dict[str, Any], template_available: bool) -> Tuple[List[str], str]:
+        # Strategies from best fit to cheapest fallback, and why
+        if template_available and features["words"] < self.full_min_words:
+            return ["template", "short", "skip"], "single-aspect question"
+        if features["words"] >= self.full_min_words or len(features["specific_info"]) > 1:
+            return ["full", "short", "template", "skip"], "detailed question"
+        if features["timeframe"] in ("week", "historical"):
+            return ["full", "short", "template", "skip"], f"{features['timeframe']} overview"
+        return ["short", "template", "skip"], "simple question"
+
+    def choose(self, user_query: str, parameters: Dict[str, Any], weather_response: str,
+               weather_data: Dict[str, Any], can_complete: bool = True) -> Dict[str, Any]:
+        """
+        Pick the summary strategy for a request
+
+        Args:
+            user_query: The user's question
+            parameters: Extracted query parameters
+            weather_response: Formatted weather text to summarize
+            weather_data: Raw payloads behind the text
+            can_complete: Whether OpenAI completions are possible at all
+
+        Returns:
+            {"strategy", "reason", "features", "fallbacks"}, plus "answer"
+            for template and "max_tokens" / "temperature" for completions.
+            Completions must call reserve() before they are requested.
+        """
+        features = query_features(user_query, parameters)
+        if not SUMMARY_ROUTER_ENABLED:
+            return self._decide("full", "router disabled", features)
+        if not weather_response or not weather_response.strip():
+            return self._decide("skip", "no weather data", features)
+
+        answer = template_answer(features, weather_data)
+        candidates, reason = self._preferred(features, answer is not None)
+        if answer is None:
+            candidates = [strategy for strategy in candidates if strategy != "template"]
+        if not can_complete:
+            candidates = [strategy for strategy in candidates if strategy not in COMPLETION_SETTINGS]
+            reason = "no completions"
+
+        # Slow completions: step down one level while they recover
+        p50 = self.completion_latencies.percentile("completion", 50)
+        if p50 is not None and p50 * 1000 > self.latency_budget_ms and candidates[0] in COMPLETION_SETTINGS:
+            candidates = candidates[1:]
+            reason = f"p50 {round(p50 * 1000)}ms over budget"
+            with self._lock:
+                self.downgrades["latency"] += 1
+
+        # Cheaper strategies to step down to if the token budget is spent
+        options = [(strategy, {"answer": answer} if strategy == "template"
+                    else dict(COMPLETION_SETTINGS.get(strategy, {}))) for strategy in candidates] or [("skip", {})]
+        strategy, extra = options[0]
+        return self._decide(strategy, reason, features, fallbacks=options[1:], **extra)
+
+    def reserve(self, route: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Take the tokens for a completion just before it is requested
+
+        Args:
+            route: Decision from choose()
+
+        Returns:
+            The route to follow: the same one, or the next cheaper one its
+            tokens could be taken for (down to skip) when the budget is spent
+        """
+        while route["strategy"] in COMPLETION_SETTINGS and self.tokens is not None \
+                and not self.tokens.try_acquire(route["max_tokens"]):
+            fallbacks = route["fallbacks"] or [("skip", {})]
+            strategy, extra = fallbacks[0]
+            with self._lock:
+                self.downgrades["tokens"] += 1
+                self.counts[route["strategy"]] -= 1
+            route = self._decide(strategy, "token budget spent", route["features"], fallbacks=fallbacks[1:], **extra)
+        return route
+
+    def _decide(self, strategy: str, reason: str, features: Dict[str, Any], **extra) -> Dict[str, Any]:
+        with self._lock:
+            self.counts[strategy] += 1
+        if SUMMARY_ROUTER_LOG:
+            print(f"Summary route: {strategy} ({reason}) timeframe={features['timeframe']} "
+                  f"specific_info={features['specific_info']} words={features['words']}")
+        return {"strategy": strategy, "reason": reason, "features": features, **extra}
+
+    def record(self, strategy: str, seconds: float, tokens: Optional[int] = None) -> None:
+        """
+        Record how long producing a summary took and the tokens it used
+
+        reserve() only took the completion's max_tokens, so the token
+        budget is charged the difference once the billed total (prompt
+        included) is known.
+
+        Args:
+            strategy: Strategy that produced it
+            seconds: Time taken
+            tokens: Total tokens billed (completions only)
+        """
+        self.latencies.record(strategy, seconds)
+        if strategy in COMPLETION_SETTINGS:
+            self.completion_latencies.record("completion", seconds)
+            if tokens is not None and self.tokens is not None:
+                self.tokens.settle(tokens - COMPLETION_SETTINGS[strategy]["max_tokens"])
+        with self._lock:
+            if tokens is not None:
+                self.tokens_used[strategy] += tokens
+                self.completions[strategy] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+            tokens_used = dict(self.tokens_used)
+            completions = dict(self.completions)
+            downgrades = dict(self.downgrades)
+        strategies = {}
+        for strategy in STRATEGIES:
+            p50 = self.latencies.percentile(strategy, 50)
+            strategies[strategy] = {
+                "requests": counts[strategy],
+                "p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+                "tokens": tokens_used[strategy],
+                "avg_tokens": round(tokens_used[strategy] / completions[strategy], 1) if completions[strategy] else None
+            }
+
+        # What the cheaper strategies saved against a full summary each
+        full = strategies["full"]
+        full_tokens = full["avg_tokens"]
+        full_ms = full["p50_ms"]
+        saved_tokens = saved_ms = None
+        if full_tokens is not None:
+            saved_tokens = round(sum(counts[strategy] * (full_tokens - (strategies[strategy]["avg_tokens"] or 0))
+                                     for strategy in ("skip", "template", "short")))
+        if full_ms is not None:
+            saved_ms = round(sum(counts[strategy] * (full_ms - (strategies[strategy]["p50_ms"] or 0))
+                                 for strategy in ("skip", "template", "short")))
+        return {"enabled": SUMMARY_ROUTER_ENABLED, "strategies": strategies, "downgrades": downgrades,
+                "estimated_saved": {"tokens": saved_tokens, "ms": saved_ms}}
+
+
+router = SummaryRouter()
+
+
+def get_stats() -> Dict[str, Any]:
+    return router.stats()
@@ -0,0 +1,206 @@
+"""
+Tenant API keys, quotas and cache namespaces
+
+When a tenants file is configured, /api/weather requires an API key in an
+``X-API-Key`` header (or ``Authorization: Bearer <key>``). Each tenant gets
+token buckets for requests and for AI summaries, an optional cache
+namespace of its own, and usage and latency statistics:
+
+    {"tenants": [
+        {"name": "forecasting", "keys": ["sha256:9f86d081884c7d65..."],
+         "requests_per_minute": 120, "summaries_per_minute": 20,
+         "cache_namespace": true}
+    ]}
+
+Keys may be listed in plain text or as "sha256:<hex digest>", so the file
+doesn't have to hold secrets. Omitting a limit leaves it unlimited. A
+tenant marked ``"anonymous": true`` serves requests without a key (such
+as the web UI's); otherwise they are refused.
+"""
+import hashlib
+import json
+import math
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+from .cache import TTLCache
+from .hedge import LatencyTracker
+from .prefetch import TokenBucket
+from .settings import settings
+
+TENANTS_FILE = settings.get("TENANTS_FILE", "")
+# Entries kept in each tenant's own cache namespace
+TENANT_CACHE_MAX_ENTRIES = settings.get_int("TENANT_CACHE_MAX_ENTRIES", 256)
+
+
+def hash_key(api_key: str) -> str:
+    """Digest an API key is indexed under"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _bucket(per_minute: Optional[float], burst: Optional[float]) -> Optional[TokenBucket]:
+    if not per_minute:
+        return None
+    # A quarter of a minute's allowance can be spent at once by default
+    return TokenBucket(per_minute / 60.0, burst if burst is not None else max(1.0, per_minute / 4))
+
+
+def _retry_after(bucket: TokenBucket, tokens: float = 1.0) -> int:
+    return max(1, math.ceil(bucket.wait_time(tokens)))
+
+
+class Tenant:
+    """One team's quotas, cache namespace and usage counters"""
+
+    def __init__(self, name: str, requests_per_minute: Optional[float] = None,
+                 summaries_per_minute: Optional[float] = None, burst: Optional[float] = None,
+                 cache_namespace: bool = False):
+        """
+        Args:
+            name: Tenant name used in metrics
+            requests_per_minute: Request quota (None for unlimited)
+            summaries_per_minute: AI summary quota (None for unlimited)
+            burst: Tokens that can be spent at once (defaults to a quarter
+                of each per-minute quota)
+            cache_namespace: Keep a private cache in front of the shared one
+        """
+        self.name = name
+        self.requests = _bucket(requests_per_minute, burst)
+        self.summaries = _bucket(summaries_per_minute, burst)
+        self.cache = TTLCache(max_entries=TENANT_CACHE_MAX_ENTRIES) if cache_namespace else None
+        self.latencies = LatencyTracker(window=256, min_samples=1)
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "throttled": 0, "summaries": 0, "summaries_throttled": 0}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += n
+
+    def admit(self, requests: int = 1) -> Optional[int]:
+        """
+        Take request tokens
+
+        Args:
+            requests: Requests to charge at once (e.g. the remaining parts
+                of an export, so it never waits on the quota mid-stream)
+
+        Returns:
+            None if the request may run, else seconds to wait before retrying
+        """
+        if self.requests is not None and not self.requests.try_acquire(requests):
+            self._count("throttled")
+            return _retry_after(self.requests, requests)
+        self._count("requests", requests)
+        return None
+
+    def max_requests(self) -> Optional[float]:
+        """Most requests that can be charged at once (None for unlimited)"""
+        return self.requests.capacity if self.requests is not None else None
+
+    def take_summary(self) -> bool:
+        """Take an AI summary token; False means answer without a summary"""
+        if self.summaries is not None and not self.summaries.try_acquire():
+            self._count("summaries_throttled")
+            return False
+        self._count("summaries")
+        return True
+
+    def record_latency(self, seconds: float) -> None:
+        self.latencies.record("request", seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.counts)
+        for percent in (50, 95):
+            latency = self.latencies.percentile("request", percent)
+            stats[f"p{percent}_ms"] = round(latency * 1000, 2) if latency is not None else None
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+
+class TenantRegistry:
+    """API key index; without tenants, requests need no key"""
+
+    def __init__(self, tenants: Optional[List[Dict[str, Any]]] = None):
+        """
+        Args:
+            tenants: Tenant definitions as in the tenants file
+        """
+        self.tenants: Dict[str, Tenant] = {}
+        self.anonymous: Optional[Tenant] = None
+        self._by_key: Dict[str, Tenant] = {}
+        for spec in tenants or []:
+            tenant = Tenant(spec["name"], spec.get("requests_per_minute"), spec.get("summaries_per_minute"),
+                            spec.get("burst"), bool(spec.get("cache_namespace", False)))
+            self.tenants[tenant.name] = tenant
+            if spec.get("anonymous"):
+                self.anonymous = tenant
+            for key in spec.get("keys", []):
+                digest = key[len("sha256:"):] if key.startswith("sha256:") else hash_key(key)
+                self._by_key[digest.lower()] = tenant
+
+    @classmethod
+    def from_file(cls, path: str) -> "TenantRegistry":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f).get("tenants", []))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.tenants)
+
+    def authenticate(self, headers: Mapping[str, str]) -> Optional[Tenant]:
+        """
+        Find the tenant for a request's API key
+
+        Args:
+            headers: Request headers
+
+        Returns:
+            The tenant, or None if the key is unknown (or missing with no
+            anonymous tenant)
+        """
+        api_key = headers.get("X-API-Key")
+        if not api_key:
+            authorization = headers.get("Authorization", "")
+            if authorization.startswith("Bearer "):
+                api_key = authorization[len("Bearer "):].strip()
+        if not api_key:
+            return self.anonymous
+        return self._by_key.get(hash_key(api_key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled,
+                "tenants": {name: tenant.stats() for name, tenant in self.tenants.items()}}
+
+
+registry = TenantRegistry.from_file(TENANTS_FILE) if TENANTS_FILE else TenantRegistry()
+
+# Tenant the running request is charged to (None without tenants)
+_current: ContextVar[Optional[Tenant]] = ContextVar("current_tenant", default=None)
+
+
+@contextmanager
+def acting_for(tenant: Optional[Tenant]) -> Iterator[None]:
+    """
+    Charge work done inside this block (such as the upstream calls of a
+    history summary) to a tenant
+
+    Args:
+        tenant: The request's tenant, or None
+    """
+    token = _current.set(tenant)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current() -> Optional[Tenant]:
+    """The tenant the running request is charged to, if any"""
+    return _current.get()
+
+
+def get_stats() -> Dict[str, Any]:
+    return registry.stats()
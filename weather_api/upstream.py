@@ -0,0 +1,854 @@
+"""
+Shared WeatherAPI.com client with response caching
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+from .cache import CacheEntry, TTLCache, next_version
+from .breaker import CircuitBreaker, CircuitOpenError
+from .bulk import BulkBatcher
+from .hedge import Hedger
+from .history_store import HistoryStore
+from . import geo, jsonstream, startup
+from .settings import settings
+
+WEATHERAPI_KEY = settings.get("WEATHERAPI_KEY")
+# Overridable so the client can be pointed at a local stub
+WEATHERAPI_BASE_URL = settings.get("WEATHERAPI_BASE_URL", "http://api.weatherapi.com/v1")
+
+# Per-request timeout (seconds) so a slow upstream cannot hold a worker
+WEATHERAPI_TIMEOUT_SECONDS = settings.get_float("WEATHERAPI_TIMEOUT_SECONDS", 5)
+# Kept-alive connections to WeatherAPI.com (match the busiest thread pool)
+WEATHERAPI_POOL_SIZE = settings.get_int("WEATHERAPI_POOL_SIZE", 32)
+
+# Cache TTLs (seconds) per endpoint. WeatherAPI.com refreshes current
+# conditions roughly every 15 minutes and forecasts hourly.
+CACHE_TTLS = {
+    "current.json": settings.get_int("WEATHER_CACHE_TTL_CURRENT", 600),
+    "forecast.json": settings.get_int("WEATHER_CACHE_TTL_FORECAST", 1800),
+    "history.json": settings.get_int("WEATHER_CACHE_TTL_HISTORY", 86400),
+    "search.json": settings.get_int("WEATHER_CACHE_TTL_SEARCH", 86400)
+}
+DEFAULT_CACHE_TTL = 600
+
+# Parts of large payloads the app actually uses; the rest (most of each
+# ~30-field hourly record) is dropped while decoding. Extend these when a
+# consumer starts reading a new field.
+_DAY_PROJECTION = {"date": True, "day": True, "astro": True}
+_HOUR_PROJECTION = {
+    "time": True, "temp_c": True, "condition": {"text": True}, "wind_kph": True,
+    "wind_dir": True, "precip_mm": True, "humidity": True,
+    "chance_of_rain": True, "chance_of_snow": True
+}
+PROJECTIONS = {
+    "forecast.json": {
+        "location": True,
+        "forecast": {"forecastday": [dict(_DAY_PROJECTION, hour=[_HOUR_PROJECTION])]},
+        "alerts": True,
+        "error": True
+    },
+    "history.json": {
+        "location": True,
+        "forecast": {"forecastday": [dict(_DAY_PROJECTION, hour=[_HOUR_PROJECTION])]},
+        "error": True
+    }
+}
+PROJECTION_ENABLED = settings.get_bool("WEATHERAPI_PROJECTION_ENABLED", True)
+# Decode projected payloads incrementally from the socket (needs ijson).
+# Cuts peak memory by more than half at several times the CPU cost.
+STREAM_DECODE = settings.get_bool("WEATHERAPI_STREAM_DECODE", False)
+
+# How long past expiry a value is served while it is revalidated in the
+# background, and how long past expiry it may be served if upstream fails
+STALE_WHILE_REVALIDATE_SECONDS = settings.get_float("WEATHER_CACHE_STALE_SECONDS", 300)
+STALE_IF_ERROR_SECONDS = settings.get_float("WEATHER_CACHE_STALE_IF_ERROR_SECONDS", 21600)
+
+# Route current-conditions lookups through WeatherAPI.com bulk requests
+# (q=bulk). Lookups arriving within the window share one upstream call.
+BULK_ENABLED = settings.get_bool("WEATHERAPI_BULK_ENABLED", False)
+BULK_WINDOW_SECONDS = settings.get_float("WEATHERAPI_BULK_WINDOW_MS", 20) / 1000
+BULK_MAX_LOCATIONS = settings.get_int("WEATHERAPI_BULK_MAX_LOCATIONS", 50)
+
+# Share cached weather between nearby locations. Names are resolved to
+# coordinates (search.json, cached for a week) and weather is cached per
+# geohash cell; a query reuses any cached cell anchored within the radius.
+GEO_CACHE_ENABLED = settings.get_bool("WEATHER_GEO_CACHE_ENABLED", True)
+GEO_CACHE_PRECISION = settings.get_int("WEATHER_GEO_CACHE_PRECISION", 5)
+GEO_CACHE_RADIUS_KM = settings.get_float("WEATHER_GEO_CACHE_RADIUS_KM", 10)
+GEO_ENDPOINTS = {"current.json", "forecast.json", "history.json"}
+LOCATION_CACHE_TTL = settings.get_int("LOCATION_CACHE_TTL", 7 * 86400)
+
+# Keep every history day and current observation in a local columnar store
+# (see history_store); past days are then answered from disk
+HISTORY_STORE_ENABLED = settings.get_bool("HISTORY_STORE_ENABLED", True)
+HISTORY_STORE_DIR = settings.get("HISTORY_STORE_DIR", os.path.join(tempfile.gettempdir(), "weather_history"))
+# Locations whose column files stay memory-mapped (each mapped column holds
+# a file descriptor)
+HISTORY_STORE_MAX_OPEN = settings.get_int("HISTORY_STORE_MAX_OPEN_LOCATIONS", 8)
+
+# Hedge slow GET requests: once a request has taken longer than this
+# percentile of its endpoint's recent latency, send an identical second
+# request and use whichever answers first. At most HEDGE_BUDGET of all
+# requests are hedged.
+HEDGE_ENABLED = settings.get_bool("WEATHERAPI_HEDGE_ENABLED", False)
+HEDGE_PERCENTILE = settings.get_float("WEATHERAPI_HEDGE_PERCENTILE", 95)
+HEDGE_BUDGET = settings.get_float("WEATHERAPI_HEDGE_BUDGET", 0.05)
+HEDGE_MIN_DELAY_SECONDS = settings.get_float("WEATHERAPI_HEDGE_MIN_DELAY_MS", 50) / 1000
+
+BREAKER_FAILURE_THRESHOLD = settings.get_int("BREAKER_FAILURE_THRESHOLD", 5)
+BREAKER_RESET_SECONDS = settings.get_float("BREAKER_RESET_SECONDS", 30)
+
+# Cache for raw upstream payloads, shared by the API and MCP providers
+weather_cache = TTLCache(max_entries=settings.get_int("WEATHER_CACHE_MAX_ENTRIES", 2048))
+
+# Resolved places ({name, region, country, lat, lon}) by normalized query;
+# an empty dict records a query that matched nothing
+location_cache = TTLCache(max_entries=settings.get_int("LOCATION_CACHE_MAX_ENTRIES", 8192))
+geo_index = geo.GeoIndex(GEO_CACHE_RADIUS_KM, max_cells=weather_cache.max_entries)
+
+# Observed weather by cache-key location ("geo:<cell>" or normalized name)
+observation_store = HistoryStore(HISTORY_STORE_DIR, HISTORY_STORE_MAX_OPEN)
+
+_stats_lock = threading.Lock()
+_upstream_calls: Dict[str, int] = {}
+_stale_served: Dict[str, int] = {}
+_geo_reused = 0
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+hedger = Hedger(HEDGE_PERCENTILE, HEDGE_BUDGET, HEDGE_MIN_DELAY_SECONDS)
+
+_revalidator = ThreadPoolExecutor(max_workers=4, thread_name_prefix="weather-revalidate")
+_revalidating: Set[Hashable] = set()
+_revalidating_lock = threading.Lock()
+
+# Called with (endpoint, cache-key location, payload) whenever data is stored
+_store_listeners: List[Callable[[str, str, Dict[str, Any]], None]] = []
+
+# Request-scoped record of cache lookups (see start_trace)
+_trace: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("upstream_trace", default=None)
+# Request-scoped switch to answer from cached data only (see cache_only)
+_cache_only: ContextVar[bool] = ContextVar("upstream_cache_only", default=False)
+# Request-scoped tenant cache in front of weather_cache (see cache_namespace)
+_namespace: ContextVar[Optional[TTLCache]] = ContextVar("upstream_cache_namespace", default=None)
+
+
+class CacheOnlyError(Exception):
+    """Raised instead of calling upstream while serving from cache only"""
+
+
+def normalize_location(location: Any) -> str:
+    """Normalize a location string for use in cache keys"""
+    return " ".join(str(location).lower().split())
+
+
+def cache_key(endpoint: str, location: str, params: Dict[str, Any]) -> Tuple[Hashable, ...]:
+    """Build the cache key for an upstream request"""
+    return (endpoint, normalize_location(location), tuple(sorted(params.items())))
+
+
+def resolve_location(location: str) -> Optional[Dict[str, Any]]:
+    """
+    Resolve a location query to a place with coordinates
+
+    Args:
+        location: Location name or "lat,lon"
+
+    Returns:
+        Dictionary with name, region, country, lat and lon (only lat and
+        lon for coordinate queries), or None if it can't be resolved
+    """
+    coordinates = geo.parse_coordinates(location)
+    if coordinates is not None:
+        return {"lat": coordinates[0], "lon": coordinates[1]}
+
+    name = normalize_location(location)
+    place = location_cache.get(name)
+    if place is None:
+        try:
+            results = cached_fetch("search.json", location)
+        except Exception as e:
+            print(f"Error resolving location '{location}': {e}")
+            return None
+        place = {}
+        if isinstance(results, list) and results:
+            place = {field: results[0].get(field) for field in ("name", "region", "country", "lat", "lon")}
+        location_cache.set(name, place, LOCATION_CACHE_TTL)
+    return place or None
+
+
+def resolve_key(endpoint: str, location: str,
+                params: Dict[str, Any]) -> Tuple[Tuple[Hashable, ...], str, Optional[Dict[str, Any]]]:
+    """
+    Work out the cache key and upstream query for a request
+
+    With the geo cache on, weather endpoints are keyed by geohash cell and
+    fetched for the cell's anchor coordinates, so nearby places share data.
+
+    Args:
+        endpoint: Endpoint name, e.g. "current.json"
+        location: Location query from the caller
+        params: Additional query parameters
+
+    Returns:
+        Tuple of (cache key, query to send as ``q``, resolved place or None)
+    """
+    global _geo_reused
+    if not GEO_CACHE_ENABLED or endpoint not in GEO_ENDPOINTS:
+        return cache_key(endpoint, location, params), location, None
+    place = resolve_location(location)
+    if place is None or place.get("lat") is None or place.get("lon") is None:
+        return cache_key(endpoint, location, params), location, None
+
+    cell = geo_index.nearest(place["lat"], place["lon"])
+    if cell is None:
+        cell = geo.encode(place["lat"], place["lon"], GEO_CACHE_PRECISION)
+        geo_index.add(cell, place["lat"], place["lon"])
+    anchor = geo_index.anchor(cell) or (place["lat"], place["lon"])
+    if anchor != (place["lat"], place["lon"]):
+        with _stats_lock:
+            _geo_reused += 1
+    query = f"{round(anchor[0], 4)},{round(anchor[1], 4)}"
+    return (endpoint, "geo:" + cell, tuple(sorted(params.items()))), query, place
+
+
+def geo_cell_for(location: str) -> Optional[str]:
+    """
+    Cache-key location of an already resolved query, without upstream calls
+
+    Args:
+        location: Location name
+
+    Returns:
+        "geo:<cell>" if the query resolves to an indexed cell, else None
+    """
+    place = location_cache.get(normalize_location(location))
+    if not place or place.get("lat") is None:
+        return None
+    cell = geo_index.nearest(place["lat"], place["lon"])
+    return "geo:" + cell if cell is not None else None
+
+
+def rebuild_geo_index() -> int:
+    """
+    Re-register the cells of geo-keyed cache entries (e.g. after a restore)
+
+    Returns:
+        Number of cells indexed
+    """
+    count = 0
+    for key, entry in weather_cache.entries(lambda key, entry: str(key[1]).startswith("geo:")):
+        anchor = geo.parse_coordinates(entry.meta.get("location", ""))
+        if anchor is not None:
+            geo_index.add(key[1][4:], anchor[0], anchor[1])
+            count += 1
+    return count
+
+
+def _unresolved(location: str) -> bool:
+    return geo.parse_coordinates(location) is None and location_cache.get(normalize_location(location)) is None
+
+
+def _remember_place(location: str, data: Any) -> None:
+    # A payload fetched by name carries the resolved place and coordinates
+    if isinstance(data, dict) and isinstance(data.get("location"), dict):
+        raw = data["location"]
+        place = {field: raw.get(field) for field in ("name", "region", "country", "lat", "lon")}
+        location_cache.set(normalize_location(location), place, LOCATION_CACHE_TTL)
+
+
+def _localize(data: Any, place: Optional[Dict[str, Any]]) -> Any:
+    # A cell's payload describes its anchor; report the place that was asked for
+    if place is None or not isinstance(data, dict) or not isinstance(data.get("location"), dict):
+        return data
+    overrides = {field: value for field, value in place.items() if value is not None}
+    return {**data, "location": {**data["location"], **overrides}}
+
+
+def start_trace() -> List[Dict[str, Any]]:
+    """
+    Start recording the cache lookups made by the current request
+
+    Each cached_fetch call in this context appends a record with the
+    endpoint, cache status ("hit", "miss" or "stale"), data version and
+    remaining TTL.
+
+    Returns:
+        The list that records will be appended to
+    """
+    trace: List[Dict[str, Any]] = []
+    _trace.set(trace)
+    return trace
+
+
+def stop_trace() -> None:
+    """Stop recording cache lookups for the current request"""
+    _trace.set(None)
+
+
+@contextmanager
+def cache_only() -> Iterator[None]:
+    """
+    Serve the current request from cached data only
+
+    Inside this block cache misses raise CacheOnlyError instead of calling
+    upstream, and expired entries are served (marked stale) for up to the
+    stale-if-error window. Used to shed load when the service is overloaded.
+    """
+    token = _cache_only.set(True)
+    try:
+        yield
+    finally:
+        _cache_only.reset(token)
+
+
+@contextmanager
+def cache_namespace(namespace: Optional[TTLCache]) -> Iterator[None]:
+    """
+    Look up weather data in a tenant's own cache first
+
+    The namespace reads through to the shared weather_cache and keeps what
+    it finds, and newly fetched data goes to both. A tenant's working set
+    then survives other tenants churning the shared cache.
+
+    Args:
+        namespace: The tenant's cache, or None to use only the shared cache
+    """
+    token = _namespace.set(namespace)
+    try:
+        yield
+    finally:
+        _namespace.reset(token)
+
+
+def namespace_id() -> Optional[int]:
+    """
+    Identity of the current cache namespace, for keys of anything built
+    from data read through it (None for the shared cache only)
+    """
+    namespace = _namespace.get()
+    return id(namespace) if namespace is not None else None
+
+
+def _lookup(key: Hashable) -> Optional[CacheEntry]:
+    namespace = _namespace.get()
+    if namespace is None:
+        return weather_cache.lookup(key)
+    entry = namespace.lookup(key)
+    if entry is None or not entry.is_fresh():
+        shared = weather_cache.lookup(key)
+        if shared is not None and (entry is None or shared.version > entry.version):
+            entry = namespace.put_entry(key, shared)
+    return entry
+
+
+def _peek_entry(key: Hashable) -> Optional[CacheEntry]:
+    namespace = _namespace.get()
+    entry = namespace.get_entry(key) if namespace is not None else None
+    shared = weather_cache.get_entry(key)
+    if entry is None or (shared is not None and shared.version > entry.version):
+        return shared
+    return entry
+
+
+def _record(key: Hashable, status: str, entry: Optional[CacheEntry]) -> None:
+    trace = _trace.get()
+    if trace is None:
+        return
+    trace.append({
+        "key": key,
+        "endpoint": key[0],
+        "status": status,
+        "version": entry.version if entry is not None else None,
+        "ttl_remaining": max(0, int(entry.ttl_remaining)) if entry is not None else 0
+    })
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    """Get the circuit breaker guarding an upstream endpoint"""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+            _breakers[endpoint] = breaker
+        return breaker
+
+
+def fetch_json(endpoint: str, params: Dict[str, Any]) -> Any:
+    """
+    Call a WeatherAPI.com endpoint and decode the JSON body
+
+    Args:
+        endpoint: Endpoint name, e.g. "current.json"
+        params: Query parameters (the API key is added automatically)
+
+    Returns:
+        Decoded JSON response
+
+    Raises:
+        CircuitOpenError: If the endpoint's circuit breaker is open
+        requests.RequestException: On network errors, timeouts or HTTP errors
+    """
+    return _request("GET", endpoint, params)
+
+
+def post_json(endpoint: str, params: Dict[str, Any], body: Dict[str, Any]) -> Any:
+    """
+    POST a JSON body to a WeatherAPI.com endpoint and decode the response
+
+    Args:
+        endpoint: Endpoint name, e.g. "current.json"
+        params: Query parameters (the API key is added automatically)
+        body: JSON request body
+
+    Returns:
+        Decoded JSON response
+
+    Raises:
+        CircuitOpenError: If the endpoint's circuit breaker is open
+        requests.RequestException: On network errors, timeouts or HTTP errors
+    """
+    return _request("POST", endpoint, params, body)
+
+
+_http = None
+_http_lock = threading.Lock()
+
+
+def http_session():
+    """
+    Shared HTTP session for WeatherAPI.com, created on first use
+
+    Reusing one session keeps connections to upstream alive between calls.
+    requests is imported here rather than at module load to keep startup fast.
+    """
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                _http = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=WEATHERAPI_POOL_SIZE)
+                _http.mount("http://", adapter)
+                _http.mount("https://", adapter)
+    return _http
+
+
+startup.add_prewarm("http_session", http_session)
+
+
+def _request(method: str, endpoint: str, params: Dict[str, Any],
+             body: Optional[Dict[str, Any]] = None) -> Any:
+    breaker = get_breaker(endpoint)
+    if not breaker.allow():
+        raise CircuitOpenError(f"WeatherAPI.com {endpoint}", breaker.retry_after())
+
+    if HEDGE_ENABLED and method == "GET":
+        # GETs are idempotent, so a slow one can safely be sent twice
+        return hedger.call(endpoint, lambda: _attempt(method, endpoint, params, body, breaker))
+    return _attempt(method, endpoint, params, body, breaker)
+
+
+def _attempt(method: str, endpoint: str, params: Dict[str, Any],
+             body: Optional[Dict[str, Any]], breaker: CircuitBreaker) -> Any:
+    projection = PROJECTIONS.get(endpoint) if PROJECTION_ENABLED and method == "GET" else None
+    stream = projection is not None and STREAM_DECODE and jsonstream.streaming_available()
+    with _stats_lock:
+        _upstream_calls[endpoint] = _upstream_calls.get(endpoint, 0) + 1
+    import requests  # already loaded by http_session()
+    try:
+        response = http_session().request(method, f"{WEATHERAPI_BASE_URL}/{endpoint}",
+                                          params={"key": WEATHERAPI_KEY, **params},
+                                          json=body,
+                                          timeout=WEATHERAPI_TIMEOUT_SECONDS,
+                                          stream=stream)
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+
+    with response:
+        # Client errors such as an unknown location mean upstream is healthy
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        response.raise_for_status()
+        if projection is None:
+            return response.json()
+        if stream:
+            # Decode straight from the socket, keeping only the projected fields
+            response.raw.decode_content = True
+            return jsonstream.parse(response.raw, projection)
+        return jsonstream.loads(response.content, projection)
+
+
+def _send_bulk_current(locations: List[Dict[str, str]], params: Dict[str, Any]) -> Any:
+    return post_json("current.json", {"q": "bulk", **params}, {"locations": locations})
+
+
+# Batches concurrent current-conditions lookups into bulk requests
+current_batcher = BulkBatcher(_send_bulk_current, BULK_WINDOW_SECONDS, BULK_MAX_LOCATIONS)
+
+
+def cached_fetch(endpoint: str, location: str, **params) -> Any:
+    """
+    Fetch an endpoint for a location, serving from the cache when fresh
+
+    Recently expired values are served immediately while a background
+    refresh runs, and older values are served if upstream is failing.
+    Stale values are marked with a ``stale`` entry holding their age.
+    Upstream error payloads are returned but never cached.
+
+    Args:
+        endpoint: Endpoint name, e.g. "forecast.json"
+        location: Location query passed as ``q``
+        **params: Additional query parameters
+
+    Returns:
+        Decoded JSON response
+
+    Raises:
+        CircuitOpenError: If the circuit is open and nothing is cached
+        requests.RequestException: On network or HTTP errors with nothing cached
+    """
+    key, query, place = resolve_key(endpoint, location, params)
+    return _localize(_cached_fetch(key, endpoint, query, params), place)
+
+
+def _cached_fetch(key: Tuple[Hashable, ...], endpoint: str, location: str, params: Dict[str, Any]) -> Any:
+    entry = _lookup(key)
+    if entry is not None and entry.is_fresh():
+        _record(key, "hit", entry)
+        return entry.value
+
+    breaker = get_breaker(endpoint)
+    if entry is not None and -entry.ttl_remaining <= STALE_WHILE_REVALIDATE_SECONDS:
+        _record(key, "stale", entry)
+        if breaker.is_open():
+            return _serve_stale(entry, "upstream_unavailable")
+        _revalidate_in_background(key, entry)
+        return _serve_stale(entry, "revalidating")
+
+    try:
+        data = _fetch_and_store(key, endpoint, location, params)
+    except Exception as e:
+        if entry is not None and -entry.ttl_remaining <= STALE_IF_ERROR_SECONDS:
+            _record(key, "stale", entry)
+            return _serve_stale(entry, "overloaded" if isinstance(e, CacheOnlyError) else "upstream_unavailable")
+        # The answer built around this failure must not be cached either
+        _record(key, "error", None)
+        raise
+    if isinstance(data, dict) and "error" in data:
+        _record(key, "error", None)
+    else:
+        _record(key, "miss", _peek_entry(key))
+    return data
+
+
+def cached_version(endpoint: str, location: str, **params) -> Optional[int]:
+    """
+    Get the data version of a cached response without fetching it
+
+    Args:
+        endpoint: Endpoint name, e.g. "forecast.json"
+        location: Location query passed as ``q``
+        **params: Additional query parameters
+
+    Returns:
+        The cached entry's version, or None if nothing is cached
+    """
+    entry = weather_cache.get_entry(resolve_key(endpoint, location, params)[0])
+    return entry.version if entry is not None else None
+
+
+def peek(endpoint: str, location: str, **params) -> Any:
+    """
+    Get cached data for a request without calling upstream
+
+    Used as a fallback when fetching takes too long. Expired data is
+    returned (marked stale) for up to the stale-if-error window.
+
+    Args:
+        endpoint: Endpoint name, e.g. "forecast.json"
+        location: Location query passed as ``q``
+        **params: Additional query parameters
+
+    Returns:
+        The cached payload, or None if nothing usable is cached
+    """
+    key = cache_key(endpoint, location, params)
+    place = None
+    if GEO_CACHE_ENABLED and endpoint in GEO_ENDPOINTS:
+        # Only already-resolved places; resolving would mean a search call
+        cell = geo_cell_for(location)
+        if cell is not None:
+            key = (endpoint, cell, tuple(sorted(params.items())))
+            place = location_cache.get(normalize_location(location))
+    entry = _peek_entry(key)
+    if entry is None or -entry.ttl_remaining > STALE_IF_ERROR_SECONDS:
+        return None
+    value = entry.value if entry.is_fresh() else _serve_stale(entry, "upstream_unavailable")
+    return _localize(value, place)
+
+
+def refresh(key: Hashable, entry: Optional[CacheEntry] = None) -> bool:
+    """
+    Re-fetch a cached entry from upstream using its recorded request
+
+    Args:
+        key: Cache key of an existing entry
+        entry: The entry, if it may no longer be in the shared cache (e.g.
+            one served from a tenant namespace)
+
+    Returns:
+        True if the entry was refreshed, False otherwise
+    """
+    if entry is None:
+        entry = weather_cache.get_entry(key)
+    if entry is None or "endpoint" not in entry.meta:
+        return False
+    meta = entry.meta
+    try:
+        data = _fetch_and_store(key, meta["endpoint"], meta["location"], meta["params"])
+    except Exception as e:
+        print(f"Error refreshing {meta['endpoint']} for {meta['location']}: {e}")
+        return False
+    return not (isinstance(data, dict) and "error" in data)
+
+
+def cached_fetch_many(endpoint: str, locations: List[str], **params) -> Dict[str, Any]:
+    """
+    Fetch an endpoint for many locations, batching cache misses
+
+    Current-conditions misses are sent as bulk requests when bulk mode is
+    enabled, so upstream calls grow with the number of batches rather than
+    the number of locations. Other endpoints are fetched one by one.
+
+    Args:
+        endpoint: Endpoint name, e.g. "current.json"
+        locations: Location queries
+        **params: Additional query parameters
+
+    Returns:
+        Mapping of each location to its payload, or to {"error": message}
+    """
+    results: Dict[str, Any] = {}
+    pending = {}
+    bulk = endpoint == "current.json" and BULK_ENABLED and not _cache_only.get()
+    for location in locations:
+        if bulk and GEO_CACHE_ENABLED and _unresolved(location):
+            # Resolve from the bulk payload itself rather than one search each
+            pending[location] = (None, location, None, None, current_batcher.submit(location, params))
+            continue
+        key, query, place = resolve_key(endpoint, location, params)
+        entry = _lookup(key)
+        if entry is not None and entry.is_fresh():
+            _record(key, "hit", entry)
+            results[location] = _localize(entry.value, place)
+        elif bulk:
+            pending[location] = (key, query, place, entry, current_batcher.submit(query, params))
+        else:
+            try:
+                results[location] = _localize(_cached_fetch(key, endpoint, query, params), place)
+            except Exception as e:
+                results[location] = {"error": str(e)}
+
+    for location, (key, query, place, entry, future) in pending.items():
+        try:
+            data = _bulk_result(future)
+            if key is None:
+                if "error" in data:
+                    results[location] = data
+                    continue
+                _remember_place(location, data)
+                key, _, place = resolve_key(endpoint, location, params)
+            data = _store(key, endpoint, query, params, data)
+            _record(key, "error" if "error" in data else "miss", _peek_entry(key))
+            results[location] = _localize(data, place)
+        except Exception as e:
+            if entry is not None and -entry.ttl_remaining <= STALE_IF_ERROR_SECONDS:
+                _record(key, "stale", entry)
+                results[location] = _localize(_serve_stale(entry, "upstream_unavailable"), place)
+            else:
+                results[location] = {"error": str(e)}
+    return results
+
+
+def refresh_many(keys: List[Hashable]) -> int:
+    """
+    Re-fetch several cached entries, batching current conditions in bulk
+
+    Args:
+        keys: Cache keys of existing entries
+
+    Returns:
+        Number of entries refreshed
+    """
+    if not BULK_ENABLED:
+        return sum(1 for key in keys if refresh(key))
+
+    refreshed = 0
+    pending = []
+    for key in keys:
+        entry = weather_cache.get_entry(key)
+        if entry is None or "endpoint" not in entry.meta:
+            continue
+        meta = entry.meta
+        if meta["endpoint"] != "current.json":
+            refreshed += refresh(key)
+            continue
+        pending.append((key, meta, current_batcher.submit(meta["location"], meta["params"])))
+
+    for key, meta, future in pending:
+        try:
+            data = _store(key, meta["endpoint"], meta["location"], meta["params"], _bulk_result(future))
+        except Exception as e:
+            print(f"Error refreshing {meta['endpoint']} for {meta['location']}: {e}")
+            continue
+        refreshed += "error" not in data
+    return refreshed
+
+
+def _fetch_and_store(key: Hashable, endpoint: str, location: str, params: Dict[str, Any]) -> Any:
+    if endpoint == "history.json" and HISTORY_STORE_ENABLED:
+        local = observation_store.get_day(str(key[1]), params.get("dt"))
+        if local is not None:
+            return _store(key, endpoint, location, params, local, observed=False)
+    if _cache_only.get():
+        raise CacheOnlyError(f"{endpoint} for '{location}' is not cached and the service is overloaded")
+    if endpoint == "current.json" and BULK_ENABLED:
+        data = _bulk_result(current_batcher.submit(location, params))
+    else:
+        data = fetch_json(endpoint, {"q": location, **params})
+    return _store(key, endpoint, location, params, data)
+
+
+def _bulk_result(future: Future) -> Any:
+    # Duplicate lookups share one future, and each cache entry is stamped
+    # with its own version, so hand every caller its own copy
+    return dict(future.result(timeout=WEATHERAPI_TIMEOUT_SECONDS + BULK_WINDOW_SECONDS))
+
+
+def _store(key: Hashable, endpoint: str, location: str, params: Dict[str, Any], data: Any,
+           observed: bool = True) -> Any:
+    if isinstance(data, dict) and "error" in data:
+        return data
+    if observed and HISTORY_STORE_ENABLED and isinstance(data, dict):
+        _record_observations(str(key[1]), endpoint, data)
+
+    meta = {"endpoint": endpoint, "location": location, "params": params}
+    version = next_version()
+    if isinstance(data, dict):
+        # Stamp the payload so formatted output can be memoized per version
+        data["data_version"] = version
+        if isinstance(data.get("location"), dict):
+            # Remember the resolved name so "nyc" and "New York" can be matched
+            meta["resolved"] = normalize_location(data["location"].get("name", location))
+    entry = weather_cache.set(key, data, CACHE_TTLS.get(endpoint, DEFAULT_CACHE_TTL), meta, version)
+    namespace = _namespace.get()
+    if namespace is not None:
+        namespace.put_entry(key, entry)
+    if isinstance(data, dict):
+        _notify_listeners(endpoint, str(key[1]), data)
+    return data
+
+
+def add_store_listener(fn: Callable[[str, str, Dict[str, Any]], None]) -> None:
+    """
+    Register a function to call with every newly fetched or refreshed payload
+
+    Args:
+        fn: Called as fn(endpoint, location_id, payload) on the storing
+            thread, where location_id is the cache-key location ("geo:<cell>"
+            or normalized name, see history_location_id). It should be quick
+            and must not modify the payload.
+    """
+    _store_listeners.append(fn)
+
+
+def _notify_listeners(endpoint: str, location_id: str, data: Dict[str, Any]) -> None:
+    for listener in _store_listeners:
+        # Listeners are extras; they must not fail the fetch
+        try:
+            listener(endpoint, location_id, data)
+        except Exception as e:
+            print(f"Store listener error for {endpoint} {location_id}: {e}")
+
+
+def _record_observations(location_id: str, endpoint: str, data: Dict[str, Any]) -> None:
+    # The store is a convenience; a full disk must not fail the request
+    try:
+        if endpoint == "history.json":
+            observation_store.record_history(location_id, data)
+        elif endpoint == "current.json":
+            observation_store.record_current(location_id, data)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error recording {endpoint} observations for {location_id}: {e}")
+
+
+def history_location_id(location: str) -> str:
+    """
+    Identifier the observation store files a location's history under
+
+    Args:
+        location: Location query
+
+    Returns:
+        The history.json cache-key location ("geo:<cell>" or normalized name)
+    """
+    return str(resolve_key("history.json", location, {})[0][1])
+
+
+def _serve_stale(entry: CacheEntry, reason: str) -> Any:
+    endpoint = entry.meta.get("endpoint", "unknown")
+    with _stats_lock:
+        _stale_served[endpoint] = _stale_served.get(endpoint, 0) + 1
+    if not isinstance(entry.value, dict):
+        return entry.value
+    return {**entry.value, "stale": {"age_seconds": int(entry.age), "reason": reason}}
+
+
+def _revalidate_in_background(key: Hashable, entry: CacheEntry) -> None:
+    with _revalidating_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    def run():
+        try:
+            refresh(key, entry)
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+
+    _revalidator.submit(run)
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        calls = dict(_upstream_calls)
+        stale = dict(_stale_served)
+        geo_reused = _geo_reused
+    with _breakers_lock:
+        breakers = {name: breaker.stats() for name, breaker in _breakers.items()}
+    return {
+        "calls": calls,
+        "total_calls": sum(calls.values()),
+        "stale_served": stale,
+        "breakers": breakers,
+        "bulk": {"enabled": BULK_ENABLED, **current_batcher.stats()},
+        "hedge": {"enabled": HEDGE_ENABLED, **hedger.stats()},
+        "geo": {
+            "enabled": GEO_CACHE_ENABLED,
+            "cells": len(geo_index),
+            "resolved_locations": location_cache.stats()["entries"],
+            "nearby_reuse": geo_reused
+        },
+        "history_store": {"enabled": HISTORY_STORE_ENABLED, **observation_store.stats()}
+    }
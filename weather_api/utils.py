@@ -1,35 +1,58 @@
 """
 Utility functions for the Weather API POC
 """
-import os
-import json
-import requests
-from dotenv import load_dotenv
-from typing import Dict, Any, Optional
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
+from .upstream import (
+    HISTORY_STORE_ENABLED,
+    cached_fetch,
+    cached_fetch_many,
+    history_location_id,
+    observation_store,
+    resolve_location
+)
+from . import formatting, tenants
+from .settings import settings
 
-# Load environment variables
-load_dotenv()
+# Longest range (days) a history summary may cover; each missing day costs
+# one upstream call the first time it is asked for
+HISTORY_SUMMARY_MAX_DAYS = settings.get_int("HISTORY_SUMMARY_MAX_DAYS", 31)
+# Missing days fetched at once, across all history summaries
+HISTORY_SUMMARY_FETCH_WORKERS = settings.get_int("HISTORY_SUMMARY_FETCH_WORKERS", 4)
+# Seconds a summary waits for missing days before answering without them
+HISTORY_SUMMARY_DEADLINE_SECONDS = settings.get_float("HISTORY_SUMMARY_DEADLINE_SECONDS", 10)
 
-# Get API key from environment variables
-WEATHERAPI_API_KEY = os.getenv("WEATHERAPI_KEY")
+_history_executor = ThreadPoolExecutor(max_workers=HISTORY_SUMMARY_FETCH_WORKERS, thread_name_prefix="history-fetch")
 
-# WeatherAPI.com API base URL
-WEATHERAPI_BASE_URL = "http://api.weatherapi.com/v1"
+# "(in) the past 10 days", "last week", "over the previous month"
+_HISTORY_RANGE = re.compile(
+    r"(?:\s(?:in|over|during|for))?(?:\s+the)?\s*\b(?:last|past|previous)\s+(?:(\d+)\s+days?|(week|month))\b"
+)
 
-def extract_weather_parameters(user_query: str) -> Dict[str, Any]:
+_NOW = re.compile(r"\b(?:now|today|currently|right now|at the moment)\b")
+
+def extract_weather_parameters(user_query: str, defaults: bool = True) -> Dict[str, Any]:
     """
     Extract weather parameters from user query using simple keyword matching.
     In a production environment, this would use an LLM for better extraction.
     
     Args:
         user_query: The user's natural language query
+        defaults: Fill in the default location and timeframe when the query
+            doesn't name them (off for follow-ups, see merge_followup_parameters)
         
     Returns:
         Dictionary containing extracted parameters
     """
     query = user_query.lower()
     params = {}
+    history_range = _HISTORY_RANGE.search(query)
+    if history_range:
+        # Keep "in the past 5 days" from being read as the location
+        query = query[:history_range.start()] + query[history_range.end():]
     
     # Extract location
     location_keywords = ["in", "at", "for", "of"]
@@ -42,7 +65,14 @@ def extract_weather_parameters(user_query: str) -> Dict[str, Any]:
                 break
     
     # Extract time frame
-    if "tomorrow" in query:
+    if history_range:
+        # "rain last month" / "past 10 days": summarize observed weather
+        params["timeframe"] = "historical"
+        if history_range.group(1):
+            params["history_days"] = max(1, min(int(history_range.group(1)), HISTORY_SUMMARY_MAX_DAYS))
+        else:
+            params["history_days"] = 7 if history_range.group(2) == "week" else 30
+    elif "tomorrow" in query:
         params["timeframe"] = "tomorrow"
     elif (
         "week" in query or
@@ -54,7 +84,7 @@ def extract_weather_parameters(user_query: str) -> Dict[str, Any]:
         params["timeframe"] = "week"
     elif "yesterday" in query or "past" in query or "historical" in query:
         params["timeframe"] = "historical"
-    else:
+    elif defaults or _NOW.search(query):
         params["timeframe"] = "current"
     
     # Extract specific weather parameters of interest
@@ -68,11 +98,38 @@ def extract_weather_parameters(user_query: str) -> Dict[str, Any]:
             params["specific_info"].append(aspect)
     
     # Default location if none found
-    if "location" not in params:
+    if "location" not in params and defaults:
         params["location"] = "New York"
         
     return params
 
+def merge_followup_parameters(previous: Dict[str, Any], user_query: str) -> Dict[str, Any]:
+    """
+    Extract parameters from a follow-up query, filling gaps from the last turn
+    
+    "And tomorrow?" keeps the previous location, "what about London?" keeps
+    the previous timeframe.
+    
+    Args:
+        previous: Parameters of the previous query in the conversation
+        user_query: The follow-up query
+        
+    Returns:
+        Dictionary containing the merged parameters
+    """
+    followup = extract_weather_parameters(user_query, defaults=False)
+    params = {
+        "location": followup.get("location", previous.get("location", "New York")),
+        "timeframe": followup.get("timeframe", previous.get("timeframe", "current"))
+    }
+    if "history_days" in followup:
+        params["history_days"] = followup["history_days"]
+    elif "timeframe" not in followup and "history_days" in previous:
+        params["history_days"] = previous["history_days"]
+    if "specific_info" in followup:
+        params["specific_info"] = followup["specific_info"]
+    return params
+
 def get_location_key(location: str) -> Dict[str, Any]:
     """
     Get location information for a given location name from WeatherAPI.com
@@ -86,17 +143,9 @@ def get_location_key(location: str) -> Dict[str, Any]:
         Dictionary with location name if found, error otherwise
     """
     try:
-        # Make a test call to validate location
-        params = {
-            "key": WEATHERAPI_API_KEY,
-            "q": location,
-            "aqi": "no"
-        }
-        
-        response = requests.get(f"{WEATHERAPI_BASE_URL}/current.json", params=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        # Make a test call to validate location. This is the same request
+        # as get_current_weather, so the follow-up fetch is a cache hit.
+        data = cached_fetch("current.json", location, aqi="no")
         if "error" in data:
             return {"error": f"Location '{location}' not found: {data['error']['message']}"}
         
@@ -120,17 +169,8 @@ def get_current_weather(location: str) -> Dict[str, Any]:
     Returns:
         Dictionary with current weather data
     """
-    params = {
-        "key": WEATHERAPI_API_KEY,
-        "q": location,
-        "aqi": "no"
-    }
-    
     try:
-        response = requests.get(f"{WEATHERAPI_BASE_URL}/current.json", params=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = cached_fetch("current.json", location, aqi="no")
         if "error" in data:
             return {"error": f"Error getting current weather: {data['error']['message']}"}
         
@@ -138,29 +178,37 @@ def get_current_weather(location: str) -> Dict[str, Any]:
     except Exception as e:
         return {"error": f"Error getting current weather: {e}"}
 
-def get_forecast(location: str) -> Dict[str, Any]:
+def get_current_weather_many(locations: List[str]) -> Dict[str, Dict[str, Any]]:
     """
-    Get 3-day forecast for a location
+    Get current weather conditions for several locations at once
+    
+    Args:
+        locations: Location names or coordinates
+        
+    Returns:
+        Dictionary mapping each location to its current weather data
+    """
+    results = {}
+    for location, data in cached_fetch_many("current.json", locations, aqi="no").items():
+        if "error" in data:
+            message = data["error"]["message"] if isinstance(data["error"], dict) else data["error"]
+            data = {"error": f"Error getting current weather: {message}"}
+        results[location] = data
+    return results
+
+def get_forecast(location: str, days: int = 3) -> Dict[str, Any]:
+    """
+    Get a multi-day forecast for a location
     
     Args:
         location: Location name or coordinates
+        days: Number of forecast days (1-14)
         
     Returns:
         Dictionary with forecast data
     """
-    params = {
-        "key": WEATHERAPI_API_KEY,
-        "q": location,
-        "days": 3,
-        "aqi": "no",
-        "alerts": "no"
-    }
-    
     try:
-        response = requests.get(f"{WEATHERAPI_BASE_URL}/forecast.json", params=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = cached_fetch("forecast.json", location, days=days, aqi="no", alerts="no")
         if "error" in data:
             return {"error": f"Error getting forecast: {data['error']['message']}"}
         
@@ -168,31 +216,24 @@ def get_forecast(location: str) -> Dict[str, Any]:
     except Exception as e:
         return {"error": f"Error getting forecast: {e}"}
 
-def get_historical_weather(location: str) -> Dict[str, Any]:
+def get_historical_weather(location: str, date_str: Optional[str] = None) -> Dict[str, Any]:
     """
-    Get historical weather data for a location (yesterday)
+    Get historical weather data for a location
     
     Args:
         location: Location name or coordinates
+        date_str: Date as YYYY-MM-DD (defaults to yesterday)
         
     Returns:
         Dictionary with historical weather data
     """
-    # Get yesterday's date
-    yesterday = datetime.now() - timedelta(days=1)
-    date_str = yesterday.strftime("%Y-%m-%d")
-    
-    params = {
-        "key": WEATHERAPI_API_KEY,
-        "q": location,
-        "dt": date_str
-    }
+    if date_str is None:
+        # Get yesterday's date
+        yesterday = datetime.now() - timedelta(days=1)
+        date_str = yesterday.strftime("%Y-%m-%d")
     
     try:
-        response = requests.get(f"{WEATHERAPI_BASE_URL}/history.json", params=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = cached_fetch("history.json", location, dt=date_str)
         if "error" in data:
             return {"error": f"Error getting historical weather: {data['error']['message']}"}
         
@@ -200,6 +241,81 @@ def get_historical_weather(location: str) -> Dict[str, Any]:
     except Exception as e:
         return {"error": f"Error getting historical weather: {e}"}
 
+def get_history_summary(location: str, start_date: Optional[str] = None,
+                        end_date: Optional[str] = None, days: int = 7) -> Dict[str, Any]:
+    """
+    Summarize observed weather over a range of past days
+
+    Days already in the local history store are read from disk; missing
+    days are fetched concurrently (which also stores them). Each fetched
+    day is charged to the current tenant as a request of its own. Days not
+    fetched by the deadline, or past the tenant's quota, are reported in
+    ``missing_days``.
+
+    Args:
+        location: Location name or coordinates
+        start_date: First date as YYYY-MM-DD (defaults to ``days`` before end_date)
+        end_date: Last date as YYYY-MM-DD (defaults to yesterday)
+        days: Range length when start_date isn't given
+
+    Returns:
+        Dictionary with the summary, the stored days and any missing dates
+    """
+    if not HISTORY_STORE_ENABLED:
+        return {"error": "Error getting history summary: the history store is disabled"}
+    try:
+        end = datetime.strptime(end_date, "%Y-%m-%d") if end_date else datetime.now() - timedelta(days=1)
+        start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else end - timedelta(days=days - 1)
+    except ValueError:
+        return {"error": "Error getting history summary: dates must be YYYY-MM-DD"}
+    if start > end:
+        return {"error": "Error getting history summary: start_date is after end_date"}
+    if (end - start).days + 1 > HISTORY_SUMMARY_MAX_DAYS:
+        return {"error": f"Error getting history summary: ranges are limited to {HISTORY_SUMMARY_MAX_DAYS} days"}
+    start_str, end_str = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+    try:
+        location_id = history_location_id(location)
+        _fetch_history_days(location, observation_store.missing_days(location_id, start_str, end_str))
+        summary = observation_store.summarize(location_id, start_str, end_str)
+        if summary is None:
+            return {"error": f"Error getting history summary: no observations for {location}"}
+        stored = observation_store.get_range(location_id, start_str, end_str)
+        missing = observation_store.missing_days(location_id, start_str, end_str)
+    except Exception as e:
+        return {"error": f"Error getting history summary: {e}"}
+
+    place = resolve_location(location) or {}
+    return {
+        "location": {**stored["location"], **{key: value for key, value in place.items() if value is not None}},
+        "start_date": start_str,
+        "end_date": end_str,
+        "summary": summary,
+        "missing_days": missing,
+        "forecast": stored["forecast"]
+    }
+
+def _fetch_history_days(location: str, days: List[str]) -> None:
+    """
+    Fetch missing history days on the shared pool until the summary deadline
+
+    Args:
+        location: Location name or coordinates
+        days: Dates (YYYY-MM-DD) to fetch
+    """
+    tenant = tenants.current()
+
+    def fetch(day: str) -> None:
+        if tenant is None or tenant.admit() is None:
+            get_historical_weather(location, day)
+
+    # Each task gets its own copy of the caller's context (cache namespace,
+    # cache-only mode)
+    futures = [_history_executor.submit(contextvars.copy_context().run, fetch, day) for day in days]
+    _, pending = wait(futures, timeout=HISTORY_SUMMARY_DEADLINE_SECONDS)
+    for future in pending:
+        future.cancel()  # Days already being fetched still get stored
+
 def format_current_weather_for_user(weather_data: Dict[str, Any], location_name: str) -> str:
     """
     Format current weather data into a user-friendly response
@@ -215,31 +331,11 @@ def format_current_weather_for_user(weather_data: Dict[str, Any], location_name:
         return f"Sorry, I couldn't get the weather information: {weather_data['error']}"
     
     try:
-        current = weather_data.get("current", {})
-        location = weather_data.get("location", {})
-        
-        condition = current.get("condition", {}).get("text", "Unknown conditions")
-        temp_f = current.get("temp_f", "N/A")
-        temp_c = current.get("temp_c", "N/A")
-        humidity = current.get("humidity", "N/A")
-        wind_mph = current.get("wind_mph", "N/A")
-        wind_kph = current.get("wind_kph", "N/A")
-        wind_dir = current.get("wind_dir", "N/A")
-        feels_like_f = current.get("feelslike_f", "N/A")
-        feels_like_c = current.get("feelslike_c", "N/A")
-        uv = current.get("uv", "N/A")
-        visibility_miles = current.get("vis_miles", "N/A")
-        
-        response = f"Current weather for {location_name}:\n"
-        response += f"• Condition: {condition}\n"
-        response += f"• Temperature: {temp_f}°F ({temp_c}°C)\n"
-        response += f"• Feels like: {feels_like_f}°F ({feels_like_c}°C)\n"
-        response += f"• Humidity: {humidity}%\n"
-        response += f"• Wind: {wind_mph} mph ({wind_kph} km/h) {wind_dir}\n"
-        response += f"• UV Index: {uv}\n"
-        response += f"• Visibility: {visibility_miles} miles\n"
-        
-        return response
+        return formatting.render(
+            ("api", "current", location_name),
+            weather_data,
+            lambda: formatting.render_api_current(weather_data, location_name)
+        )
     except Exception as e:
         return f"Error formatting weather data: {e}"
 
@@ -259,74 +355,11 @@ def format_forecast_for_user(forecast_data: Dict[str, Any], location_name: str,
         return f"Sorry, I couldn't get the forecast: {forecast_data['error']}"
     
     try:
-        forecast_days = forecast_data.get("forecast", {}).get("forecastday", [])
-        
-        if not forecast_days:
-            return f"No forecast data available for {location_name}"
-        
-        # If the user asked for tomorrow, only show the second day
-        if timeframe == "tomorrow" and len(forecast_days) > 1:
-            day = forecast_days[1]
-            date = day.get("date", "Unknown")
-            day_info = day.get("day", {})
-            astro = day.get("astro", {})
-            try:
-                date_obj = datetime.strptime(date, "%Y-%m-%d")
-                formatted_date = date_obj.strftime("%A, %B %d")
-            except:
-                formatted_date = date
-            condition = day_info.get("condition", {}).get("text", "Unknown")
-            max_temp_f = day_info.get("maxtemp_f", "N/A")
-            min_temp_f = day_info.get("mintemp_f", "N/A")
-            max_temp_c = day_info.get("maxtemp_c", "N/A")
-            min_temp_c = day_info.get("mintemp_c", "N/A")
-            avg_humidity = day_info.get("avghumidity", "N/A")
-            total_precip_mm = day_info.get("totalprecip_mm", "N/A")
-            total_precip_in = day_info.get("totalprecip_in", "N/A")
-            max_wind_mph = day_info.get("maxwind_mph", "N/A")
-            max_wind_kph = day_info.get("maxwind_kph", "N/A")
-            response = f"Tomorrow's forecast for {location_name} ({formatted_date}):\n"
-            response += f"• Condition: {condition}\n"
-            response += f"• High: {max_temp_f}°F ({max_temp_c}°C)\n"
-            response += f"• Low: {min_temp_f}°F ({min_temp_c}°C)\n"
-            response += f"• Humidity: {avg_humidity}%\n"
-            response += f"• Precipitation: {total_precip_in} in ({total_precip_mm} mm)\n"
-            response += f"• Max Wind: {max_wind_mph} mph ({max_wind_kph} km/h)\n"
-            response += f"• Sunrise: {astro.get('sunrise', 'N/A')}\n"
-            response += f"• Sunset: {astro.get('sunset', 'N/A')}\n"
-            return response.strip()
-        
-        # Otherwise, show all days
-        response = f"Weather forecast for {location_name}:\n\n"
-        for day in forecast_days:
-            date = day.get("date", "Unknown")
-            day_info = day.get("day", {})
-            astro = day.get("astro", {})
-            try:
-                date_obj = datetime.strptime(date, "%Y-%m-%d")
-                formatted_date = date_obj.strftime("%A, %B %d")
-            except:
-                formatted_date = date
-            condition = day_info.get("condition", {}).get("text", "Unknown")
-            max_temp_f = day_info.get("maxtemp_f", "N/A")
-            min_temp_f = day_info.get("mintemp_f", "N/A")
-            max_temp_c = day_info.get("maxtemp_c", "N/A")
-            min_temp_c = day_info.get("mintemp_c", "N/A")
-            avg_humidity = day_info.get("avghumidity", "N/A")
-            total_precip_mm = day_info.get("totalprecip_mm", "N/A")
-            total_precip_in = day_info.get("totalprecip_in", "N/A")
-            max_wind_mph = day_info.get("maxwind_mph", "N/A")
-            max_wind_kph = day_info.get("maxwind_kph", "N/A")
-            response += f"📅 {formatted_date}:\n"
-            response += f"   • {condition}\n"
-            response += f"   • High: {max_temp_f}°F ({max_temp_c}°C)\n"
-            response += f"   • Low: {min_temp_f}°F ({min_temp_c}°C)\n"
-            response += f"   • Humidity: {avg_humidity}%\n"
-            response += f"   • Precipitation: {total_precip_in} in ({total_precip_mm} mm)\n"
-            response += f"   • Max Wind: {max_wind_mph} mph ({max_wind_kph} km/h)\n"
-            response += f"   • Sunrise: {astro.get('sunrise', 'N/A')}\n"
-            response += f"   • Sunset: {astro.get('sunset', 'N/A')}\n\n"
-        return response.strip()
+        return formatting.render(
+            ("api", timeframe, location_name),
+            forecast_data,
+            lambda: formatting.render_api_forecast(forecast_data, location_name, timeframe)
+        )
     except Exception as e:
         return f"Error formatting forecast data: {e}"
 
@@ -345,41 +378,29 @@ def format_historical_for_user(historical_data: Dict[str, Any], location_name: s
         return f"Sorry, I couldn't get the historical weather: {historical_data['error']}"
     
     try:
-        forecast_day = historical_data.get("forecast", {}).get("forecastday", [])
-        
-        if not forecast_day:
-            return f"No historical data available for {location_name}"
-        
-        day_data = forecast_day[0]
-        day_info = day_data.get("day", {})
-        date = day_data.get("date", "Unknown")
-        
-        # Parse date for better formatting
-        try:
-            date_obj = datetime.strptime(date, "%Y-%m-%d")
-            formatted_date = date_obj.strftime("%A, %B %d, %Y")
-        except:
-            formatted_date = date
-        
-        condition = day_info.get("condition", {}).get("text", "Unknown")
-        max_temp_f = day_info.get("maxtemp_f", "N/A")
-        min_temp_f = day_info.get("mintemp_f", "N/A")
-        max_temp_c = day_info.get("maxtemp_c", "N/A")
-        min_temp_c = day_info.get("mintemp_c", "N/A")
-        avg_humidity = day_info.get("avghumidity", "N/A")
-        total_precip_mm = day_info.get("totalprecip_mm", "N/A")
-        total_precip_in = day_info.get("totalprecip_in", "N/A")
-        max_wind_mph = day_info.get("maxwind_mph", "N/A")
-        max_wind_kph = day_info.get("maxwind_kph", "N/A")
-        
-        response = f"Historical weather for {location_name} on {formatted_date}:\n\n"
-        response += f"• Condition: {condition}\n"
-        response += f"• High: {max_temp_f}°F ({max_temp_c}°C)\n"
-        response += f"• Low: {min_temp_f}°F ({min_temp_c}°C)\n"
-        response += f"• Average Humidity: {avg_humidity}%\n"
-        response += f"• Total Precipitation: {total_precip_in} in ({total_precip_mm} mm)\n"
-        response += f"• Max Wind: {max_wind_mph} mph ({max_wind_kph} km/h)\n"
-        
-        return response
+        return formatting.render(
+            ("api", "historical", location_name),
+            historical_data,
+            lambda: formatting.render_api_historical(historical_data, location_name)
+        )
     except Exception as e:
         return f"Error formatting historical data: {e}"
+
+def format_history_summary_for_user(summary_data: Dict[str, Any], location_name: str) -> str:
+    """
+    Format a history summary into a user-friendly response
+    
+    Args:
+        summary_data: Result of get_history_summary
+        location_name: Name of the location
+        
+    Returns:
+        Formatted string with the summarized weather
+    """
+    if "error" in summary_data:
+        return f"Sorry, I couldn't summarize the past weather: {summary_data['error']}"
+    
+    try:
+        return formatting.render_api_history_summary(summary_data, location_name)
+    except Exception as e:
+        return f"Error formatting history summary: {e}"